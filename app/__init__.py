@@ -1,44 +1,244 @@
+import calendar
+import os
+import sys
+import time
+import timeit
 import click
+import sqlite3
 
 from flask import Flask
 from config import Config
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 parking_lot = Flask(__name__)
 parking_lot.config.from_object(Config)
 db = SQLAlchemy(parking_lot)
 migrate = Migrate(parking_lot, db)
 
+def sqlite_pragmas(config):
+    """
+    The pragmas of the SQLite connections, those of SQLITE_PRAGMAS and of the SQLITE_DURABILITY level
+
+    Parameters:
+    config (Config): The configuration of the app
+
+    Returns:
+    list: (name, value) pairs, in the order they are applied. The busy timeout comes first, as the journal mode waits
+    for the other connections.
+    """
+    if config['SQLITE_DURABILITY'] not in config['SQLITE_DURABILITY_LEVELS']:
+        raise ValueError('Unknown SQLite durability level {}, not one of {}'.format(config['SQLITE_DURABILITY'], ', '.join(sorted(config['SQLITE_DURABILITY_LEVELS']))))
+    pragmas = dict(config['SQLITE_PRAGMAS'], **config['SQLITE_DURABILITY_LEVELS'][config['SQLITE_DURABILITY']])
+    return [('busy_timeout', config['SQLITE_BUSY_TIMEOUT'])] + sorted(pragmas.items(), key=lambda pragma: pragma[0] != 'journal_mode')
+
+# pysqlite begins transactions lazily and commits implicitly before a SAVEPOINT, which breaks nested transactions.
+# Let SQLAlchemy emit BEGIN itself instead.
+# Reference: https://docs.sqlalchemy.org/en/13/dialects/sqlite.html#serializable-isolation-savepoints-transactional-ddl
+@event.listens_for(Engine, 'connect')
+def sqlite_connect(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.isolation_level = None
+        for name, value in sqlite_pragmas(parking_lot.config):
+            dbapi_connection.execute('PRAGMA {} = {}'.format(name, value))
+
+@event.listens_for(Engine, 'begin')
+def sqlite_begin(connection):
+    if connection.dialect.name == 'sqlite':
+        # The 'sqlite_begin' execution option picks the transaction type, e.g. IMMEDIATE for writes
+        connection.execute('BEGIN {}'.format(connection.get_execution_options().get('sqlite_begin', 'DEFERRED')))
+
 from app import models, utils
+from app.api import api
+from app.daemon import remove_stale_socket, serve_daemon
+from app.gate_server import GateServer
+from app.instrumentation import instrumentation
+from app.server import serve
+from app.shards import SHARD_BATCH_SIZE, ShardPool
+from app.simulations import run_simulations, simulation_files, write_summary
+
+parking_lot.register_blueprint(api, url_prefix='/api')
+
+if parking_lot.config['INSTRUMENTATION']:
+    instrumentation.enable()
+
+def recover_memory_lot():
+    """
+    The memory parking lot starts empty: it is recovered from the journal, if there is one, so that the journaled
+    commands carry on from its state
+    """
+    if parking_lot.config['JOURNAL_PATH'] and parking_lot.config['STORAGE_BACKEND'] == 'memory':
+        utils.recover_parking_lot()
 
 @parking_lot.cli.command()
 @click.argument('file_path', required=False) # Input file, optional
-def run_parking_lot(file_path=None):
+@click.option('--batch-size', default=1, type=int, help='Number of file commands run in a single transaction')
+def run_parking_lot(file_path=None, batch_size=1):
     """
     Run the parking lot game
     """
 
     # TODO: This function can be better optimized
+    recover_memory_lot()
 
     # Read the file, if present and play the game
     if file_path:
         with open(file_path, 'rU') as input_file:
-            for command_input in input_file:
-                command_input = command_input.rstrip('\n').rstrip()
-                exit_status_or_message = utils.process_command_input(command_input)
-                if exit_status_or_message == 0: # Exit status
-                    return
-                else:
-                    print exit_status_or_message
+            utils.play_file(input_file, sys.stdout, batch_size)
     else: # play the game using console input
         command_input = raw_input().rstrip()
         while 1:
-            exit_status_or_message = utils.process_command_input(command_input)
-            if exit_status_or_message == 0: # Exit status
+            if utils.process_command_output(command_input, sys.stdout) == 0: # Exit status
                 return
-            else:
-                print exit_status_or_message
 
             # Read next line
             command_input = raw_input().rstrip()
+
+@parking_lot.cli.command()
+@click.option('--socket', 'socket_path', help='Path of the Unix socket, DAEMON_SOCKET by default')
+def run_parking_lot_daemon(socket_path=None):
+    """
+    Run the parking lot game as a resident daemon, on a Unix socket
+    """
+    socket_path = socket_path or parking_lot.config['DAEMON_SOCKET']
+    if not remove_stale_socket(socket_path):
+        raise click.UsageError('A daemon is already listening on {}'.format(socket_path))
+    recover_memory_lot()
+    serve_daemon(socket_path)
+
+@parking_lot.cli.command()
+@click.argument('file_path')
+@click.option('--workers', default=2, type=int, help='Number of worker processes, each running the lots of its shard')
+def run_sharded_parking_lot(file_path, workers=2):
+    """
+    Run the parking lot game from a file, the lots (`lot <lot_id> <command>`) sharded over worker processes
+    """
+    try:
+        pool = ShardPool(workers)
+    except ValueError as error:
+        raise click.UsageError(str(error))
+    try:
+        with open(file_path, 'rU') as input_file:
+            command_inputs = []
+            for command_input in input_file:
+                command_input = command_input.rstrip('\n').rstrip()
+                if command_input in ['exit', '']:
+                    break
+                command_inputs.append(command_input)
+                # Enough commands for a batch of every worker, their messages are printed in order
+                if len(command_inputs) >= SHARD_BATCH_SIZE*workers:
+                    sys.stdout.write(''.join('{}\n'.format(message) for message in pool.run_commands(command_inputs)))
+                    command_inputs = []
+            sys.stdout.write(''.join('{}\n'.format(message) for message in pool.run_commands(command_inputs)))
+    finally:
+        pool.close()
+
+@parking_lot.cli.command()
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--workers', default=2, type=int, help='Number of worker processes, each running a file at a time')
+@click.option('--output-dir', help='Directory of the outputs and of the summary, <directory>/results by default, not <directory> itself')
+@click.option('--database-dir', help='Directory of the temporary databases of the runs (e.g. /dev/shm), SIMULATION_DATABASE_DIR by default, in memory if not set')
+@click.option('--batch-size', default=1, type=int, help='Number of file commands run in a single transaction')
+def simulate(directory, workers=2, output_dir=None, database_dir=None, batch_size=1):
+    """
+    Run the parking lot game from every file of a directory, each file in a worker process against a new database
+    """
+    output_dir = output_dir or os.path.join(directory, 'results')
+    # The outputs and the summary would be run as input files by the next simulation of the directory
+    if os.path.realpath(output_dir) == os.path.realpath(directory):
+        raise click.UsageError('The output directory cannot be the directory of the input files')
+    file_paths = simulation_files(directory)
+    start = timeit.default_timer()
+    results = []
+    for result in run_simulations(file_paths, workers, database_dir or parking_lot.config['SIMULATION_DATABASE_DIR'], batch_size):
+        results.append(result)
+        sys.stdout.write('{:<40}{:>10} commands{:>10.3f} s{}\n'.format(os.path.basename(result['file']), result['commands'], result['seconds'],
+                                                                      '  ' + result['error'] if result['error'] else ''))
+    summary = write_summary(output_dir, results, workers, timeit.default_timer()-start)
+    sys.stdout.write('{files} files, {commands} commands in {wall_seconds:.3f} s on {workers} workers\n'.format(**summary))
+    sys.stdout.write('Outputs and summary in {}\n'.format(output_dir))
+    if summary['failed']:
+        raise click.ClickException('{} of the {} files failed'.format(summary['failed'], summary['files']))
+
+@parking_lot.cli.command()
+@click.option('--host', default='127.0.0.1', help='The interface to bind')
+@click.option('--port', default=5100, type=int, help='The port to bind')
+@click.option('--snapshot', 'snapshot_path', help='Snapshot answering the reads while the server starts, SNAPSHOT_PATH by default')
+def run_gate_server(host='127.0.0.1', port=5100, snapshot_path=None):
+    """
+    Run the parking lot game for the gates, on persistent TCP connections
+    """
+    GateServer(host, port, snapshot_path or parking_lot.config['SNAPSHOT_PATH']).serve_forever()
+
+@parking_lot.cli.command()
+@click.option('--chunk-size', default=10000, type=int, help='Number of parking ids moved per transaction')
+@click.option('--pause', default=0.0, type=float, help='Seconds to sleep between the chunks')
+def compact_parking_history(chunk_size=10000, pause=0.0):
+    """
+    Move the closed parkings to the parking history
+    """
+    print 'Moved {} parkings to the parking history'.format(utils.compact_parking_history(chunk_size, pause))
+
+@parking_lot.cli.command()
+@click.option('--lot', 'lot_id', default=models.DEFAULT_LOT_ID, type=int, help='The lot billed')
+@click.option('--since', type=click.DateTime(), help='Bill the parkings closed from this date (UTC)')
+@click.option('--until', type=click.DateTime(), help='Bill the parkings closed before this date (UTC)')
+@click.option('--chunk-size', default=200000, type=int, help='Number of parking ids read at a time')
+def billing_report(lot_id=models.DEFAULT_LOT_ID, since=None, until=None, chunk_size=200000):
+    """
+    Bill the closed parkings and report the dwell times and the hourly occupancy
+    """
+    # numpy is only imported by the report, the commands of the game start without it
+    from app import billing
+    report = billing.billing_report(billing.Tariff.from_config(parking_lot.config), lot_id, since and calendar.timegm(since.timetuple()),
+                                    until and calendar.timegm(until.timetuple()), chunk_size)
+    for line in report.report_lines():
+        print line
+
+@parking_lot.cli.command()
+@click.argument('snapshot_path', required=False)
+def snapshot_parking_lot(snapshot_path=None):
+    """
+    Write the parking lot to a snapshot file, SNAPSHOT_PATH by default
+    """
+    snapshot_path = snapshot_path or parking_lot.config['SNAPSHOT_PATH']
+    print 'Wrote {} parkings to {}'.format(utils.snapshot_parking_lot(snapshot_path), snapshot_path)
+
+@parking_lot.cli.command()
+@click.argument('snapshot_path', required=False)
+def restore_parking_lot(snapshot_path=None):
+    """
+    Replace the parking lot with a snapshot file, SNAPSHOT_PATH by default
+    """
+    snapshot_path = snapshot_path or parking_lot.config['SNAPSHOT_PATH']
+    print 'Restored {} parkings from {}'.format(utils.restore_parking_lot(snapshot_path), snapshot_path)
+    # The journaled commands before the restore no longer apply
+    utils.checkpoint_journal(force=True)
+
+@parking_lot.cli.command()
+def recover_parking_lot():
+    """
+    Recover the parking lot from the latest checkpoint of the journal and the commands journaled after it
+    """
+    if not parking_lot.config['JOURNAL_PATH']:
+        raise click.UsageError('The journal is disabled, set PARKING_LOT_JOURNAL')
+    start = time.time()
+    restored, replayed = utils.recover_parking_lot()
+    print 'Restored {} parkings and replayed {} commands in {:.3f}s'.format(restored, replayed, time.time()-start)
+
+@parking_lot.cli.command()
+@click.option('--host', default='127.0.0.1', help='The interface to bind')
+@click.option('--port', default=5000, type=int, help='The port to bind')
+@click.option('--processes', default=1, type=int, help='Number of worker processes, each handling requests in threads')
+def serve_parking_lot(host='127.0.0.1', port=5000, processes=1):
+    """
+    Serve the parking lot JSON API
+    """
+    if processes > 1 and parking_lot.config['STORAGE_BACKEND'] == 'memory':
+        raise click.UsageError('The memory storage backend cannot be shared by several processes')
+    if processes > 1 and parking_lot.config['JOURNAL_PATH']:
+        raise click.UsageError('The journal cannot be written by several processes')
+    recover_memory_lot()
+    serve(host, port, processes)
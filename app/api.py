@@ -0,0 +1,136 @@
+from flask import Blueprint, abort, jsonify, request, url_for
+
+from app import utils
+
+api = Blueprint('api', __name__)
+
+# Status pages are at most this long
+MAX_STATUS_PAGE_SIZE = 10000
+
+
+def error(status_code, message):
+    response = jsonify(error=message)
+    response.status_code = status_code
+    return response
+
+@api.errorhandler(400)
+def bad_request(exception):
+    return error(400, exception.description)
+
+@api.errorhandler(404)
+def not_found(exception):
+    return error(404, 'Not found')
+
+def json_field(name, field_type, minimum=None):
+    """
+    Field of the JSON request body
+
+    Parameters:
+    name (string): The field name
+    field_type (type): The expected type of the field
+    minimum (int): The least value of an integer field, any integer if None
+
+    Returns:
+    The field value, the request is aborted with 400 if the field is missing, of another type or below the minimum
+    """
+    value = (request.get_json(silent=True) or {}).get(name)
+    if field_type is int and isinstance(value, bool) or not isinstance(value, field_type):
+        abort(400, 'Field {} is required, as {}'.format(name, 'an integer' if field_type is int else 'a string'))
+    if minimum is not None and value < minimum:
+        abort(400, 'Field {} is required, as an integer of at least {}'.format(name, minimum))
+    return value
+
+# Every route is also served per lot, under /lots/<lot_id>. The routes without it are those of the default lot.
+
+@api.route('/parking_lot', methods=['POST'])
+@api.route('/lots/<int(min=1):lot_id>/parking_lot', methods=['POST'])
+def create_parking_lot(lot_id=utils.LOT_ID):
+    number_of_slots = json_field('slots', int, minimum=1)
+    return jsonify(slots=utils.create_parking_lot(number_of_slots, lot_id=lot_id)), 201
+
+@api.route('/parking_lot', methods=['PUT'])
+@api.route('/lots/<int(min=1):lot_id>/parking_lot', methods=['PUT'])
+def resize_parking_lot(lot_id=utils.LOT_ID):
+    number_of_slots = json_field('slots', int, minimum=1)
+    if utils.resize_parking_lot(number_of_slots, lot_id=lot_id) == -1:
+        return error(409, 'Sorry, slots beyond {} are occupied'.format(number_of_slots))
+    return jsonify(slots=number_of_slots)
+
+@api.route('/parkings', methods=['POST'])
+@api.route('/lots/<int(min=1):lot_id>/parkings', methods=['POST'])
+def park_vehicle(lot_id=utils.LOT_ID):
+    arguments = [json_field('registration_number', basestring), json_field('colour', basestring)]
+    # The entrance and the slot type are optional, positional arguments like those of the command (see app.utils.journaled)
+    body = request.get_json(silent=True) or {}
+    if 'entrance' in body:
+        arguments.append(json_field('entrance', basestring))
+        if 'slot_type' in body:
+            arguments.append(json_field('slot_type', basestring))
+    slot_id = utils.park_vehicle(*arguments, lot_id=lot_id)
+    if slot_id == -4:
+        return error(400, 'Sorry, {} is not a slot type'.format(arguments[3]))
+    elif slot_id == -3:
+        return error(404, 'Sorry, there is no entrance {}'.format(arguments[2]))
+    elif slot_id == -2:
+        return error(409, 'This is a repeated parking. Car already in parking.')
+    elif slot_id == -1:
+        return error(409, 'Sorry, parking lot is full')
+    return jsonify(slot_id=slot_id), 201
+
+@api.route('/slots/<int:slot_id>/parking', methods=['DELETE'])
+@api.route('/lots/<int(min=1):lot_id>/slots/<int:slot_id>/parking', methods=['DELETE'])
+def unpark_vehicle(slot_id, lot_id=utils.LOT_ID):
+    if not utils.unpark_vehicle(slot_id, lot_id=lot_id):
+        return error(404, 'The parking slot is inactive')
+    return jsonify(slot_id=slot_id)
+
+@api.route('/status')
+@api.route('/lots/<int(min=1):lot_id>/status')
+def parking_lot_status(lot_id=None):
+    """
+    A page of the status, ordered by slot number. The `next` URL continues after the last slot of the page, so
+    that pages stay consistent while vehicles come and go.
+    """
+    after_slot_id = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), MAX_STATUS_PAGE_SIZE)
+
+    parkings = list(utils.parking_lot_status(after_slot_id, limit, lot_id=lot_id or utils.LOT_ID))
+    next_url = url_for('.parking_lot_status', lot_id=lot_id, after=parkings[-1]['slot_id'], limit=limit) if len(parkings) == limit else None
+    return jsonify(parkings=parkings, next=next_url)
+
+@api.route('/colours/<colour>/registration_numbers')
+@api.route('/lots/<int(min=1):lot_id>/colours/<colour>/registration_numbers')
+def registration_numbers_for_cars_with_colour(colour, lot_id=utils.LOT_ID):
+    return jsonify(registration_numbers=utils.info_for_vehicles_with_colour(colour, 'registration_number', lot_id=lot_id))
+
+@api.route('/colours/<colour>/slots')
+@api.route('/lots/<int(min=1):lot_id>/colours/<colour>/slots')
+def slot_numbers_for_cars_with_colour(colour, lot_id=utils.LOT_ID):
+    return jsonify(slot_ids=utils.info_for_vehicles_with_colour(colour, 'slot_id', lot_id=lot_id))
+
+@api.route('/registration_numbers/<registration_number>/slot')
+@api.route('/lots/<int(min=1):lot_id>/registration_numbers/<registration_number>/slot')
+def slot_number_for_registration_number(registration_number, lot_id=utils.LOT_ID):
+    slot_id = utils.slot_number_for_registration_number(registration_number, lot_id=lot_id)
+    if slot_id == -1:
+        abort(404)
+    return jsonify(slot_id=slot_id)
+
+@api.route('/registration_numbers')
+@api.route('/lots/<int(min=1):lot_id>/registration_numbers')
+def search_registration(lot_id=utils.LOT_ID):
+    pattern = request.args.get('pattern')
+    if not pattern:
+        abort(400, 'Parameter pattern is required, e.g. KA-01-HH-*')
+    return jsonify(parkings=utils.search_registration_numbers(pattern, lot_id=lot_id))
+
+@api.route('/occupancy')
+@api.route('/lots/<int(min=1):lot_id>/occupancy')
+def occupancy(lot_id=utils.LOT_ID):
+    parked_vehicles, active_slots = utils.occupancy(lot_id=lot_id)
+    return jsonify(parked_vehicles=parked_vehicles, slots=active_slots)
+
+@api.route('/colours/<colour>/count')
+@api.route('/lots/<int(min=1):lot_id>/colours/<colour>/count')
+def count_cars_with_colour(colour, lot_id=utils.LOT_ID):
+    return jsonify(count=utils.count_vehicles_with_colour(colour, lot_id=lot_id))
@@ -0,0 +1,199 @@
+import time
+
+import numpy
+
+from app import db, models
+
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 24*SECONDS_PER_HOUR
+
+# Parking ids read at a time by the report, the memory taken by the report is bounded by the chunk
+REPORT_CHUNK_SIZE = 200000
+
+# Dwell times are counted by minute up to a week, the percentiles of longer ones are reported as a week
+DWELL_MINUTES = 7*24*60
+
+# Percentiles of the dwell times in the report
+DWELL_PERCENTILES = (50, 90, 99)
+
+
+class Tariff(object):
+    """
+    Fees of the parkings, in cents, by dwell time: free up to free_minutes, hourly_rate per started hour otherwise, at
+    most daily_maximum per started day
+    """
+
+    def __init__(self, free_minutes, hourly_rate, daily_maximum):
+        self.free_minutes = free_minutes
+        self.hourly_rate = hourly_rate
+        self.daily_maximum = daily_maximum
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['TARIFF_FREE_MINUTES'], config['TARIFF_HOURLY_RATE'], config['TARIFF_DAILY_MAXIMUM'])
+
+    def fees(self, dwell_times):
+        """
+        Parameters:
+        dwell_times (numpy.ndarray): Dwell times in seconds
+
+        Returns:
+        numpy.ndarray: The fee of every dwell time, in cents
+        """
+        days, rest = numpy.divmod(dwell_times, SECONDS_PER_DAY)
+        hours = -(-rest//SECONDS_PER_HOUR)  # Started hours
+        fees = days*self.daily_maximum + numpy.minimum(hours*self.hourly_rate, self.daily_maximum)
+        fees[dwell_times <= self.free_minutes*60] = 0
+        return fees
+
+
+def closed_parking_times(lot_id=models.DEFAULT_LOT_ID, since=None, until=None, chunk_size=REPORT_CHUNK_SIZE):
+    """
+    Entry and exit times of the closed parkings, compacted (parking_history) or not (parking), read in chunks of
+    parking ids. Every column of a chunk is read as a single comma separated string (SQLite's group_concat) and parsed
+    by numpy, there is no row object.
+
+    Parameters:
+    lot_id (int): The lot
+    since (int): The earliest exit time, in seconds since the epoch, None for no limit
+    until (int): The exit time the parkings left before, None for no limit
+    chunk_size (int): The number of parking ids per chunk
+
+    Returns:
+    generator: (entry times, exit times) pairs of numpy.ndarray, by chunk. The parkings without times, closed before
+    they were recorded, are left out.
+    """
+    for table, closed in [(models.ParkingHistory.__table__, True), (models.Parking.__table__, models.Parking.__table__.c.active==False)]:
+        conditions = [closed, table.c.lot_id==lot_id, table.c.entered_at.isnot(None), table.c.exited_at.isnot(None)]
+        if since is not None:
+            conditions.append(table.c.exited_at >= since)
+        if until is not None:
+            conditions.append(table.c.exited_at < until)
+
+        first_id, last_id = db.session.query(db.func.min(table.c.id), db.func.max(table.c.id)).one()
+        for chunk_start in xrange(first_id or 0, (last_id or 0)+1, chunk_size):
+            chunk = db.and_(table.c.id >= chunk_start, table.c.id < chunk_start+chunk_size, *conditions)
+            entered_at, exited_at = db.session.execute(db.select([db.func.group_concat(table.c.entered_at), db.func.group_concat(table.c.exited_at)]).where(chunk)).first()
+            if entered_at:
+                yield numpy.fromstring(entered_at, numpy.int64, sep=','), numpy.fromstring(exited_at, numpy.int64, sep=',')
+
+
+class BillingReport(object):
+    """
+    Fees, dwell times and hourly occupancy of closed parkings, added a chunk at a time with vectorised operations.
+    Only counts are kept: the dwell times by minute, and the vehicles arriving and leaving by hour.
+    """
+
+    def __init__(self, tariff):
+        self.tariff = tariff
+        self.parkings = 0
+        self.revenue = 0
+        self.longest_dwell_time = 0
+        self.dwell_minutes = numpy.zeros(DWELL_MINUTES+1, numpy.int64)
+        # Occupancy by hour from first_hour (hours since the epoch): the vehicles parked from the start of the hour on
+        # are the cumulative sum of the arrivals minus the departures, corrected by the seconds of the hour before
+        # they arrived or after they left
+        self.first_hour = None
+        self.arrivals = numpy.zeros(0, numpy.int64)
+        self.partial_seconds = numpy.zeros(0, numpy.int64)
+
+    def add(self, entered_at, exited_at):
+        """
+        Adds closed parkings
+
+        Parameters:
+        entered_at (numpy.ndarray): Entry times of the parkings, in seconds since the epoch
+        exited_at (numpy.ndarray): Exit times of the parkings
+        """
+        if not len(entered_at):
+            return
+        exited_at = numpy.maximum(exited_at, entered_at)
+        dwell_times = exited_at - entered_at
+        self.parkings += len(dwell_times)
+        self.revenue += int(self.tariff.fees(dwell_times).sum())
+        self.longest_dwell_time = max(self.longest_dwell_time, int(dwell_times.max()))
+        self.dwell_minutes += numpy.bincount(numpy.minimum(dwell_times//60, DWELL_MINUTES), minlength=DWELL_MINUTES+1)
+
+        self._extend(int(entered_at.min())//SECONDS_PER_HOUR, int(exited_at.max())//SECONDS_PER_HOUR + 2)
+        for times, sign in [(entered_at, 1), (exited_at, -1)]:
+            hours = times//SECONDS_PER_HOUR
+            indexes = hours - self.first_hour
+            self.arrivals += sign*numpy.bincount(indexes+1, minlength=len(self.arrivals))
+            self.partial_seconds += sign*numpy.bincount(indexes, (hours+1)*SECONDS_PER_HOUR - times, len(self.partial_seconds)).astype(numpy.int64)
+
+    def _extend(self, first_hour, end_hour):
+        # Hours from first_hour to end_hour (excluded) are counted
+        if self.first_hour is None:
+            self.first_hour = first_hour
+        before = max(self.first_hour-first_hour, 0)
+        after = max(end_hour-self.first_hour-len(self.arrivals), 0)
+        if before or after:
+            self.arrivals = numpy.pad(self.arrivals, (before, after), 'constant')
+            self.partial_seconds = numpy.pad(self.partial_seconds, (before, after), 'constant')
+            self.first_hour -= before
+
+    def dwell_time_percentile(self, percentile):
+        """
+        Returns:
+        int: The dwell time in minutes that the percentile of the parkings stayed at most, None without parkings
+        """
+        if not self.parkings:
+            return None
+        return int(numpy.searchsorted(numpy.cumsum(self.dwell_minutes), self.parkings*percentile/100.0))
+
+    def hourly_occupancy(self):
+        """
+        Returns:
+        tuple: The first hour, in hours since the epoch, and the mean number of vehicles parked in every hour from it
+        """
+        return self.first_hour, (numpy.cumsum(self.arrivals)*SECONDS_PER_HOUR + self.partial_seconds)[:-1]/float(SECONDS_PER_HOUR)
+
+    def report_lines(self):
+        """
+        Returns:
+        generator: The lines of the report
+        """
+        yield 'Parkings: {}'.format(self.parkings)
+        yield 'Revenue: {}'.format(format_amount(self.revenue))
+        if not self.parkings:
+            return
+        yield 'Mean fee: {}'.format(format_amount(self.revenue//self.parkings))
+        for percentile in DWELL_PERCENTILES:
+            yield 'Dwell time p{}: {}'.format(percentile, format_duration(self.dwell_time_percentile(percentile)*60))
+        yield 'Longest dwell time: {}'.format(format_duration(self.longest_dwell_time))
+
+        first_hour, occupancy = self.hourly_occupancy()
+        hours_of_day = (numpy.arange(len(occupancy)) + first_hour) % 24
+        mean_occupancy = numpy.bincount(hours_of_day, occupancy, 24)/numpy.maximum(numpy.bincount(hours_of_day, minlength=24), 1)
+        yield 'Mean occupancy by hour of day (UTC):'
+        for hour_of_day, vehicles in enumerate(mean_occupancy):
+            yield '{:02d}:00 {:.1f}'.format(hour_of_day, vehicles)
+        peak = int(numpy.argmax(occupancy))
+        yield 'Peak hour: {} UTC, {:.1f} vehicles'.format(time.strftime('%Y-%m-%d %H:00', time.gmtime((first_hour+peak)*SECONDS_PER_HOUR)), occupancy[peak])
+
+
+def format_amount(cents):
+    return '{}.{:02d}'.format(cents//100, cents % 100)
+
+def format_duration(seconds):
+    return '{}h{:02d}m'.format(seconds//SECONDS_PER_HOUR, seconds % SECONDS_PER_HOUR//60)
+
+def billing_report(tariff, lot_id=models.DEFAULT_LOT_ID, since=None, until=None, chunk_size=REPORT_CHUNK_SIZE):
+    """
+    Bills the closed parkings of a lot
+
+    Parameters:
+    tariff (Tariff): The tariff
+    lot_id (int): The lot
+    since (int): The earliest exit time, in seconds since the epoch, None for no limit
+    until (int): The exit time the parkings left before, None for no limit
+    chunk_size (int): The number of parking ids read at a time
+
+    Returns:
+    BillingReport: The report
+    """
+    report = BillingReport(tariff)
+    for entered_at, exited_at in closed_parking_times(lot_id, since, until, chunk_size):
+        report.add(entered_at, exited_at)
+    db.session.commit()
+    return report
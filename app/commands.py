@@ -0,0 +1,164 @@
+class CommandError(ValueError):
+    """
+    Invalid command input: an unknown command, or missing or malformed arguments
+    """
+
+
+class Command(object):
+    """
+    Command of the parking lot game
+
+    Attributes:
+    name (string): The name the command is given by
+    handler (function): Called with the parsed arguments
+    arguments (tuple): (name, type) pairs of the arguments, the type converting the argument string
+    optional_arguments (tuple): (name, type) pairs of the arguments which can be left out, after the others. The
+        handler is called without them, with its defaults.
+    formatter (function): Called with the result of the handler and the arguments, returns the message or, for
+        streamed commands, the lines of the message
+    writes (bool): Whether the command changes the parking lot
+    streamed (bool): Whether the message is written line by line, as the formatter yields them
+    lot_scoped (bool): Whether the command can be scoped to a lot (see LOT_PREFIX), the handler is then called with
+        the lot_id keyword argument
+    """
+
+    def __init__(self, name, handler, arguments=(), formatter=None, writes=False, streamed=False, lot_scoped=False, optional_arguments=()):
+        self.name = name
+        self.handler = handler
+        self.arguments = tuple(arguments) + tuple(optional_arguments)
+        self.required_arguments = len(arguments)
+        self.formatter = formatter or (lambda result, *arguments: '{}'.format(result))
+        self.writes = writes
+        self.streamed = streamed
+        self.lot_scoped = lot_scoped
+        self.usage = 'Usage: {}'.format(' '.join([name] + ['<{}>'.format(argument_name) for argument_name, _ in self.arguments[:self.required_arguments]] +
+                                                  ['[<{}>]'.format(argument_name) for argument_name, _ in self.arguments[self.required_arguments:]]))
+        # String arguments need no conversion, the most common case
+        self.converters = [argument_type for _, argument_type in self.arguments]
+        self.converts = any(argument_type is not str for argument_type in self.converters)
+
+    def parse(self, argument_strings):
+        """
+        Converts the argument strings to the declared types
+
+        Parameters:
+        argument_strings (list): The arguments of the command input
+
+        Returns:
+        list: The arguments given
+        """
+        if not self.required_arguments <= len(argument_strings) <= len(self.converters):
+            raise CommandError('Invalid Command. {}'.format(self.usage))
+        if not self.converts:
+            return argument_strings
+        try:
+            return [convert(argument_string) for convert, argument_string in zip(self.converters, argument_strings)]
+        except ValueError:
+            for (argument_name, argument_type), argument_string in zip(self.arguments, argument_strings):
+                try:
+                    argument_type(argument_string)
+                except ValueError:
+                    raise CommandError('Invalid Command. {} is not a valid {}'.format(argument_string, argument_name))
+            raise
+
+
+# The commands of the game, by name
+commands = {}
+
+# Prefix running a command on another lot than the default one: `lot <lot_id> <command> <arguments>`
+LOT_PREFIX = 'lot'
+
+def register_command(name, handler, arguments=(), formatter=None, writes=False, streamed=False, lot_scoped=False, optional_arguments=()):
+    """
+    Registers a command of the game, or replaces the one with the same name
+
+    Parameters:
+    name (string): The name the command is given by
+    handler (function): Called with the parsed arguments
+    arguments (iterable): (name, type) pairs of the arguments
+    formatter (function): Called with the result of the handler and the arguments, returns the message
+    writes (bool): Whether the command changes the parking lot
+    streamed (bool): Whether the formatter returns the lines of the message, to be written one by one
+    lot_scoped (bool): Whether the handler takes the lot_id keyword argument, for the commands given with LOT_PREFIX
+    optional_arguments (iterable): (name, type) pairs of the arguments which can be left out, after the others
+
+    Returns:
+    Command: The registered command
+    """
+    commands[name] = Command(name, handler, arguments, formatter, writes, streamed, lot_scoped, optional_arguments)
+    return commands[name]
+
+def split_lot_prefix(command_inputs):
+    """
+    Splits the lot prefix off a command input
+
+    Parameters:
+    command_inputs (list): The words of the command input
+
+    Returns:
+    tuple: The lot id (None without the prefix) and the words of the command, CommandError is raised for an invalid
+    lot id
+    """
+    if not command_inputs or command_inputs[0] != LOT_PREFIX:
+        return None, command_inputs
+    if len(command_inputs) < 3:
+        raise CommandError('Invalid Command. Usage: {} <lot_id> <command>'.format(LOT_PREFIX))
+    try:
+        lot_id = int(command_inputs[1])
+    except ValueError:
+        lot_id = 0
+    if lot_id < 1:
+        raise CommandError('Invalid Command. {} is not a valid lot_id'.format(command_inputs[1]))
+    return lot_id, command_inputs[2:]
+
+def find_command(command_input):
+    """
+    The command of a command input, without parsing its arguments
+
+    Parameters:
+    command_input (string): The command given in the parking lot game
+
+    Returns:
+    Command: The command, None if it is invalid
+    """
+    command_inputs = command_input.split()
+    if command_inputs and command_inputs[0] == LOT_PREFIX:
+        command_inputs = command_inputs[2:]
+    return commands.get(command_inputs[0]) if command_inputs else None
+
+def parse_command_input(command_input):
+    """
+    Parses a command input, once for its dispatch and its arguments
+
+    Parameters:
+    command_input (string): The command given in the parking lot game
+
+    Returns:
+    tuple: The command, its parsed arguments and its keyword arguments (the lot_id of a command given with
+    LOT_PREFIX), CommandError is raised for an invalid command
+    """
+    lot_id, command_inputs = split_lot_prefix(command_input.split())
+    command = commands.get(command_inputs[0]) if command_inputs else None
+    if command is None:
+        raise CommandError('Invalid Command')
+    if lot_id is None:
+        return command, command.parse(command_inputs[1:]), {}
+    if not command.lot_scoped:
+        raise CommandError('Invalid Command. {} is not run per lot'.format(command.name))
+    return command, command.parse(command_inputs[1:]), dict(lot_id=lot_id)
+
+def run_command_input(command_input):
+    """
+    Parses and runs a command
+
+    Parameters:
+    command_input (string): The command given in the parking lot game
+
+    Returns:
+    tuple: The command (None if it is invalid) and its message, the lines of the message for streamed commands
+    """
+    try:
+        command, arguments, keyword_arguments = parse_command_input(command_input)
+    except CommandError as error:
+        return None, str(error)
+    return command, command.formatter(command.handler(*arguments, **keyword_arguments), *arguments)
@@ -0,0 +1,75 @@
+import errno
+import os
+import signal
+import socket
+import SocketServer
+import sys
+
+from app import db, utils
+
+# Marks the end of the reply of a command. Replies have no empty lines, so a client can tell where one ends while
+# the connection stays open.
+END_OF_REPLY = '\n'
+
+
+class LineProtocolHandler(SocketServer.StreamRequestHandler):
+    """
+    Plays the parking lot game over a connection: a command per line, the reply of every command followed by an
+    empty line. The connection is closed on `exit` (or an empty command), like the game ends.
+    """
+
+    def handle(self):
+        try:
+            for command_input in iter(self.rfile.readline, ''):
+                command_input = command_input.rstrip('\n').rstrip()
+                if utils.process_command_output(command_input, self.wfile) == 0: # Exit status
+                    return
+                self.wfile.write(END_OF_REPLY)
+                self.wfile.flush()
+        finally:
+            db.session.remove()
+
+
+class ParkingLotDaemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def remove_stale_socket(socket_path):
+    """
+    Removes the socket file left by a daemon which is no longer running
+
+    Parameters:
+    socket_path (string): The path of the Unix socket
+
+    Returns:
+    bool: False if a daemon is listening on the socket
+    """
+    if not os.path.exists(socket_path):
+        return True
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except socket.error as error:
+        if error.errno != errno.ECONNREFUSED:
+            raise
+        os.unlink(socket_path)
+        return True
+    finally:
+        probe.close()
+    return False
+
+def serve_daemon(socket_path):
+    """
+    Serves the game on a Unix socket until interrupted, a thread per connection
+
+    Parameters:
+    socket_path (string): The path of the Unix socket
+    """
+    daemon = ParkingLotDaemon(socket_path, LineProtocolHandler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # Removes the socket on kill too
+    try:
+        daemon.serve_forever()
+    finally:
+        daemon.server_close()
+        os.unlink(socket_path)
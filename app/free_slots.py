@@ -0,0 +1,306 @@
+import bisect
+import heapq
+
+# Stale heap entries tolerated on top of the live ones, before a queue is rebuilt (see FreeSlotIndex.push)
+COMPACTION_SLACK = 64
+
+
+def slot_id_ranges(slot_ids):
+    """
+    The ranges of consecutive slot ids
+
+    Parameters:
+    slot_ids (iterable): The slot ids, sorted
+
+    Returns:
+    generator: (first, last) ranges, in order
+    """
+    first = last = None
+    for slot_id in slot_ids:
+        if last is not None and slot_id != last+1:
+            yield first, last
+            first = None
+        if first is None:
+            first = slot_id
+        last = slot_id
+    if first is not None:
+        yield first, last
+
+
+class SlotRanges(object):
+    """
+    Disjoint ranges of slot ids, e.g. the inactive slots, sorted by their first slot id
+
+    A slot is looked up with a bisection, and a range of any length is added or removed at the cost of the ranges it
+    overlaps, not of its slots.
+    """
+
+    def __init__(self, ranges=()):
+        self._firsts = []
+        self._lasts = []
+        self._length = 0
+        for first, last in ranges:
+            self.add(first, last)
+
+    def find(self, slot_id):
+        """
+        Returns:
+        tuple: The (first, last) range of the slot, None if the slot is in none
+        """
+        index = bisect.bisect_right(self._firsts, slot_id)-1
+        if index >= 0 and self._lasts[index] >= slot_id:
+            return self._firsts[index], self._lasts[index]
+        return None
+
+    def __contains__(self, slot_id):
+        return self.find(slot_id) is not None
+
+    def __len__(self):
+        # The number of slots in the ranges
+        return self._length
+
+    def __iter__(self):
+        return iter(zip(self._firsts, self._lasts))
+
+    def _overlapping(self, first, last):
+        # The indexes of the ranges from the first one ending at or after first to the last one starting at or before last
+        return bisect.bisect_left(self._lasts, first), bisect.bisect_right(self._firsts, last)
+
+    def _replace(self, start, end, ranges):
+        self._length += sum(last-first+1 for first, last in ranges) - sum(last-first+1 for first, last in zip(self._firsts[start:end], self._lasts[start:end]))
+        self._firsts[start:end] = [first for first, _ in ranges]
+        self._lasts[start:end] = [last for _, last in ranges]
+
+    def add(self, first, last):
+        """
+        Adds the slots from first to last (inclusive), merged with the ranges they overlap or are next to
+        """
+        start, end = self._overlapping(first-1, last+1)
+        if start < end:
+            first, last = min(first, self._firsts[start]), max(last, self._lasts[end-1])
+        self._replace(start, end, [(first, last)])
+
+    def remove(self, first, last):
+        """
+        Removes the slots from first to last (inclusive), the ranges overlapping them are cut
+        """
+        start, end = self._overlapping(first, last)
+        if start < end:
+            ranges = [(self._firsts[start], first-1), (last+1, self._lasts[end-1])]
+            self._replace(start, end, [(range_first, range_last) for range_first, range_last in ranges if range_first <= range_last])
+
+
+class FreeSlotIndex(object):
+    """
+    Free slots of the parking lot, for "nearest free and active slot" (the lowest numbered one)
+
+    The free slots are counted in a Fenwick tree (binary indexed tree) over the slot ids, which finds the first free
+    slot after any slot id in O(log n). The inactive slots are ranges (see SlotRanges), which the search jumps over a
+    range at a time: slots are (de)activated by ranges of any length at the cost of a bisection, their free slots are
+    neither scanned nor moved. The set of free slots, active or not, is the source of truth.
+
+    Queues of the free slots ordered by another distance than the slot number, e.g. from an entrance, can be added
+    (see load_queue). They share the set of free slots: a slot taken from any of them is skipped by the others.
+
+    The index records the generation of the parking lot it reflects, so that it can be dropped when another process
+    sharing the database changed the parking lot.
+    """
+
+    def __init__(self):
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Drops the index, it needs to be loaded again before use
+        """
+        self._tree = None
+        self._free = None
+        self._queues = {}
+        self.inactive = SlotRanges()
+        self.generation = None
+
+    @property
+    def loaded(self):
+        return self._tree is not None
+
+    def load(self, slot_ids, generation=None, inactive=()):
+        """
+        (Re-)Builds the index
+
+        Parameters:
+        slot_ids (iterable): The free slot ids, active or not
+        generation (int): The generation of the parking lot the slots were read at
+        inactive (iterable): The (first, last) ranges of the inactive slots
+        """
+        self._free = set(slot_ids)
+        self._build(max(self._free) if self._free else 0)
+        self._queues = {}
+        self.inactive = SlotRanges(inactive)
+        self.generation = generation
+
+    def _build(self, size):
+        # Every node of the tree counts the free slots of a range of slot ids ending at its own
+        tree = [0]*(size+1)
+        for slot_id in self._free:
+            tree[slot_id] = 1
+        for node in xrange(1, size+1):
+            parent = node + (node & -node)
+            if parent <= size:
+                tree[parent] += tree[node]
+        self._tree = tree
+        self._top = 1  # The highest power of 2 up to the size, the first step of the searches
+        while self._top*2 <= size:
+            self._top *= 2
+
+    def _count(self, slot_id, change):
+        tree = self._tree
+        if slot_id >= len(tree):
+            self._build(max(slot_id, 2*(len(tree)-1)))
+            return
+        while slot_id < len(tree):
+            tree[slot_id] += change
+            slot_id += slot_id & -slot_id
+
+    def _free_up_to(self, slot_id):
+        # The number of free slots up to the slot id
+        tree = self._tree
+        slot_id = min(slot_id, len(tree)-1)
+        free = 0
+        while slot_id > 0:
+            free += tree[slot_id]
+            slot_id -= slot_id & -slot_id
+        return free
+
+    def _first_free_after(self, slot_id):
+        # The lowest numbered free slot after the slot id, None if there is none
+        tree = self._tree
+        remaining = self._free_up_to(slot_id)+1
+        node, step = 0, self._top
+        while step:
+            if node+step < len(tree) and tree[node+step] < remaining:
+                node += step
+                remaining -= tree[node]
+            step >>= 1
+        return node+1 if node+1 < len(tree) else None
+
+    def has_queue(self, key):
+        return key in self._queues
+
+    def load_queue(self, key, distances):
+        """
+        (Re-)Builds a queue of the free and active slots, nearest first. The queues are dropped with the index, and need
+        to be dropped when the distances change (see drop_queues).
+
+        Parameters:
+        key: The key of the queue, e.g. an entrance
+        distances (dict): The distances of the slots of the queue, free or not, by slot id. Ties go to the lowest
+            numbered slot.
+        """
+        heap = [(slot_distance, slot_id) for slot_id, slot_distance in distances.iteritems() if slot_id in self._free and slot_id not in self.inactive]
+        heapq.heapify(heap)
+        self._queues[key] = (distances, heap)
+
+    def drop_queues(self):
+        """
+        Drops the queues, e.g. when the slots are laid out again
+        """
+        self._queues = {}
+
+    def _take(self, slot_id):
+        self._free.remove(slot_id)
+        self._count(slot_id, -1)
+
+    def pop_nearest(self, key):
+        """
+        Takes the nearest free and active slot of a queue out of the index
+
+        Parameters:
+        key: The key of the loaded queue
+
+        Returns:
+        int: Slot number or None, if there is no free slot in the queue
+        """
+        _, heap = self._queues[key]
+        while heap:
+            # The entries of inactive slots are dropped, the queues are built again when slots are activated
+            _, slot_id = heapq.heappop(heap)
+            if slot_id in self._free and slot_id not in self.inactive:
+                self._take(slot_id)
+                return slot_id
+        return None
+
+    def pop(self):
+        """
+        Takes the nearest (lowest numbered) free and active slot out of the index
+
+        Returns:
+        int: Slot number or None, if there is no free slot
+        """
+        slot_id = self._first_free_after(0)
+        while slot_id is not None:
+            inactive_range = self.inactive.find(slot_id)
+            if inactive_range is None:
+                self._take(slot_id)
+                return slot_id
+            slot_id = self._first_free_after(inactive_range[1])
+        return None
+
+    def push(self, slot_id):
+        """
+        Marks the slot as free. A no-op for slots which are already free.
+
+        Parameters:
+        slot_id (int): The slot id
+        """
+        if slot_id not in self._free:
+            self._free.add(slot_id)
+            self._count(slot_id, 1)
+            # Slots taken from another queue leave stale entries behind, which are only skipped by the pops of this
+            # one: a queue is rebuilt once they outnumber its live entries
+            for key, (distances, heap) in self._queues.items():
+                slot_distance = distances.get(slot_id)
+                if slot_distance is not None:
+                    heapq.heappush(heap, (slot_distance, slot_id))
+                    if len(heap) > 2*len(distances) + COMPACTION_SLACK:
+                        self.load_queue(key, distances)
+
+    def push_all(self, slot_ids):
+        """
+        Marks the slots as free
+
+        Parameters:
+        slot_ids (iterable): The slot ids
+        """
+        for slot_id in slot_ids:
+            self.push(slot_id)
+
+    def discard_all(self, slot_ids):
+        """
+        Takes the slots out of the index, e.g. when they are occupied behind its back
+
+        Parameters:
+        slot_ids (iterable): The slot ids
+        """
+        for slot_id in slot_ids:
+            if slot_id in self._free:
+                self._take(slot_id)
+
+    def deactivate(self, first_slot_id, last_slot_id):
+        """
+        Marks the slots from first_slot_id to last_slot_id inactive, they are skipped until they are activated again
+        """
+        self.inactive.add(first_slot_id, last_slot_id)
+
+    def activate(self, first_slot_id, last_slot_id):
+        """
+        Marks the slots from first_slot_id to last_slot_id active. The queues are dropped, as they left the inactive
+        slots out.
+        """
+        self.inactive.remove(first_slot_id, last_slot_id)
+        self.drop_queues()
+
+    def __len__(self):
+        # The free and active slots
+        if not self.loaded:
+            return 0
+        return len(self._free) - sum(self._free_up_to(last)-self._free_up_to(first-1) for first, last in self.inactive)
@@ -0,0 +1,299 @@
+import asynchat
+import asyncore
+import collections
+import errno
+import fcntl
+import logging
+import os
+import Queue
+import socket
+import threading
+
+from app import db, utils
+from app.commands import find_command
+from app.daemon import END_OF_REPLY
+
+# The writes queued while the writer commits are run in a single transaction, up to this number
+WRITE_BATCH_SIZE = 256
+
+# Pending connections queued by the listening socket
+LISTEN_BACKLOG = 1024
+
+# Reply of the commands which failed for another reason than their input
+UNAVAILABLE_MESSAGE = 'Sorry, the parking lot is unavailable'
+
+logger = logging.getLogger(__name__)
+
+
+def is_write_command(command_input):
+    """
+    Whether the command changes the parking lot, and is run by the single writer. The other commands are answered from
+    memory.
+    """
+    command = find_command(command_input)
+    return command is not None and command.writes
+
+def read_command(command_input):
+    """
+    Answers a read-only command from the memory parking lot, or from the mapped snapshot while the memory parking lot
+    loads
+
+    Parameters:
+    command_input (string): The command given in the parking lot game
+
+    Returns:
+    string: The message of the command
+    """
+    with utils.using_storage_backend('snapshot'):
+        return utils.process_command_input(command_input)
+
+def write_commands(command_inputs):
+    """
+    Runs write commands in a single transaction, each in its own savepoint, then mirrors them on the memory parking
+    lot. Only the writer thread calls it, so neither the database nor the memory parking lot is contended.
+
+    Parameters:
+    command_inputs (list): The commands given in the parking lot game
+
+    Returns:
+    list: The message of every command
+    """
+    messages = []
+    with utils.using_storage_backend('sql'):
+        try:
+            utils.begin_write()
+            for command_input in command_inputs:
+                savepoint = db.session.begin_nested()
+                messages.append(utils.process_command_input(command_input))
+                if savepoint.is_active:
+                    savepoint.commit()
+            db.session.commit()
+        except Exception:
+            logger.exception('Writes failed: %r', command_inputs)
+            db.session.rollback()
+            utils.invalidate_free_slots()
+            utils.load_memory_lots()
+            return [UNAVAILABLE_MESSAGE]*len(command_inputs)
+
+    # The memory parking lot allocates like the database does, unless another process changed the database
+    with utils.using_storage_backend('memory'), utils.without_journal():
+        mirrored_messages = [utils.process_command_input(command_input) for command_input in command_inputs]
+    if mirrored_messages != messages:
+        utils.load_memory_lots()
+    db.session.commit()
+    utils.checkpoint_journal()
+    return messages
+
+
+class SingleWriter(threading.Thread):
+    """
+    Thread running all the write commands of the server, in the order they are submitted
+    """
+
+    def __init__(self, server):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.server = server
+        self.queue = Queue.Queue()
+
+    def submit(self, connection, pending_command):
+        self.queue.put((connection, pending_command))
+
+    def stop(self):
+        self.queue.put(None)
+
+    def run(self):
+        try:
+            # The reads are answered from the snapshot until the memory parking lot is loaded, before any write
+            if utils.mapped_snapshot is not None:
+                utils.load_memory_lot(utils.mapped_snapshot)
+                utils.unmap_snapshot()
+
+            while True:
+                writes = [self.queue.get()]
+                while writes[-1] is not None and len(writes) < WRITE_BATCH_SIZE:
+                    try:
+                        writes.append(self.queue.get_nowait())
+                    except Queue.Empty:
+                        break
+                if writes[-1] is None:
+                    writes.pop()
+                    stopping = True
+                else:
+                    stopping = False
+
+                if writes:
+                    messages = write_commands([pending_command.command_input for _, pending_command in writes])
+                    self.server.complete([(connection, pending_command, message) for (connection, pending_command), message in zip(writes, messages)])
+                if stopping:
+                    return
+        finally:
+            db.session.remove()
+
+
+class PendingCommand(object):
+
+    def __init__(self, command_input):
+        self.command_input = command_input
+        self.submitted = False
+        self.message = None
+
+
+class GateConnection(asynchat.async_chat):
+    """
+    Connection of a gate: a command per line, the reply of every command followed by an empty line, like the daemon
+    (app.daemon). The commands of a connection are answered in order, a read-only command after the writes sent
+    before it.
+    """
+
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock, map=server.socket_map)
+        self.set_terminator('\n')
+        self.server = server
+        self.buffer = []
+        self.pending_commands = collections.deque()
+        self.closing = False
+
+    def collect_incoming_data(self, data):
+        self.buffer.append(data)
+
+    def found_terminator(self):
+        command_input = ''.join(self.buffer).rstrip()
+        self.buffer = []
+        if self.closing:
+            return
+        if command_input in ['exit', '']:
+            self.closing = True
+        else:
+            self.pending_commands.append(PendingCommand(command_input))
+        self.reply()
+
+    def reply(self):
+        """
+        Sends the replies of the commands which are done, in order
+        """
+        while self.pending_commands:
+            pending_command = self.pending_commands[0]
+            if pending_command.message is None:
+                if is_write_command(pending_command.command_input):
+                    if not pending_command.submitted:
+                        pending_command.submitted = True
+                        self.server.writer.submit(self, pending_command)
+                    return
+                pending_command.message = read_command(pending_command.command_input)
+
+            self.pending_commands.popleft()
+            self.push('{}\n{}'.format(pending_command.message, END_OF_REPLY))
+
+        if self.closing:
+            self.close_when_done()
+
+    def handle_close(self):
+        self.closing = True
+        self.pending_commands.clear()
+        self.close()
+
+
+class Wakeup(asyncore.file_dispatcher):
+    """
+    Pipe waking up the event loop, when the writer completed commands
+    """
+
+    def __init__(self, server):
+        self.read_fd, self.write_fd = os.pipe()
+        fcntl.fcntl(self.write_fd, fcntl.F_SETFL, fcntl.fcntl(self.write_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        asyncore.file_dispatcher.__init__(self, self.read_fd, map=server.socket_map)
+        self.server = server
+
+    def wake(self):
+        try:
+            os.write(self.write_fd, 'x')
+        except OSError as error:
+            if error.errno != errno.EAGAIN: # Full pipe, the loop is waking up anyway
+                raise
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(4096)
+        self.server.handle_completed()
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        os.close(self.write_fd)
+
+
+class GateServer(asyncore.dispatcher):
+    """
+    TCP server of the gates. A single thread runs the event loop of all the connections and answers the read-only
+    commands from the memory parking lot. The write commands are queued to the single writer thread, whose replies
+    are handed back to the event loop.
+
+    With a current snapshot (see app.snapshot), the server starts answering right away: the reads are answered from the
+    mapped snapshot while the writer thread loads the memory parking lot from it.
+    """
+
+    def __init__(self, host, port, snapshot_path=None):
+        self.socket_map = {}
+        asyncore.dispatcher.__init__(self, map=self.socket_map)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(LISTEN_BACKLOG)
+        self.address = self.socket.getsockname()
+        self.snapshot_path = snapshot_path
+
+        self.completed = collections.deque()
+        self.stopping = False
+        self.wakeup = Wakeup(self)
+        self.writer = SingleWriter(self)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            GateConnection(pair[0], self)
+
+    def complete(self, completed_commands):
+        """
+        Hands the completed write commands to the event loop. Called by the writer thread.
+
+        Parameters:
+        completed_commands (list): (connection, pending command, message) triples
+        """
+        self.completed.extend(completed_commands)
+        self.wakeup.wake()
+
+    def handle_completed(self):
+        while self.completed:
+            connection, pending_command, message = self.completed.popleft()
+            pending_command.message = message
+            if connection.connected:
+                connection.reply()
+        if self.stopping:
+            for dispatcher in self.socket_map.values():
+                dispatcher.close()
+
+    def serve_forever(self):
+        """
+        Serves the gates until stopped
+        """
+        if self.snapshot_path is None or utils.map_snapshot(self.snapshot_path) is None:
+            utils.load_memory_lots()
+        else:
+            # The snapshot is that of the default lot, the other lots are loaded up front
+            utils.load_memory_lots([lot_id for lot_id in utils.stored_lot_ids() if lot_id != utils.LOT_ID])
+        db.session.remove()
+        self.writer.start()
+        try:
+            asyncore.loop(timeout=30, use_poll=True, map=self.socket_map)
+        finally:
+            self.writer.stop()
+            self.writer.join()
+
+    def stop(self):
+        """
+        Stops the server, from any thread
+        """
+        self.stopping = True
+        self.wakeup.wake()
@@ -0,0 +1,175 @@
+import bisect
+import functools
+import threading
+import timeit
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.commands import LOT_PREFIX
+
+# Histogram bucket bounds in seconds, from 1 microsecond to ~100 seconds, 4 buckets per power of 2
+BUCKET_BOUNDS = [1e-6*2**(index/4.0) for index in xrange(4*27)]
+
+# Commands are tracked separately up to this number of distinct names, the rest are tracked as 'other'
+MAX_COMMANDS = 64
+
+
+class Histogram(object):
+    """
+    Log-scale latency histogram, with a fixed memory footprint
+    """
+
+    def __init__(self):
+        self.buckets = [0]*(len(BUCKET_BOUNDS)+1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """
+        Approximate percentile, the upper bound of the bucket holding it
+
+        Parameters:
+        percent (float): The percentile, between 0 and 100
+
+        Returns:
+        float: The percentile value in seconds
+        """
+        rank = percent/100.0*self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if bucket_count and seen >= rank:
+                return min(BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total/self.count if self.count else 0.0
+
+
+class CommandStats(object):
+    """
+    Latency, SQL query and commit statistics of a command
+    """
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.queries = 0
+        self.query_time = 0.0
+        self.commits = 0
+
+
+class Instrumentation(object):
+    """
+    Opt-in per-command instrumentation
+
+    When enabled, every instrumented call is timed and the SQL statements and commits it issues are counted through
+    SQL Alchemy engine events. When disabled, no event listener is registered and an instrumented call costs a single
+    attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.commands = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        if not self.enabled:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(Engine, 'commit', self._commit)
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            event.remove(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.remove(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.remove(Engine, 'commit', self._commit)
+            self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.commands = {}
+
+    def _current(self):
+        return getattr(self._local, 'current', None)
+
+    def _before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        current = self._current()
+        if current is not None:
+            current['query_start'] = timeit.default_timer()
+
+    def _after_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        current = self._current()
+        if current is not None and 'query_start' in current:
+            current['queries'] += 1
+            current['query_time'] += timeit.default_timer()-current.pop('query_start')
+
+    def _commit(self, connection):
+        current = self._current()
+        if current is not None:
+            current['commits'] += 1
+
+    def _command_stats(self, name):
+        with self._lock:
+            if name not in self.commands and len(self.commands) >= MAX_COMMANDS:
+                name = 'other'
+            return self.commands.setdefault(name, CommandStats())
+
+    def command(self, function):
+        """
+        Decorator instrumenting a function taking the command input as its first argument. Nested instrumented calls
+        are accounted to the outermost command.
+        """
+        @functools.wraps(function)
+        def wrapper(command_input, *args, **kwargs):
+            if not self.enabled or self._current() is not None:
+                return function(command_input, *args, **kwargs)
+
+            current = self._local.current = {'queries': 0, 'query_time': 0.0, 'commits': 0}
+            start = timeit.default_timer()
+            try:
+                return function(command_input, *args, **kwargs)
+            finally:
+                latency = timeit.default_timer()-start
+                self._local.current = None
+                command_inputs = command_input.split()
+                if command_inputs[:1] == [LOT_PREFIX]:  # Lot scoped commands are accounted to the command
+                    command_inputs = command_inputs[2:]
+                command_stats = self._command_stats((command_inputs or ['exit'])[0])
+                with self._lock:
+                    command_stats.latency.add(latency)
+                    command_stats.queries += current['queries']
+                    command_stats.query_time += current['query_time']
+                    command_stats.commits += current['commits']
+        return wrapper
+
+    def report_lines(self):
+        """
+        Lines of the statistics report
+
+        Returns:
+        generator: The header and a line per command
+        """
+        yield '{:<42}{:>8}{:>10}{:>10}{:>10}{:>10}{:>9}{:>10}{:>9}'.format(
+            'Command', 'Count', 'Mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'SQL/cmd', 'SQL ms', 'Commits')
+        with self._lock:
+            commands = sorted(self.commands.items())
+        for name, command_stats in commands:
+            latency = command_stats.latency
+            yield '{:<42}{:>8}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}{:>9.2f}{:>10.3f}{:>9}'.format(
+                name, latency.count, latency.mean*1e3, latency.percentile(50)*1e3, latency.percentile(95)*1e3,
+                latency.percentile(99)*1e3, float(command_stats.queries)/latency.count,
+                command_stats.query_time/latency.count*1e3, command_stats.commits)
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,136 @@
+import atexit
+import errno
+import fcntl
+import os
+import struct
+import threading
+import zlib
+
+# Frame header: length and CRC-32 of the payload, sequence number of the frame
+FRAME = struct.Struct('<IIQ')
+
+# Frames appended between two fsyncs, by default
+GROUP_SIZE = 64
+
+
+def read_frames(journal_path, offset=0):
+    """
+    Reads the frames of a journal. Reading stops at the first torn or corrupt frame, the end of what was written in
+    full before a crash.
+
+    Parameters:
+    journal_path (string): The path of the journal file
+    offset (int): The offset of the first frame read
+
+    Returns:
+    generator: (sequence, payload, offset after the frame) triples
+    """
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, 'rb') as journal_file:
+        journal_file.seek(offset)
+        while True:
+            header = journal_file.read(FRAME.size)
+            if len(header) < FRAME.size:
+                return
+            length, checksum, sequence = FRAME.unpack(header)
+            payload = journal_file.read(length)
+            if len(payload) < length or zlib.crc32(payload) & 0xffffffff != checksum:
+                return
+            offset += FRAME.size+length
+            yield sequence, payload, offset
+
+
+class Journal(object):
+    """
+    Append-only journal of framed payloads, e.g. the write commands of the parking lot
+
+    Frames are numbered by a sequence and appended with a single write each batch. fsync is grouped: the journal is
+    synced once group_size frames are appended since the last sync, and when synced explicitly, e.g. at the end of a
+    transaction. A crash loses at most the frames appended since the last sync.
+
+    A journal has a single writer: it is locked (flock) while it is open, and opening it again fails, in another
+    process or in the same one.
+    """
+
+    def __init__(self, journal_path, group_size=GROUP_SIZE, offset=0, sequence=0):
+        """
+        Opens the journal for appending, after its last complete frame. A torn frame left by a crash is dropped.
+        Raises IOError (EWOULDBLOCK) if the journal is already open.
+
+        Parameters:
+        journal_path (string): The path of the journal file
+        group_size (int): The frames appended between two fsyncs
+        offset (int): The offset of a frame boundary to start reading from, e.g. that of the latest checkpoint
+        sequence (int): The sequence of the frame before the offset
+        """
+        if offset and (not os.path.exists(journal_path) or os.path.getsize(journal_path) < offset):
+            raise ValueError('The journal {} is shorter than its checkpoint'.format(journal_path))
+        self._fd = os.open(journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            # Before the end is read: another writer would append after it, and the end would be truncated away
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as error:
+            os.close(self._fd)
+            if error.errno in (errno.EWOULDBLOCK, errno.EAGAIN):
+                raise IOError(error.errno, 'The journal {} is open in another writer'.format(journal_path))
+            raise
+        self.path = journal_path
+        self.group_size = group_size
+        self.pid = os.getpid()
+        self.sequence = sequence
+        self.end = offset
+        for self.sequence, _, self.end in read_frames(journal_path, offset):
+            pass
+
+        self._lock = threading.Lock()
+        os.ftruncate(self._fd, self.end)
+        self.unsynced = 0
+        atexit.register(self.close)
+
+    def append(self, payloads):
+        """
+        Appends frames, with a single write
+
+        Parameters:
+        payloads (list): The payloads of the frames
+
+        Returns:
+        int: The sequence of the last frame
+        """
+        with self._lock:
+            frames = []
+            for payload in payloads:
+                self.sequence += 1
+                frames.append(FRAME.pack(len(payload), zlib.crc32(payload) & 0xffffffff, self.sequence))
+                frames.append(payload)
+            data = ''.join(frames)
+            written = 0
+            while written < len(data):
+                written += os.write(self._fd, data[written:])
+            self.end += len(data)
+            self.unsynced += len(payloads)
+            if self.unsynced >= self.group_size:
+                self._sync()
+            return self.sequence
+
+    def _sync(self):
+        os.fsync(self._fd)
+        self.unsynced = 0
+
+    def sync(self):
+        """
+        Makes the appended frames durable
+        """
+        with self._lock:
+            if self.unsynced:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._fd is None:
+                return
+            if self.unsynced:
+                self._sync()
+            os.close(self._fd)  # Unlocks the journal
+            self._fd = None
@@ -0,0 +1,189 @@
+import bisect
+import collections
+import threading
+
+# Bounds of the cache: registration numbers (parked or not), colours and rows of the status snapshot
+MAX_REGISTRATIONS = 100000
+MAX_COLOURS = 64
+MAX_STATUS_ROWS = 100000
+
+
+class LookupCounter(object):
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+
+class LookupCache(object):
+    """
+    Write-through cache of the SQL lookups: slot by registration number, slots by colour and the status
+
+    Registration numbers and colours are kept in least recently used order and the least recently used ones are
+    evicted beyond MAX_REGISTRATIONS and MAX_COLOURS. The status snapshot is only kept for parking lots of up to
+    MAX_STATUS_ROWS parked vehicles, and dropped on every change.
+
+    The cache records the generation of the parking lot it reflects (see app.utils.begin_write). It is cleared when
+    another process changed the parking lot, and updated in place by the changes of this process.
+    """
+
+    def __init__(self, max_registrations=MAX_REGISTRATIONS, max_colours=MAX_COLOURS, max_status_rows=MAX_STATUS_ROWS):
+        self.max_registrations = max_registrations
+        self.max_colours = max_colours
+        self.max_status_rows = max_status_rows
+        self.counters = collections.OrderedDict((lookup, LookupCounter()) for lookup in ['registration', 'colour', 'status'])
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self, generation=None):
+        """
+        Drops the cached lookups
+
+        Parameters:
+        generation (int): The generation of the parking lot the cache reflects from now on
+        """
+        self.generation = generation
+        self._slot_by_registration_number = collections.OrderedDict()  # registration_number -> slot_id, -1 if not parked
+        self._registration_number_by_slot = {}
+        self._slots_by_colour = collections.OrderedDict()  # colour_key -> ([slot_id], [registration_number]), by slot
+        self._status = None  # [(slot_id, registration_number, colour)], by slot
+
+    def validate(self, generation):
+        """
+        Clears the cache if it does not reflect the given generation of the parking lot
+
+        Parameters:
+        generation (int): The current generation of the parking lot
+        """
+        with self._lock:
+            if self.generation != generation:
+                self.clear(generation)
+
+    def advance(self, previous_generation, generation):
+        """
+        Moves the cache to the generation written by this process. The change is to be applied, if it returns True.
+
+        Parameters:
+        previous_generation (int): The generation the change was made on
+        generation (int): The generation after the change
+
+        Returns:
+        bool: False if the cache was cleared instead, as it did not reflect the previous generation
+        """
+        with self._lock:
+            if self.generation != previous_generation:
+                self.clear(generation)
+                return False
+            self.generation = generation
+            self._status = None
+            return True
+
+    def _count(self, lookup, value):
+        counter = self.counters[lookup]
+        if value is None:
+            counter.misses += 1
+        else:
+            counter.hits += 1
+        return value
+
+    # Slot by registration number
+
+    def slot_for_registration_number(self, registration_number):
+        with self._lock:
+            slot_id = self._slot_by_registration_number.pop(registration_number, None)
+            if slot_id is not None:
+                self._slot_by_registration_number[registration_number] = slot_id  # Most recently used
+            return self._count('registration', slot_id)
+
+    def _set_slot_for_registration_number(self, registration_number, slot_id):
+        previous_slot_id = self._slot_by_registration_number.pop(registration_number, -1)
+        self._registration_number_by_slot.pop(previous_slot_id, None)
+        self._slot_by_registration_number[registration_number] = slot_id
+        if slot_id != -1:
+            self._registration_number_by_slot[slot_id] = registration_number
+        while len(self._slot_by_registration_number) > self.max_registrations:
+            _, evicted_slot_id = self._slot_by_registration_number.popitem(last=False)
+            self._registration_number_by_slot.pop(evicted_slot_id, None)
+
+    def store_slot_for_registration_number(self, generation, registration_number, slot_id):
+        with self._lock:
+            if self.generation == generation:
+                self._set_slot_for_registration_number(registration_number, slot_id)
+
+    # Slots by colour
+
+    def vehicles_with_colour(self, colour_key):
+        """
+        Returns:
+        tuple: Copies of the slot ids and the registration numbers of the vehicles, by slot, None if not cached
+        """
+        with self._lock:
+            vehicles = self._slots_by_colour.pop(colour_key, None)
+            if vehicles is not None:
+                self._slots_by_colour[colour_key] = vehicles  # Most recently used
+                vehicles = (list(vehicles[0]), list(vehicles[1]))
+            return self._count('colour', vehicles)
+
+    def store_vehicles_with_colour(self, generation, colour_key, slot_ids, registration_numbers):
+        with self._lock:
+            if self.generation == generation:
+                self._slots_by_colour.pop(colour_key, None)
+                self._slots_by_colour[colour_key] = (list(slot_ids), list(registration_numbers))
+                while len(self._slots_by_colour) > self.max_colours:
+                    self._slots_by_colour.popitem(last=False)
+
+    # Status
+
+    def status(self):
+        """
+        Returns:
+        list: (slot_id, registration_number, colour) of the parked vehicles, by slot, None if not cached
+        """
+        with self._lock:
+            return self._count('status', self._status)
+
+    def store_status(self, generation, status):
+        with self._lock:
+            if self.generation == generation and len(status) <= self.max_status_rows:
+                self._status = status
+
+    # Changes of the parking lot, applied after advance
+
+    def park(self, slot_id, registration_number, colour_key):
+        with self._lock:
+            self._set_slot_for_registration_number(registration_number, slot_id)
+            vehicles = self._slots_by_colour.get(colour_key)
+            if vehicles is not None:
+                slot_ids, registration_numbers = vehicles
+                index = bisect.bisect_left(slot_ids, slot_id)
+                if index == len(slot_ids) or slot_ids[index] != slot_id:
+                    slot_ids.insert(index, slot_id)
+                    registration_numbers.insert(index, registration_number)
+
+    def unpark(self, slot_id):
+        with self._lock:
+            registration_number = self._registration_number_by_slot.get(slot_id)
+            if registration_number is not None:
+                self._set_slot_for_registration_number(registration_number, -1)
+            for slot_ids, registration_numbers in self._slots_by_colour.itervalues():
+                index = bisect.bisect_left(slot_ids, slot_id)
+                if index < len(slot_ids) and slot_ids[index] == slot_id:
+                    del slot_ids[index]
+                    del registration_numbers[index]
+
+    def report_lines(self):
+        """
+        Lines of the hit and miss report
+
+        Returns:
+        generator: A line per lookup
+        """
+        with self._lock:
+            entries = {
+                'registration': len(self._slot_by_registration_number),
+                'colour': len(self._slots_by_colour),
+                'status': len(self._status) if self._status is not None else 0,
+            }
+            counters = [(lookup, counter.hits, counter.misses) for lookup, counter in self.counters.items()]
+        for lookup, hits, misses in counters:
+            yield '{:<14}{:>10} hits{:>10} misses{:>10} entries'.format(lookup, hits, misses, entries[lookup])
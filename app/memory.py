@@ -0,0 +1,291 @@
+import bisect
+import fnmatch
+import re
+
+from app.free_slots import FreeSlotIndex, slot_id_ranges
+from app.models import SLOT_TYPES, checked_number_of_slots, colour_key, distance, registration_affixes, reversed_registration_number, slot_range
+from app.snapshot import MappedSnapshot, write_snapshot
+
+
+def _with_prefix(values, prefix):
+    # The values starting with the prefix, a slice of the sorted values
+    start = bisect.bisect_left(values, prefix)
+    end = start
+    while end < len(values) and values[end].startswith(prefix):
+        end += 1
+    return values[start:end]
+
+
+class MemoryParkingLot(object):
+    """
+    Memory resident parking lot, with the same operations as the SQL backed functions in app.utils
+
+    Parked vehicles are kept in dicts keyed by slot number and by registration number, the slots of every colour in
+    a sorted list (keyed by models.colour_key, as colours are matched case insensitively) and the free slots in
+    a FreeSlotIndex. The registration numbers are also kept in sorted lists, forwards and reversed, for the searches by
+    prefix and suffix; kept up to date by the writes, as the searches run in reader threads which must not build them
+    while a writer changes the parkings. The free
+    slots nearest an entrance are queued in the FreeSlotIndex, by entrance and slot type. The inactive slots are the
+    ranges of the FreeSlotIndex.
+
+    Writes need to be serialised (see app.utils.serialised). Reads can run in other threads meanwhile.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """
+        Drops the parking lot
+        """
+        self.number_of_slots = 0
+        self.layout = {}  # slot_id -> (level, x, y, slot_type) of the slots laid out
+        self.entrances = {}  # name -> (level, x, y)
+        self.parkings = {}  # slot_id -> (registration_number, colour)
+        self.slot_by_registration_number = {}
+        self.slots_by_colour = {}
+        self.registration_numbers = []  # Sorted
+        self.reversed_registration_numbers = []
+        self.free_slots = FreeSlotIndex()
+        self.free_slots.load([])
+
+    @property
+    def inactive_slots(self):
+        return self.free_slots.inactive
+
+    def load(self, slots, parkings, layout=(), entrances=()):
+        """
+        Loads the parking lot, e.g. from the SQL tables
+
+        Parameters:
+        slots (iterable): (slot_id, active) pairs
+        parkings (iterable): (slot_id, registration_number, colour) triples of the active parkings
+        layout (iterable): (slot_id, level, x, y, slot_type) of the slots laid out
+        entrances (iterable): (name, level, x, y) of the entrances
+        """
+        self.clear()
+        inactive_slots = []
+        for slot_id, active in slots:
+            self.number_of_slots = max(self.number_of_slots, slot_id)
+            if not active:
+                inactive_slots.append(slot_id)
+        for slot_id, level, x, y, slot_type in layout:
+            self.layout[slot_id] = (level, x, y, slot_type)
+        for name, level, x, y in entrances:
+            self.entrances[name] = (level, x, y)
+        for slot_id, registration_number, colour in parkings:
+            self._add_parking(slot_id, registration_number, colour, False)
+        # Sorted once, rather than inserted in order one at a time
+        self.registration_numbers = sorted(self.slot_by_registration_number)
+        self.reversed_registration_numbers = sorted(reversed_registration_number(registration_number) for registration_number in self.slot_by_registration_number)
+        self.free_slots.load((slot_id for slot_id in xrange(1, self.number_of_slots+1) if slot_id not in self.parkings), None, slot_id_ranges(sorted(inactive_slots)))
+
+    def _add_parking(self, slot_id, registration_number, colour, sorted_lookups=True):
+        # The sorted registration numbers are left to the caller if not sorted_lookups, e.g. for a bulk load
+        self.parkings[slot_id] = (registration_number, colour)
+        self.slot_by_registration_number[registration_number] = slot_id
+        bisect.insort(self.slots_by_colour.setdefault(colour_key(colour), []), slot_id)
+        if sorted_lookups:
+            bisect.insort(self.registration_numbers, registration_number)
+            bisect.insort(self.reversed_registration_numbers, reversed_registration_number(registration_number))
+
+    def _remove_parking(self, slot_id):
+        # The lookups are updated before the parking is dropped, as readers in other threads go through them
+        registration_number, colour = self.parkings[slot_id]
+        del self.slot_by_registration_number[registration_number]
+        colour_slots = self.slots_by_colour[colour_key(colour)]
+        del colour_slots[bisect.bisect_left(colour_slots, slot_id)]
+        if not colour_slots:
+            del self.slots_by_colour[colour_key(colour)]
+        for values, value in [(self.registration_numbers, registration_number), (self.reversed_registration_numbers, reversed_registration_number(registration_number))]:
+            del values[bisect.bisect_left(values, value)]
+        del self.parkings[slot_id]
+
+    def _is_active_slot(self, slot_id):
+        return 1 <= slot_id <= self.number_of_slots and slot_id not in self.inactive_slots
+
+    def create_parking_lot(self, number_of_slots):
+        checked_number_of_slots(number_of_slots)
+        self.clear()
+        self.number_of_slots = number_of_slots
+        self.free_slots.load(xrange(1, number_of_slots+1))
+        return number_of_slots
+
+    def resize_parking_lot(self, number_of_slots):
+        checked_number_of_slots(number_of_slots)
+        # Slots to be retired need to be free
+        if any(slot_id > number_of_slots for slot_id in self.parkings):
+            return -1
+
+        self.free_slots.drop_queues()  # The new slots are in none of them
+        self.free_slots.push_all(xrange(self.number_of_slots+1, number_of_slots+1))
+        self.free_slots.activate(1, number_of_slots)
+        if number_of_slots < self.number_of_slots:
+            self.free_slots.deactivate(number_of_slots+1, self.number_of_slots)
+        self.number_of_slots = max(self.number_of_slots, number_of_slots)
+
+        return number_of_slots
+
+    def snapshot_parking_lot(self, snapshot_path, journal_sequence=0, journal_offset=0):
+        return write_snapshot(
+            snapshot_path,
+            0,
+            ((slot_id, slot_id not in self.inactive_slots) for slot_id in xrange(1, self.number_of_slots+1)),
+            ((slot_id,) + self.parkings[slot_id] for slot_id in sorted(self.parkings)),
+            journal_sequence,
+            journal_offset,
+            ((slot_id,) + self.layout[slot_id] for slot_id in sorted(self.layout)),
+            ((name,) + self.entrances[name] for name in sorted(self.entrances)),
+        )
+
+    def restore_parking_lot(self, snapshot_path):
+        snapshot = MappedSnapshot(snapshot_path)
+        try:
+            self.load(snapshot.slots(), snapshot.parkings(), snapshot.layout(), snapshot.entrances())
+        finally:
+            snapshot.close()
+        return len(self.parkings)
+
+    def layout_slots(self, first_slot_id, last_slot_id, level, x, y, slot_type):
+        if slot_type not in SLOT_TYPES:
+            return -1
+        slot_ids = xrange(max(first_slot_id, 1), min(last_slot_id, self.number_of_slots)+1)
+        for slot_id in slot_ids:
+            self.layout[slot_id] = (level, x+slot_id-first_slot_id, y, slot_type)
+        self.free_slots.drop_queues()
+        return len(slot_ids)
+
+    def deactivate_slots(self, slots):
+        first_slot_id, last_slot_id = slot_range(slots)
+        last_slot_id = min(last_slot_id, self.number_of_slots)
+        inactive_slots = len(self.inactive_slots)
+        if first_slot_id <= last_slot_id:
+            self.free_slots.deactivate(first_slot_id, last_slot_id)
+        # The parked vehicles of the range, found in the sorted slots of every colour
+        slot_ids = []
+        for colour_slots in self.slots_by_colour.values():
+            slot_ids.extend(colour_slots[bisect.bisect_left(colour_slots, first_slot_id):bisect.bisect_right(colour_slots, last_slot_id)])
+        parkings = [dict(slot_id=slot_id, registration_number=self.parkings[slot_id][0], colour=self.parkings[slot_id][1]) for slot_id in sorted(slot_ids)]
+        return len(self.inactive_slots)-inactive_slots, parkings
+
+    def activate_slots(self, slots):
+        first_slot_id, last_slot_id = slot_range(slots)
+        inactive_slots = len(self.inactive_slots)
+        self.free_slots.activate(first_slot_id, last_slot_id)
+        return inactive_slots-len(self.inactive_slots)
+
+    def add_entrance(self, name, level, x, y):
+        self.entrances[name] = (level, x, y)
+        self.free_slots.drop_queues()
+        return name
+
+    def _entrance_distances(self, position, slot_type):
+        # Distances of the slots of the type from the entrance, the slots not laid out are at level 0, (0, 0)
+        default_layout = (0, 0, 0, SLOT_TYPES[0])
+        layouts = ((slot_id, self.layout.get(slot_id, default_layout)) for slot_id in xrange(1, self.number_of_slots+1))
+        return dict((slot_id, distance(position, layout[:3])) for slot_id, layout in layouts if layout[3] == slot_type)
+
+    def park_vehicle(self, registration_number, colour, entrance=None, slot_type=SLOT_TYPES[0]):
+        # The errors are checked in the order of the SQL storage backend, so that both give the same reply
+        if slot_type not in SLOT_TYPES:
+            return -4
+
+        # Check if the vehicle is already parked and not repeated parking
+        if registration_number in self.slot_by_registration_number:
+            return -2
+
+        if entrance is None:
+            slot_id = self.free_slots.pop()
+        else:
+            if entrance not in self.entrances:
+                return -3
+            if not self.free_slots.has_queue((entrance, slot_type)):
+                self.free_slots.load_queue((entrance, slot_type), self._entrance_distances(self.entrances[entrance], slot_type))
+            slot_id = self.free_slots.pop_nearest((entrance, slot_type))
+        if slot_id is None:
+            return -1
+
+        self._add_parking(slot_id, registration_number, colour)
+        return slot_id
+
+    def unpark_vehicle(self, slot_id):
+        # The vehicles parked in slots deactivated since can leave
+        if slot_id not in self.parkings and not self._is_active_slot(slot_id):
+            return False
+
+        if slot_id in self.parkings:
+            self._remove_parking(slot_id)
+        self.free_slots.push(slot_id)
+        return True
+
+    def parking_lot_status(self, after_slot_id=0, limit=None):
+        slot_ids = sorted(slot_id for slot_id in self.parkings.keys() if slot_id > after_slot_id)
+        for slot_id in slot_ids[:limit]:
+            # Skips the slots left since the status was started (by another thread)
+            parking = self.parkings.get(slot_id)
+            if parking is None:
+                continue
+            registration_number, colour = parking
+            yield {
+                "slot_id": slot_id,
+                "registration_number": registration_number,
+                "colour": colour,
+            }
+
+    def info_for_vehicles_with_colour(self, colour, info):
+        slot_ids = list(self.slots_by_colour.get(colour_key(colour), []))
+        if info == 'slot_id':
+            return slot_ids
+        # Skips the slots left meanwhile (by another thread)
+        parkings = [self.parkings.get(slot_id) for slot_id in slot_ids]
+        return [parking[0] for parking in parkings if parking is not None]
+
+    def slot_number_for_registration_number(self, registration_number):
+        return self.slot_by_registration_number.get(registration_number, -1)
+
+    def search_registration_numbers(self, pattern):
+        # The candidates are those starting with the literal prefix of the pattern, or ending with its literal suffix
+        prefix, suffix = registration_affixes(pattern)
+        if prefix and len(prefix) >= len(suffix):
+            candidates = _with_prefix(self.registration_numbers, prefix)
+        elif suffix:
+            candidates = [reversed_registration_number(value) for value in _with_prefix(self.reversed_registration_numbers, reversed_registration_number(suffix))]
+        else:
+            candidates = list(self.registration_numbers)
+
+        # Matched case sensitively like fnmatch.fnmatchcase, with the pattern compiled once
+        match = re.compile(fnmatch.translate(pattern)).match
+        parkings = []
+        for registration_number in (candidate for candidate in candidates if match(candidate)):
+            slot_id = self.slot_by_registration_number.get(registration_number)
+            parking = self.parkings.get(slot_id)
+            # Skips the vehicles left meanwhile (by another thread)
+            if parking is not None:
+                parkings.append({
+                    "slot_id": slot_id,
+                    "registration_number": registration_number,
+                    "colour": parking[1],
+                })
+        return sorted(parkings, key=lambda parking: parking['slot_id'])
+
+    def occupancy(self):
+        # The parkings and the slots are counted by their dicts and set
+        return len(self.parkings), self.number_of_slots-len(self.inactive_slots)
+
+    def count_vehicles_with_colour(self, colour):
+        return len(self.slots_by_colour.get(colour_key(colour), []))
+
+    def check_consistency(self):
+        # The counts of the lookups and of the free slots are checked against a recount of the parkings
+        counted_colours = {}
+        for _, colour in self.parkings.values():
+            counted_colours[colour_key(colour)] = counted_colours.get(colour_key(colour), 0)+1
+        parked_vehicles, active_slots = self.occupancy()
+        parked_in_inactive_slots = sum(1 for slot_id in self.parkings if slot_id in self.inactive_slots)
+        counters = [
+            ('registration_numbers', len(self.slot_by_registration_number), parked_vehicles),
+            ('free_slots', len(self.free_slots), active_slots-parked_vehicles+parked_in_inactive_slots),
+        ]
+        counters.extend(('colour {}'.format(key), len(self.slots_by_colour.get(key, [])), counted_colours.get(key, 0))
+                        for key in sorted(set(self.slots_by_colour) | set(counted_colours)))
+        return [(counter, recorded, counted) for counter, recorded, counted in counters if recorded != counted]
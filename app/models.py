@@ -1,20 +1,206 @@
 from app import db
 
+class Lot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    generation = db.Column(db.Integer, default=0, nullable=False)  # Bumped by every change of the parking lot, so that processes sharing the database can tell their in-memory indexes are stale
+    # Counters of the parking lot, kept up to date in the transaction of every change
+    active_slots = db.Column(db.Integer, default=0, nullable=False, server_default=db.text('0'))
+    parked_vehicles = db.Column(db.Integer, default=0, nullable=False, server_default=db.text('0'))
+
+    def __repr__(self):
+        return '{}'.format(self.id)
+
+
+class LotColour(db.Model):
+    """
+    Number of parked vehicles of a colour in a lot, kept up to date like the counters of the Lot
+    """
+    lot_id = db.Column(db.Integer, db.ForeignKey('lot.id'), primary_key=True, autoincrement=False)
+    colour_key = db.Column(db.String(15), primary_key=True)
+    parked_vehicles = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return '{}'.format(self.colour_key)
+
+
+# Rows written without a lot, e.g. before lots were introduced, belong to the default lot (see app.utils.LOT_ID)
+DEFAULT_LOT_ID = 1
+
+
+# Types of the slots, the first one is that of the slots not laid out
+SLOT_TYPES = ('standard', 'compact', 'ev', 'disabled')
+
+# Distance between two levels, in the units of the slot coordinates
+LEVEL_DISTANCE = 100
+
+
+def distance(entrance, slot):
+    """
+    Walking distance from an entrance to a slot, along the aisles (Manhattan distance) and the ramps between the
+    levels
+
+    Parameters:
+    entrance (tuple): The (level, x, y) position of the entrance
+    slot (tuple): The (level, x, y) position of the slot
+
+    Returns:
+    int: The distance
+    """
+    return abs(entrance[0]-slot[0])*LEVEL_DISTANCE + abs(entrance[1]-slot[1]) + abs(entrance[2]-slot[2])
+
+
+def slot_range(slots):
+    """
+    The first and the last slot of a range of slots
+
+    Parameters:
+    slots (string): The range, `first-last` (e.g. `101-200`) or a single slot
+
+    Returns:
+    tuple: The first and the last slot ids, ValueError is raised for a malformed or empty range
+    """
+    first, _, last = slots.partition('-')
+    first_slot_id, last_slot_id = int(first), int(last or first)
+    if not 1 <= first_slot_id <= last_slot_id:
+        raise ValueError('Invalid range of slots {}'.format(slots))
+    return first_slot_id, last_slot_id
+
+
+def checked_number_of_slots(number_of_slots):
+    """
+    The number of slots of a parking lot, which has at least one
+
+    Parameters:
+    number_of_slots (int): The number of slots
+
+    Returns:
+    int: The number of slots, ValueError is raised if it is below 1
+    """
+    if number_of_slots < 1:
+        raise ValueError('Invalid number of slots {}'.format(number_of_slots))
+    return number_of_slots
+
+
 class Slot(db.Model):
-    id = db.Column(db.Integer, primary_key=True)  # (Re-)Using the PK (id) for slot numbers
+    lot_id = db.Column(db.Integer, db.ForeignKey('lot.id'), primary_key=True, autoincrement=False, server_default=db.text('{}'.format(DEFAULT_LOT_ID)))
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # (Re-)Using the PK (lot_id, id) for slot numbers, numbered per lot
     parkings = db.relationship('Parking', backref='slot', lazy=True)
     active = db.Column(db.Boolean, default=True, nullable=False)  # A slot can be marked
+    # Position and type of the slot, for the allocation of the slot nearest an entrance
+    level = db.Column(db.Integer, default=0, nullable=False, server_default=db.text('0'))
+    x = db.Column(db.Integer, default=0, nullable=False, server_default=db.text('0'))
+    y = db.Column(db.Integer, default=0, nullable=False, server_default=db.text('0'))
+    slot_type = db.Column(db.String(10), default=SLOT_TYPES[0], nullable=False, server_default=SLOT_TYPES[0])
 
     def __repr__(self):
         return '{}'.format(self.id)
 
 
+class Entrance(db.Model):
+    lot_id = db.Column(db.Integer, db.ForeignKey('lot.id'), primary_key=True, autoincrement=False)
+    name = db.Column(db.String(20), primary_key=True)
+    level = db.Column(db.Integer, nullable=False)
+    x = db.Column(db.Integer, nullable=False)
+    y = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '{}'.format(self.name)
+
+
+def colour_key(colour):
+    """
+    The key colours are matched on, case insensitively and without the surrounding whitespace
+    """
+    return colour.strip().lower()
+
+
+def reversed_registration_number(registration_number):
+    """
+    The registration number read backwards, registration numbers ending alike are next to each other in its order
+    """
+    return registration_number[::-1]
+
+
+# Characters of the wildcards of a registration number search (see fnmatch)
+WILDCARDS = '*?['
+
+def registration_affixes(pattern):
+    """
+    The literal prefix and suffix of a registration number search pattern, which the searches narrow the candidate
+    registration numbers to
+
+    Parameters:
+    pattern (string): The pattern, with the wildcards of fnmatch
+
+    Returns:
+    tuple: The prefix and the suffix, both the whole pattern if it has no wildcard
+    """
+    wildcards = [index for index, character in enumerate(pattern) if character in WILDCARDS]
+    if not wildcards:
+        return pattern, pattern
+    # A character set ends with the last `]` of the pattern
+    last = max(wildcards[-1], pattern.rfind(']') if '[' in pattern else -1)
+    return pattern[:wildcards[0]], pattern[last+1:]
+
+
 class Parking(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    slot_id = db.Column(db.Integer, db.ForeignKey('slot.id'), nullable=False)
-    registration_number = db.Column(db.String(20), nullable=False, index=True)  # Longest registration number is assumed to be of max length 20 including '-'
-    colour = db.Column(db.String(15), nullable=False, index=True)  # Colour length assumed to be max 15
+    lot_id = db.Column(db.Integer, nullable=False, server_default=db.text('{}'.format(DEFAULT_LOT_ID)))
+    slot_id = db.Column(db.Integer, nullable=False)
+    registration_number = db.Column(db.String(20), nullable=False)  # Longest registration number is assumed to be of max length 20 including '-'
+    colour = db.Column(db.String(15), nullable=False)  # Colour length assumed to be max 15
+    colour_key = db.Column(db.String(15), nullable=False, default=lambda context: colour_key(context.get_current_parameters()['colour']))  # Normalised colour, set at park time
     active = db.Column(db.Boolean, default=True, nullable=False)
+    reversed_registration_number = db.Column(db.String(20), nullable=False, server_default='',
+                                             default=lambda context: reversed_registration_number(context.get_current_parameters()['registration_number']))  # For the suffix searches
+    # Times the vehicle entered and left, in seconds since the epoch (UTC), for the billing. Parkings from before they
+    # were recorded have none.
+    entered_at = db.Column(db.Integer)
+    exited_at = db.Column(db.Integer)
+
+    # Closed parkings are moved to ParkingHistory by compaction. Until then, the partial indexes keep them out of the
+    # hot lookups, which filter on `active = 1`. Being unique, they also guarantee that a slot is never allocated twice
+    # and a vehicle is never parked twice in a lot, even with concurrent writers.
+    __table_args__ = (
+        db.ForeignKeyConstraint(['lot_id', 'slot_id'], ['slot.lot_id', 'slot.id']),
+        db.Index('ix_parking_active_colour_key_slot_id', 'active', 'lot_id', 'colour_key', 'slot_id'),  # Colour lookups are ordered index range scans
+        db.Index('ix_parking_active_registration_number', 'lot_id', 'registration_number', unique=True, sqlite_where=db.text('active = 1')),
+        db.Index('ix_parking_active_slot_id', 'lot_id', 'slot_id', unique=True, sqlite_where=db.text('active = 1')),
+        db.Index('ix_parking_active_reversed_registration_number', 'lot_id', 'reversed_registration_number', sqlite_where=db.text('active = 1')),
+        # Ids are never reused, even once the parkings with the highest ids are compacted: the ids of ParkingHistory
+        # stay unique, and a restore tells the parkings closed before a snapshot by their ids
+        {'sqlite_autoincrement': True},
+    )
+
+    def __repr__(self):
+        return '{}'.format(self.registration_number)
+
+
+class ParkingHistory(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # Same as the id of the closed Parking
+    lot_id = db.Column(db.Integer, nullable=False, server_default=db.text('{}'.format(DEFAULT_LOT_ID)))
+    slot_id = db.Column(db.Integer, nullable=False)
+    registration_number = db.Column(db.String(20), nullable=False)
+    colour = db.Column(db.String(15), nullable=False)
+    colour_key = db.Column(db.String(15), nullable=False)
+    entered_at = db.Column(db.Integer)
+    exited_at = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.ForeignKeyConstraint(['lot_id', 'slot_id'], ['slot.lot_id', 'slot.id']),
+    )
 
     def __repr__(self):
         return '{}'.format(self.registration_number)
+
+
+class Shard(db.Model):
+    """
+    The shard a database belongs to (see app.shards), recorded when its worker first opens it: the lots of the
+    database are only run by their worker if they are sharded over the same number of shards
+    """
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    number_of_shards = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '{}/{}'.format(self.id, self.number_of_shards)
@@ -0,0 +1,67 @@
+import os
+import signal
+import socket
+import sys
+
+from werkzeug.serving import make_server
+
+from app import db, parking_lot, utils
+
+# Pending connections queued by the listening socket
+LISTEN_BACKLOG = 128
+
+
+def serve_worker(host, port, fd):
+    """
+    Serves the app on the listening socket, a thread per request
+
+    Parameters:
+    host (string): The host the socket is bound to
+    port (int): The port the socket is bound to
+    fd (int): File descriptor of the listening socket, None to bind a new socket
+    """
+    # Connections opened before a fork must not be shared, and the free slot indexes are rebuilt by the worker
+    db.engine.dispose()
+    utils.invalidate_free_slots()
+    make_server(host, port, parking_lot, threaded=True, fd=fd).serve_forever()
+
+def serve(host, port, processes):
+    """
+    Serves the JSON API with threaded workers. With several processes, the workers are forked up front and accept
+    connections on the same listening socket, each keeping its free slot index across requests.
+
+    Parameters:
+    host (string): The host to bind
+    port (int): The port to bind
+    processes (int): The number of worker processes
+    """
+    if processes == 1:
+        serve_worker(host, port, None)
+        return
+
+    listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listening_socket.bind((host, port))
+    listening_socket.listen(LISTEN_BACKLOG)
+
+    worker_pids = []
+    for _ in xrange(processes):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve_worker(host, port, listening_socket.fileno())
+            finally:
+                os._exit(0)
+        worker_pids.append(pid)
+
+    # Stopping the parent stops the workers
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for _ in worker_pids:
+            os.wait()
+    finally:
+        for pid in worker_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:  # Already exited
+                pass
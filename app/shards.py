@@ -0,0 +1,217 @@
+import logging
+import multiprocessing
+
+from app import db, models, parking_lot, utils
+from app.commands import CommandError, split_lot_prefix
+from app.gate_server import UNAVAILABLE_MESSAGE
+
+# Commands sent to a worker at a time, run in a single transaction
+SHARD_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(lot_id, number_of_shards):
+    """
+    The shard running a lot
+
+    Parameters:
+    lot_id (int): The lot
+    number_of_shards (int): The number of shards
+
+    Returns:
+    int: The shard, from 0
+    """
+    return lot_id % number_of_shards
+
+def lot_of(command_input):
+    """
+    The lot of a command input
+
+    Parameters:
+    command_input (string): The command given in the parking lot game
+
+    Returns:
+    int: The lot given with LOT_PREFIX, the default lot otherwise. Invalid lot prefixes go to the default lot as well,
+    whose worker answers with the error.
+    """
+    try:
+        lot_id, _ = split_lot_prefix(command_input.split())
+    except CommandError:
+        lot_id = None
+    return lot_id or utils.LOT_ID
+
+def check_shard(shard, number_of_shards):
+    """
+    Records the shard of a new shard database, or checks the shard of an existing one. A database sharded over another
+    number of shards holds lots that other shards would now run, e.g. `lot_id % 2` is not `lot_id % 3`.
+
+    Parameters:
+    shard (int): The shard of the worker
+    number_of_shards (int): The number of shards
+
+    Returns:
+    string: The error, None if the database belongs to the shard
+    """
+    recorded = models.Shard.query.first()
+    if recorded is None:
+        db.session.add(models.Shard(id=shard, number_of_shards=number_of_shards))
+        db.session.commit()
+    elif (recorded.id, recorded.number_of_shards) != (shard, number_of_shards):
+        return 'The database of shard {} belongs to shard {} of {} shards, not of {}'.format(shard, recorded.id, recorded.number_of_shards, number_of_shards)
+    return None
+
+def run_shard_batch(command_inputs):
+    """
+    Runs a batch of commands in the worker of a shard. With the SQL storage backend, the batch is a single transaction
+    and every command runs in its own savepoint, like the writes of the gate server.
+
+    Parameters:
+    command_inputs (list): The commands given in the parking lot game
+
+    Returns:
+    list: The message of every command
+    """
+    if utils.current_storage_backend() != 'sql':
+        messages = [utils.process_command_input(command_input) for command_input in command_inputs]
+        db.session.commit()
+        return messages
+
+    messages = []
+    try:
+        utils.begin_write()
+        for command_input in command_inputs:
+            savepoint = db.session.begin_nested()
+            messages.append(utils.process_command_input(command_input))
+            if savepoint.is_active:
+                savepoint.commit()
+        db.session.commit()
+    except Exception:
+        logger.exception('Shard batch failed: %r', command_inputs)
+        db.session.rollback()
+        utils.invalidate_free_slots()
+        return [UNAVAILABLE_MESSAGE]*len(command_inputs)
+    return messages
+
+def run_shard(shard, number_of_shards, database_uri, connection):
+    """
+    Worker process of a shard: checks the database of the shard (see check_shard) and sends back the error, None if
+    it belongs to the shard. It then runs the batches of commands received on the connection, until None is received,
+    and sends back their messages.
+
+    Parameters:
+    shard (int): The shard of the worker
+    number_of_shards (int): The number of shards
+    database_uri (string): The SQL Alchemy database URI of the shard, created if it does not exist
+    connection (Connection): The pipe to the pool
+    """
+    # The parent's connections and lots must not be shared with the worker, which owns its shard
+    db.engine.dispose()
+    parking_lot.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    if parking_lot.config['JOURNAL_PATH']:
+        parking_lot.config['JOURNAL_PATH'] = '{}.shard{}'.format(parking_lot.config['JOURNAL_PATH'], shard)
+    utils.forget_lots()
+    try:
+        db.create_all()
+        error = check_shard(shard, number_of_shards)
+        connection.send(error)
+        if error:
+            return
+        if parking_lot.config['JOURNAL_PATH'] and parking_lot.config['STORAGE_BACKEND'] == 'memory':
+            utils.recover_parking_lot()
+
+        for command_inputs in iter(connection.recv, None):
+            connection.send(run_shard_batch(command_inputs))
+    finally:
+        db.session.remove()
+        connection.close()
+
+
+class ShardPool(object):
+    """
+    Worker processes running the commands of independent lots in parallel, so that the throughput scales with the
+    cores
+
+    Lots are sharded over the workers by lot id (see shard_of). A lot is only ever run by the worker of its shard,
+    which owns the database of the shard and, with the memory storage backend, the memory parking lots of its lots.
+    The commands of a lot run in the order they are given, those of different lots in parallel. The databases record
+    their shard, so that the lots are never run over another number of shards than that they were created with.
+    """
+
+    def __init__(self, number_of_shards, database_uri=None):
+        """
+        Starts the workers, ValueError is raised if a database belongs to another shard
+
+        Parameters:
+        number_of_shards (int): The number of worker processes
+        database_uri (string): The SQL Alchemy database URI of the shards, formatted with the shard number,
+            SHARD_DATABASE_URI by default
+        """
+        database_uri = database_uri or parking_lot.config['SHARD_DATABASE_URI']
+        self.number_of_shards = number_of_shards
+        self.connections = []
+        self.processes = []
+        for shard in xrange(number_of_shards):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_shard, args=(shard, number_of_shards, database_uri.format(shard=shard), worker_connection))
+            process.daemon = True
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+        errors = []
+        for shard, connection in enumerate(self.connections):
+            try:
+                errors.append(connection.recv())
+            except EOFError:
+                errors.append('The worker of shard {} exited'.format(shard))
+        errors = [error for error in errors if error]
+        if errors:
+            self.close()
+            raise ValueError('\n'.join(errors))
+
+    def run_commands(self, command_inputs):
+        """
+        Runs commands on the workers of their lots. Every worker is sent SHARD_BATCH_SIZE commands at a time, the
+        workers run their batches in parallel.
+
+        Parameters:
+        command_inputs (list): The commands given in the parking lot game
+
+        Returns:
+        list: The message of every command, in the order of the commands
+        """
+        batches = [[] for _ in xrange(self.number_of_shards)]  # (index, command_input) pairs, by shard
+        for index, command_input in enumerate(command_inputs):
+            batches[shard_of(lot_of(command_input), self.number_of_shards)].append((index, command_input))
+
+        messages = [None]*len(command_inputs)
+        for start in xrange(0, max(len(batch) for batch in batches), SHARD_BATCH_SIZE):
+            sent = []
+            for shard, batch in enumerate(batches):
+                chunk = batch[start:start+SHARD_BATCH_SIZE]
+                if chunk:
+                    self.connections[shard].send([command_input for _, command_input in chunk])
+                    sent.append((shard, chunk))
+            for shard, chunk in sent:
+                try:
+                    chunk_messages = self.connections[shard].recv()
+                except EOFError:
+                    raise RuntimeError('The worker of shard {} exited'.format(shard))
+                for (index, _), message in zip(chunk, chunk_messages):
+                    messages[index] = message
+        return messages
+
+    def close(self):
+        """
+        Stops the workers, once they are done with their commands
+        """
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except IOError:  # The worker exited
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join()
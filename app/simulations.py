@@ -0,0 +1,146 @@
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import timeit
+from cStringIO import StringIO
+
+from app import db, parking_lot, utils
+
+# Name of the summary written next to the outputs of the runs
+SUMMARY_FILE_NAME = 'summary.json'
+
+logger = logging.getLogger(__name__)
+
+
+def simulation_files(directory):
+    """
+    The input files of a simulation
+
+    Parameters:
+    directory (string): The directory of the input files, its subdirectories are left out
+
+    Returns:
+    list: The paths of the files, the largest first so that the longest runs start first and the workers finish
+    together
+    """
+    paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+    return sorted([path for path in paths if os.path.isfile(path)], key=os.path.getsize, reverse=True)
+
+def counted(lines, counter):
+    """
+    The lines, counted in counter[0] as they are read
+    """
+    for line in lines:
+        counter[0] += 1
+        yield line
+
+def run_simulation(file_path, database_dir=None, batch_size=1):
+    """
+    Runs an input file against a database of its own, created empty for the run and dropped after it, so that the
+    output is that of the file run alone on a new parking lot. The journal is disabled.
+
+    Parameters:
+    file_path (string): The input file
+    database_dir (string): The directory of the temporary database file, an in-memory database if None
+    batch_size (int): The number of commands per transaction
+
+    Returns:
+    dict: The file, its output, the number of commands read, the seconds taken and the error that stopped the run (None
+    if it ran to the end)
+    """
+    database_path = None
+    if database_dir:
+        handle, database_path = tempfile.mkstemp(prefix='parking_lot_simulation', suffix='.db', dir=os.path.abspath(database_dir))
+        os.close(handle)
+
+    # Nothing is shared with the previous run of the process: the connections (an in-memory database goes with its
+    # connection), the lots and the journal
+    db.session.remove()
+    db.engine.dispose()
+    parking_lot.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database_path if database_path else 'sqlite://'
+    parking_lot.config['JOURNAL_PATH'] = None
+    utils.forget_lots()
+
+    output = StringIO()
+    counter = [0]
+    error = None
+    start = timeit.default_timer()
+    try:
+        db.create_all()
+        with open(file_path, 'rU') as input_file:
+            utils.play_file(counted(input_file, counter), output, batch_size)
+    except Exception as exception:
+        logger.exception('Simulation of %s failed', file_path)
+        db.session.rollback()
+        error = '{}: {}'.format(type(exception).__name__, exception)
+    finally:
+        seconds = timeit.default_timer()-start
+        db.session.remove()
+        db.engine.dispose()
+        utils.forget_lots()
+        if database_path:
+            for path in [database_path, database_path + '-wal', database_path + '-shm']:
+                if os.path.exists(path):
+                    os.remove(path)
+    return dict(file=file_path, output=output.getvalue(), commands=counter[0], seconds=seconds, error=error)
+
+def run_simulation_arguments(arguments):
+    # Pool.imap_unordered passes a single argument
+    return run_simulation(*arguments)
+
+def run_simulations(file_paths, workers, database_dir=None, batch_size=1):
+    """
+    Runs input files in parallel, each in a worker process against a database of its own (see run_simulation)
+
+    Parameters:
+    file_paths (list): The input files
+    workers (int): The number of worker processes
+    database_dir (string): The directory of the temporary database files, in-memory databases if None
+    batch_size (int): The number of commands per transaction
+
+    Returns:
+    generator: The results of the runs (see run_simulation), in the order they finish
+    """
+    pool = multiprocessing.Pool(workers)
+    try:
+        # A file at a time, so that a worker done with a short file takes the next one
+        for result in pool.imap_unordered(run_simulation_arguments, [(file_path, database_dir, batch_size) for file_path in file_paths], 1):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def write_summary(output_dir, results, workers, wall_seconds):
+    """
+    Writes the output of every run to <output_dir>/<input file name>.out, and the summary of the runs to
+    <output_dir>/summary.json
+
+    Parameters:
+    output_dir (string): The directory of the outputs, created if it does not exist
+    results (list): The results of the runs (see run_simulation)
+    workers (int): The number of worker processes
+    wall_seconds (float): The seconds taken by all the runs
+
+    Returns:
+    dict: The summary: the totals (the seconds of all the runs in wall_seconds, the sum of their seconds in
+    run_seconds), and the input file, output file, commands, seconds and error of every run, by input file name
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    runs = []
+    for result in sorted(results, key=lambda result: result['file']):
+        output_path = os.path.join(output_dir, os.path.basename(result['file']) + '.out')
+        with open(output_path, 'w') as output_file:
+            output_file.write(result['output'])
+        runs.append(dict(file=result['file'], output=output_path, commands=result['commands'], seconds=round(result['seconds'], 6), error=result['error']))
+
+    summary = dict(workers=workers, files=len(runs), failed=sum(1 for run in runs if run['error']), commands=sum(run['commands'] for run in runs),
+                   wall_seconds=round(wall_seconds, 6), run_seconds=round(sum(run['seconds'] for run in runs), 6), runs=runs)
+    with open(os.path.join(output_dir, SUMMARY_FILE_NAME), 'w') as summary_file:
+        json.dump(summary, summary_file, indent=2, sort_keys=True)
+    return summary
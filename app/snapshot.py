@@ -0,0 +1,405 @@
+import array
+import fnmatch
+import mmap
+import os
+import struct
+import sys
+
+from app.models import SLOT_TYPES, colour_key, registration_affixes
+
+MAGIC = 'PLOTSNAP'
+VERSION = 4
+# Versions still read, version 2 has no slot layout nor entrances, version 3 no parking ids nor entry times
+READ_VERSIONS = (2, 3, VERSION)
+
+# magic, version, generation, journal sequence and offset, number of slots, number of parkings, number of colours,
+# number of colour keys and size of the string table
+HEADER = struct.Struct('<8sIqqqIIIII')
+UINT = struct.Struct('<I')
+LAST_PARKING_ID = struct.Struct('<q')
+STRING_LENGTH = struct.Struct('<H')
+
+# Flags of a slot
+ACTIVE = 1
+OCCUPIED = 2
+
+# Slots scanned at a time by the status
+STATUS_CHUNK_SIZE = 4096
+
+
+def _encode(string):
+    return string.encode('utf-8') if isinstance(string, unicode) else string
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+def _from_little_endian(typecode, data):
+    values = array.array(typecode)
+    values.fromstring(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def write_snapshot(snapshot_path, generation, slots, parkings, journal_sequence=0, journal_offset=0, layout=(), entrances=(), parking_times=(), last_parking_id=None):
+    """
+    Writes the parking lot to a snapshot file. The file is replaced atomically, a reader maps either the previous or
+    the new snapshot.
+
+    Layout, after the header, little endian:
+        registration offsets  uint32 per slot, into the string table
+        registration index    uint32 slot ids of the parkings, by registration number
+        colour key table      (string offset, first, count) uint32 triples, by colour key, of the colour slots
+        colour slots          uint32 slot ids of the parkings, by colour key and slot
+        colour names          uint32 string offset per colour id
+        colour ids            uint16 per slot
+        slot flags            uint8 per slot, ACTIVE and OCCUPIED
+        slot positions        int32 levels, then x and y coordinates, per slot
+        slot types            uint8 index in models.SLOT_TYPES per slot
+        parking ids           uint32 per slot, 0 for none or unknown
+        entry times           uint32 seconds since the epoch per slot, 0 for none or unknown
+        last parking id       int64, -1 if unknown
+        entrances             uint32 count, then (string offset, level, x, y) int32 quadruples
+        string table          strings, each after its uint16 length
+
+    Parameters:
+    snapshot_path (string): The path of the snapshot file
+    generation (int): The generation of the parking lot (see app.utils.lot_generation)
+    slots (iterable): (slot_id, active) pairs
+    parkings (iterable): (slot_id, registration_number, colour) triples of the active parkings
+    journal_sequence (int): The sequence of the last journaled command in the snapshot, for a checkpoint (see
+        app.journal)
+    journal_offset (int): The journal offset after that command
+    layout (iterable): (slot_id, level, x, y, slot_type) of the slots laid out, the others are at level 0, (0, 0) and
+        of the first slot type
+    entrances (iterable): (name, level, x, y) of the entrances
+    parking_times (iterable): (slot_id, parking_id, entered_at) of the active parkings, entered_at None if unknown
+    last_parking_id (int): The highest parking id of the lot, closed parkings included, None if unknown. With the
+        parking ids, it tells the parkings closed before the snapshot from the others (see
+        app.utils.restore_parking_lot).
+
+    Returns:
+    int: number of parkings written
+    """
+    slots = list(slots)
+    number_of_slots = max([slot_id for slot_id, _ in slots] or [0])
+    flags = array.array('B', [0])*number_of_slots
+    for slot_id, active in slots:
+        if active:
+            flags[slot_id-1] = ACTIVE
+
+    registration_offsets = array.array('I', [0])*number_of_slots
+    colour_ids = array.array('H', [0])*number_of_slots
+    strings = []
+    strings_size = [0]
+
+    def add_string(encoded):
+        offset = strings_size[0]
+        strings.append(STRING_LENGTH.pack(len(encoded)))
+        strings.append(encoded)
+        strings_size[0] += STRING_LENGTH.size+len(encoded)
+        return offset
+
+    colours = {}  # colour -> colour id
+    slots_by_colour_key = {}
+    registrations = []
+    for slot_id, registration_number, colour in parkings:
+        encoded = _encode(registration_number)
+        flags[slot_id-1] |= OCCUPIED
+        registration_offsets[slot_id-1] = add_string(encoded)
+        colour_id = colours.get(colour)
+        if colour_id is None:
+            colour_id = colours[colour] = len(colours)
+        colour_ids[slot_id-1] = colour_id
+        slots_by_colour_key.setdefault(_encode(colour_key(colour)), []).append(slot_id)
+        registrations.append((encoded, slot_id))
+    if len(colours) > 0xffff:
+        raise ValueError('Too many colours for a snapshot: {}'.format(len(colours)))
+
+    registrations.sort()
+    registration_index = array.array('I', [slot_id for _, slot_id in registrations])
+    colour_key_table = array.array('I')
+    colour_slots = array.array('I')
+    for key in sorted(slots_by_colour_key):
+        colour_key_table.extend([add_string(key), len(colour_slots), len(slots_by_colour_key[key])])
+        colour_slots.extend(sorted(slots_by_colour_key[key]))
+    colour_names = array.array('I', [0])*len(colours)
+    for colour, colour_id in colours.items():
+        colour_names[colour_id] = add_string(_encode(colour))
+
+    positions = array.array('i', [0])*(3*number_of_slots)
+    slot_types = array.array('B', [0])*number_of_slots
+    for slot_id, level, x, y, slot_type in layout:
+        positions[slot_id-1], positions[number_of_slots+slot_id-1], positions[2*number_of_slots+slot_id-1] = level, x, y
+        slot_types[slot_id-1] = SLOT_TYPES.index(slot_type)
+    parking_ids = array.array('I', [0])*number_of_slots
+    entry_times = array.array('I', [0])*number_of_slots
+    for slot_id, parking_id, entered_at in parking_times:
+        if parking_id > 0xffffffff:
+            raise ValueError('Parking id too large for a snapshot: {}'.format(parking_id))
+        parking_ids[slot_id-1], entry_times[slot_id-1] = parking_id, entered_at or 0
+    entrances = list(entrances)
+    entrance_table = array.array('i', [len(entrances)])
+    for name, level, x, y in entrances:
+        entrance_table.extend([add_string(_encode(name)), level, x, y])
+
+    temporary_path = '{}.tmp'.format(snapshot_path)
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, VERSION, generation, journal_sequence, journal_offset, number_of_slots, len(registrations), len(colours), len(slots_by_colour_key), strings_size[0]))
+        for values in [registration_offsets, registration_index, colour_key_table, colour_slots, colour_names, colour_ids, flags, positions, slot_types, parking_ids, entry_times]:
+            snapshot_file.write(_little_endian(values))
+        snapshot_file.write(LAST_PARKING_ID.pack(-1 if last_parking_id is None else last_parking_id))
+        snapshot_file.write(_little_endian(entrance_table))
+        snapshot_file.write(''.join(strings))
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.rename(temporary_path, snapshot_path)
+
+    return len(registrations)
+
+
+class MappedSnapshot(object):
+    """
+    Read-only parking lot, memory-mapped from a snapshot file (see write_snapshot)
+
+    Nothing is loaded up front: the read operations of MemoryParkingLot are answered from the mapped arrays, the slot of
+    a registration number and the slots of a colour by binary search. The pages of the file are read on demand by the
+    operating system, so the reads can be served right after a restart.
+    """
+
+    def __init__(self, snapshot_path):
+        with open(snapshot_path, 'rb') as snapshot_file:
+            self._map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            self._map.close()
+            raise ValueError('{} is not a parking lot snapshot'.format(snapshot_path))
+        magic, version, self.generation, self.journal_sequence, self.journal_offset, self.number_of_slots, self.number_of_parkings, number_of_colours, number_of_colour_keys, strings_size = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version not in READ_VERSIONS:
+            self._map.close()
+            raise ValueError('{} is not a parking lot snapshot'.format(snapshot_path))
+
+        # Offsets of the arrays
+        self._registration_offsets = HEADER.size
+        self._registration_index = self._registration_offsets + 4*self.number_of_slots
+        self._colour_key_table = self._registration_index + 4*self.number_of_parkings
+        self._colour_slots = self._colour_key_table + 12*number_of_colour_keys
+        self._colour_names = self._colour_slots + 4*self.number_of_parkings
+        self._colour_ids = self._colour_names + 4*number_of_colours
+        self._flags = self._colour_ids + 2*self.number_of_slots
+        self._positions = self._flags + self.number_of_slots
+        self.last_parking_id = None
+        self._parking_ids = None
+        if version == 2:
+            self._slot_types = self._slot_types_end = self._entrances = self._strings = self._positions
+            self.number_of_entrances = 0
+        else:
+            self._slot_types = self._positions + 12*self.number_of_slots
+            self._slot_types_end = self._entrances = self._slot_types + self.number_of_slots
+            if version >= 4:
+                self._parking_ids = self._slot_types_end
+                self._entry_times = self._parking_ids + 4*self.number_of_slots
+                last_parking_id = LAST_PARKING_ID.unpack_from(self._map, self._entry_times + 4*self.number_of_slots)[0]
+                self.last_parking_id = None if last_parking_id < 0 else last_parking_id
+                self._entrances = self._entry_times + 4*self.number_of_slots + LAST_PARKING_ID.size
+            self.number_of_entrances = UINT.unpack_from(self._map, self._entrances)[0]
+            self._strings = self._entrances + 4 + 16*self.number_of_entrances
+        self.number_of_colour_keys = number_of_colour_keys
+        self.colours = [self._string(offset) for offset in _from_little_endian('I', self._map[self._colour_names:self._colour_ids])]
+        self._active_slots = None
+
+    def close(self):
+        self._map.close()
+
+    def _uint(self, offset, index):
+        return UINT.unpack_from(self._map, offset + 4*index)[0]
+
+    def _bytes(self, offset):
+        start = self._strings + offset
+        length = STRING_LENGTH.unpack_from(self._map, start)[0]
+        return self._map[start+STRING_LENGTH.size:start+STRING_LENGTH.size+length]
+
+    def _string(self, offset):
+        return self._bytes(offset).decode('utf-8')
+
+    def _registration_number(self, slot_id):
+        return self._string(self._uint(self._registration_offsets, slot_id-1))
+
+    def _colour(self, slot_id):
+        return self.colours[struct.unpack_from('<H', self._map, self._colour_ids + 2*(slot_id-1))[0]]
+
+    def slots(self):
+        """
+        Returns:
+        generator: (slot_id, active) pairs
+        """
+        flags = self._map[self._flags:self._flags+self.number_of_slots]
+        for slot_id in xrange(1, self.number_of_slots+1):
+            yield slot_id, bool(ord(flags[slot_id-1]) & ACTIVE)
+
+    def layout(self):
+        """
+        Returns:
+        generator: (slot_id, level, x, y, slot_type) of the slots laid out, see write_snapshot
+        """
+        # Empty in a version 2 snapshot
+        positions = _from_little_endian('i', self._map[self._positions:self._slot_types])
+        slot_types = self._map[self._slot_types:self._slot_types_end]
+        for index in xrange(len(slot_types)):
+            level, x, y = positions[index], positions[self.number_of_slots+index], positions[2*self.number_of_slots+index]
+            slot_type = ord(slot_types[index])
+            if level or x or y or slot_type:
+                yield index+1, level, x, y, SLOT_TYPES[slot_type]
+
+    def entrances(self):
+        """
+        Returns:
+        generator: (name, level, x, y) of the entrances
+        """
+        table = _from_little_endian('i', self._map[self._entrances+4:self._entrances+4+16*self.number_of_entrances])
+        for index in xrange(self.number_of_entrances):
+            yield self._string(table[4*index]), table[4*index+1], table[4*index+2], table[4*index+3]
+
+    def parkings(self):
+        """
+        Returns:
+        generator: (slot_id, registration_number, colour) triples of the parkings, by slot
+        """
+        # The arrays are copied in once, instead of unpacking slot by slot
+        flags = self._map[self._flags:self._flags+self.number_of_slots]
+        registration_offsets = _from_little_endian('I', self._map[self._registration_offsets:self._registration_index])
+        colour_ids = _from_little_endian('H', self._map[self._colour_ids:self._flags])
+        strings = self._map[self._strings:]
+        for index, flag in enumerate(flags):
+            if ord(flag) & OCCUPIED:
+                start = registration_offsets[index]
+                length = STRING_LENGTH.unpack_from(strings, start)[0]
+                yield index+1, strings[start+STRING_LENGTH.size:start+STRING_LENGTH.size+length].decode('utf-8'), self.colours[colour_ids[index]]
+
+    def parking_times(self):
+        """
+        Returns:
+        generator: (slot_id, parking_id, entered_at) of the parkings, by slot, None for an unknown id or time (none
+        are known before version 4)
+        """
+        if self._parking_ids is None:
+            return
+        flags = self._map[self._flags:self._flags+self.number_of_slots]
+        parking_ids = _from_little_endian('I', self._map[self._parking_ids:self._entry_times])
+        entry_times = _from_little_endian('I', self._map[self._entry_times:self._entry_times+4*self.number_of_slots])
+        for index, flag in enumerate(flags):
+            if ord(flag) & OCCUPIED:
+                yield index+1, parking_ids[index] or None, entry_times[index] or None
+
+    def parking_lot_status(self, after_slot_id=0, limit=None):
+        slot_id = max(after_slot_id, 0)+1
+        while slot_id <= self.number_of_slots and limit != 0:
+            flags = self._map[self._flags+slot_id-1:self._flags+min(slot_id-1+STATUS_CHUNK_SIZE, self.number_of_slots)]
+            for index, flag in enumerate(flags):
+                if ord(flag) & OCCUPIED and limit != 0:
+                    yield {
+                        "slot_id": slot_id+index,
+                        "registration_number": self._registration_number(slot_id+index),
+                        "colour": self._colour(slot_id+index),
+                    }
+                    if limit is not None:
+                        limit -= 1
+            slot_id += len(flags)
+
+    def active_slots(self):
+        """
+        Returns:
+        int: The number of active slots, counted once
+        """
+        if self._active_slots is None:
+            flags = self._map[self._flags:self._flags+self.number_of_slots]
+            self._active_slots = flags.count(chr(ACTIVE)) + flags.count(chr(ACTIVE | OCCUPIED))
+        return self._active_slots
+
+    def colour_counts(self):
+        """
+        Returns:
+        generator: (colour_key, number of parkings) pairs, by colour key
+        """
+        for index in xrange(self.number_of_colour_keys):
+            yield self._string(self._uint(self._colour_key_table, 3*index)), self._uint(self._colour_key_table, 3*index+2)
+
+    def _colour_slots_range(self, colour):
+        # (first, count) of the slots of the colour in the colour slots, found by binary search of the colour key table
+        key = _encode(colour_key(colour))
+        low, high = 0, self.number_of_colour_keys
+        while low < high:
+            middle = (low+high)//2
+            if self._bytes(self._uint(self._colour_key_table, 3*middle)) < key:
+                low = middle+1
+            else:
+                high = middle
+        if low == self.number_of_colour_keys or self._bytes(self._uint(self._colour_key_table, 3*low)) != key:
+            return 0, 0
+        return self._uint(self._colour_key_table, 3*low+1), self._uint(self._colour_key_table, 3*low+2)
+
+    def occupancy(self):
+        return self.number_of_parkings, self.active_slots()
+
+    def count_vehicles_with_colour(self, colour):
+        return self._colour_slots_range(colour)[1]
+
+    def check_consistency(self):
+        # The header counts are checked against the slot flags
+        flags = self._map[self._flags:self._flags+self.number_of_slots]
+        counted = flags.count(chr(OCCUPIED)) + flags.count(chr(ACTIVE | OCCUPIED))
+        counters = [
+            ('parked_vehicles', self.number_of_parkings, counted),
+            ('colour_slots', sum(count for _, count in self.colour_counts()), counted),
+        ]
+        return [(counter, recorded, counted) for counter, recorded, counted in counters if recorded != counted]
+
+    def info_for_vehicles_with_colour(self, colour, info):
+        first, count = self._colour_slots_range(colour)
+        if not count:
+            return []
+        slot_ids = list(struct.unpack_from('<{}I'.format(count), self._map, self._colour_slots + 4*first))
+        if info == 'slot_id':
+            return slot_ids
+        return [self._registration_number(slot_id) for slot_id in slot_ids]
+
+    def _first_registration_index(self, encoded):
+        # Index of the first registration number not before the given one, by binary search of the registration index
+        low, high = 0, self.number_of_parkings
+        while low < high:
+            middle = (low+high)//2
+            slot_id = self._uint(self._registration_index, middle)
+            if self._bytes(self._uint(self._registration_offsets, slot_id-1)) < encoded:
+                low = middle+1
+            else:
+                high = middle
+        return low
+
+    def slot_number_for_registration_number(self, registration_number):
+        encoded = _encode(registration_number)
+        low = self._first_registration_index(encoded)
+        if low < self.number_of_parkings:
+            slot_id = self._uint(self._registration_index, low)
+            if self._bytes(self._uint(self._registration_offsets, slot_id-1)) == encoded:
+                return slot_id
+        return -1
+
+    def search_registration_numbers(self, pattern):
+        # The registration numbers starting with the literal prefix of the pattern are a range of the registration
+        # index, the other patterns scan it (there is no reversed index in the snapshot)
+        prefix = _encode(registration_affixes(pattern)[0])
+        parkings = []
+        for index in xrange(self._first_registration_index(prefix), self.number_of_parkings):
+            slot_id = self._uint(self._registration_index, index)
+            encoded = self._bytes(self._uint(self._registration_offsets, slot_id-1))
+            if not encoded.startswith(prefix):
+                break
+            registration_number = encoded.decode('utf-8')
+            if fnmatch.fnmatchcase(registration_number, pattern):
+                parkings.append({
+                    "slot_id": slot_id,
+                    "registration_number": registration_number,
+                    "colour": self._colour(slot_id),
+                })
+        return sorted(parkings, key=lambda parking: parking['slot_id'])
@@ -1,11 +1,34 @@
+import json
+import logging
 import os
+import shutil
+import socket
+import tempfile
+import threading
 import unittest
 
-from app import db, parking_lot, models, utils
+from StringIO import StringIO
 
-class ParkingLotTests(unittest.TestCase):
+import numpy
+from sqlalchemy.exc import IntegrityError
+
+from app import billing, db, parking_lot, models, shards, simulations, sqlite_pragmas, utils
+from app.commands import commands, register_command
+from app.free_slots import FreeSlotIndex, SlotRanges
+from app.daemon import LineProtocolHandler, ParkingLotDaemon, remove_stale_socket
+from app.gate_server import GateServer
+from app.instrumentation import Histogram, instrumentation
+from app.journal import Journal, read_frames
+from app.lookup_cache import LookupCache
+from app.memory import MemoryParkingLot
+from app.snapshot import MappedSnapshot
+from benchmarks import runner, workload
+
+class ParkingLotTestCase(unittest.TestCase):
     # TODO: This test class can be broken down into more classes and different files
 
+    storage_backend = 'sql'
+
     @classmethod
     def setUpClass(cls):
         # creates a test client
@@ -16,20 +39,62 @@ class ParkingLotTests(unittest.TestCase):
         # Change config to test configs
         parking_lot.config['TESTING'] = True
         parking_lot.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(parking_lot.config['BASEDIR'], parking_lot.config['TEST_DB'])
+        parking_lot.config['STORAGE_BACKEND'] = cls.storage_backend
         db.drop_all()
 
         cls.total_slots = 6
 
     @classmethod
     def tearDownClass(cls):
+        db.session.remove()
         db.drop_all()
 
     def setUp(self):
         db.create_all()
+        utils.forget_lots()
 
     def tearDown(self):
+        db.session.remove()
         db.drop_all()
 
+    def active_parkings_count(self):
+        if self.storage_backend == 'memory':
+            return len(utils.memory_lot.parkings)
+        return models.Parking.query.filter(models.Parking.active.is_(True)).count()
+
+    def active_slots_count(self):
+        if self.storage_backend == 'memory':
+            return utils.memory_lot.number_of_slots - len(utils.memory_lot.inactive_slots)
+        return models.Slot.query.filter(models.Slot.active.is_(True)).count()
+
+    def enable_journal(self, checkpoint_interval):
+        journal_directory = tempfile.mkdtemp()
+        journal_path = os.path.join(journal_directory, 'parking_lot.journal')
+        parking_lot.config['JOURNAL_PATH'] = journal_path
+        parking_lot.config['JOURNAL_CHECKPOINT_INTERVAL'] = checkpoint_interval
+
+        def disable_journal():
+            parking_lot.config['JOURNAL_PATH'] = None
+            utils.journals.pop(journal_path).close()
+            for file_name in os.listdir(journal_directory):
+                os.remove(os.path.join(journal_directory, file_name))
+            os.rmdir(journal_directory)
+        self.addCleanup(disable_journal)
+        return journal_path
+
+    def set_time(self, seconds):
+        utils.thread_clock.seconds = seconds
+        self.addCleanup(setattr, utils.thread_clock, 'seconds', None)
+
+    def park_vehicles(self):
+        utils.create_parking_lot(self.total_slots)
+        for registration_number, colour in [('KA-01-HH-1234', 'White'), ('KA-01-HH-9999', 'White'), ('KA-01-BB-0001', 'Black'),
+                                            ('KA-01-HH-7777', 'Red'), ('KA-01-HH-2701', 'Blue'), ('KA-01-HH-3141', 'Black')]:
+            utils.park_vehicle(registration_number, colour)
+
+
+class ParkingLotTests(ParkingLotTestCase):
+
     def test_create_parking_lot(self):
 
         # Create New Parking Lot
@@ -39,19 +104,53 @@ class ParkingLotTests(unittest.TestCase):
         self.assertEqual(utils.park_vehicle('KA-01-HH-1234', 'White'), 1)
 
         # Test count
-        self.assertEqual(models.Parking.query.filter(models.Parking.active.is_(True)).count(), 1)
+        self.assertEqual(self.active_parkings_count(), 1)
 
         # Test repeat call
         self.assertEqual(utils.create_parking_lot(self.total_slots), self.total_slots)
 
         # Test count
-        self.assertEqual(models.Parking.query.filter(models.Parking.active.is_(True)).count(), 0)
+        self.assertEqual(self.active_parkings_count(), 0)
+
+        # Test a parking lot without slots is refused, like malformed numbers
+        for command_input, number_of_slots in [('create_parking_lot -3', '-3'), ('create_parking_lot 0', '0'), ('create_parking_lot six', 'six'), ('resize_parking_lot 0', '0')]:
+            self.assertEqual(utils.process_command_input(command_input), 'Invalid Command. {} is not a valid number_of_slots'.format(number_of_slots))
+        # Test the storage functions refuse them too, for their other callers
+        for function, number_of_slots in [(utils.create_parking_lot, -3), (utils.create_parking_lot, 0), (utils.resize_parking_lot, 0), (utils.resize_parking_lot, -2)]:
+            with self.assertRaisesRegexp(ValueError, 'Invalid number of slots {}'.format(number_of_slots)):
+                function(number_of_slots)
+        self.assertEqual(self.active_slots_count(), self.total_slots)
+        self.assertEqual(utils.process_command_input('occupancy'), 'Occupied 0 of {} slots'.format(self.total_slots))
+        self.assertEqual(utils.process_command_input('check_consistency'), 'Counters are consistent')
+
+    def test_resize_parking_lot(self):
+        utils.create_parking_lot(self.total_slots)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1234', 'White'), 1)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-9999', 'White'), 2)
+
+        # Shrink the parking lot
+        self.assertEqual(utils.resize_parking_lot(3), 3)
+        self.assertEqual(self.active_slots_count(), 3)
+        self.assertEqual(utils.park_vehicle('KA-01-BB-0001', 'Black'), 3)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-7777', 'Red'), -1)
+
+        # Test shrinking below an occupied slot
+        self.assertEqual(utils.resize_parking_lot(2), -1)
+        self.assertEqual(self.active_slots_count(), 3)
+
+        # Grow the parking lot, re-activating the retired slots
+        self.assertEqual(utils.resize_parking_lot(8), 8)
+        self.assertEqual(self.active_slots_count(), 8)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-7777', 'Red'), 4)
+
+        # Test the parkings are kept
+        self.assertEqual(self.active_parkings_count(), 4)
 
     def test_park_vehicle(self):
         utils.create_parking_lot(self.total_slots)
 
         # Test initial count
-        self.assertEqual(models.Parking.query.filter(models.Parking.active.is_(True)).count(), 0)
+        self.assertEqual(self.active_parkings_count(), 0)
 
         # Test each slot allotment number
         self.assertEqual(utils.park_vehicle('KA-01-HH-1234', 'White'), 1)
@@ -62,7 +161,91 @@ class ParkingLotTests(unittest.TestCase):
         self.assertEqual(utils.park_vehicle('KA-01-HH-3141', 'Black'), 6)
 
         # Test final count
-        self.assertEqual(models.Parking.query.filter(models.Parking.active.is_(True)).count(), self.total_slots)
+        self.assertEqual(self.active_parkings_count(), self.total_slots)
+
+    def test_deactivate_slots(self):
+        utils.create_parking_lot(10)
+        for registration_number, colour in [('KA-01-HH-1234', 'White'), ('KA-01-HH-9999', 'White'), ('KA-01-BB-0001', 'Black')]:
+            utils.park_vehicle(registration_number, colour)
+
+        # Test the vehicles parked in the range are reported, and the range is skipped
+        self.assertEqual(utils.process_command_input('deactivate_slots 2-5'), 'Deactivated 4 slots, vehicles are still parked in them:\n'
+                                                                              'Slot No.    Registration No    Colour\n'
+                                                                              '2           KA-01-HH-9999      White\n'
+                                                                              '3           KA-01-BB-0001      Black')
+        self.assertEqual(utils.process_command_input('occupancy'), 'Occupied 3 of 6 slots')
+        self.assertEqual(utils.park_vehicle('KA-01-HH-7777', 'Red'), 6)
+
+        # Test the vehicles of the range can leave, the slots stay inactive
+        self.assertEqual(utils.process_command_input('leave 2'), 'Slot number 2 is free')
+        self.assertEqual(utils.process_command_input('leave 2'), 'The parking slot is inactive')
+        self.assertEqual(utils.park_vehicle('KA-01-HH-2701', 'Blue'), 7)
+        self.assertEqual(utils.process_command_input('deactivate_slots 4-12'), 'Deactivated 5 slots, vehicles are still parked in them:\n'
+                                                                               'Slot No.    Registration No    Colour\n'
+                                                                               '6           KA-01-HH-7777      Red\n'
+                                                                               '7           KA-01-HH-2701      Blue')
+        self.assertEqual(utils.process_command_input('deactivate_slots 9'), 'Deactivated 0 slots')
+        self.assertEqual(utils.park_vehicle('KA-01-HH-3141', 'Black'), -1)
+        self.assertEqual(utils.process_command_input('check_consistency'), 'Counters are consistent')
+
+        # Test activating a part of the ranges
+        self.assertEqual(utils.process_command_input('activate_slots 3-4'), 'Activated 2 slots')
+        self.assertEqual(utils.park_vehicle('KA-01-HH-3141', 'Black'), 4)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-3142', 'Black'), -1)
+        self.assertEqual(utils.process_command_input('activate_slots 1-10'), 'Activated 7 slots')
+        self.assertEqual(utils.park_vehicle('KA-01-HH-3142', 'Black'), 2)
+        self.assertEqual(utils.process_command_input('occupancy'), 'Occupied 6 of 10 slots')
+        self.assertEqual(utils.process_command_input('check_consistency'), 'Counters are consistent')
+
+        self.assertEqual(utils.process_command_input('deactivate_slots 5-2'), 'Invalid Command. 5-2 is not a valid slot_range')
+        self.assertEqual(utils.process_command_input('activate_slots two'), 'Invalid Command. two is not a valid slot_range')
+
+    def test_deactivate_slots_without_parking_lot(self):
+        # Test a lot without slots (and without counters) has no slot to (de)activate
+        self.assertEqual(utils.process_command_input('lot 2 deactivate_slots 1-2'), 'Deactivated 0 slots')
+        self.assertEqual(utils.process_command_input('lot 2 activate_slots 1-2'), 'Activated 0 slots')
+        self.assertEqual(utils.process_command_input('deactivate_slots 1'), 'Deactivated 0 slots')
+        self.assertEqual(utils.process_command_input('lot 2 create_parking_lot 2'), 'Created a parking lot with 2 slots')
+        self.assertEqual(utils.process_command_input('lot 2 deactivate_slots 1-2'), 'Deactivated 2 slots')
+        self.assertEqual(utils.process_command_input('lot 2 occupancy'), 'Occupied 0 of 0 slots')
+
+    def test_park_vehicle_entrance(self):
+        # Two levels of 5 slots, the last one for electric vehicles
+        utils.create_parking_lot(10)
+        self.assertEqual(utils.layout_slots(1, 5, 0, 0, 0, 'standard'), 5)
+        self.assertEqual(utils.process_command_input('layout_slots 6 9 1 0 0 standard'), 'Laid out 4 slots')
+        self.assertEqual(utils.process_command_input('layout_slots 10 12 1 4 0 ev'), 'Laid out 1 slots')
+        self.assertEqual(utils.process_command_input('layout_slots 1 2 0 0 0 truck'), 'Sorry, truck is not a slot type (standard, compact, ev, disabled)')
+        self.assertEqual(utils.process_command_input('add_entrance north 0 4 0'), 'Added entrance north')
+        self.assertEqual(utils.add_entrance('ramp', 1, 0, 0), 'ramp')
+
+        # Test the free slot of the type nearest the entrance is allocated, on the level of the entrance first
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1234', 'White', 'north'), 5)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-9999', 'White', 'north'), 4)
+        self.assertEqual(utils.process_command_input('park KA-01-BB-0001 Black ramp'), 'Allocated slot number: 6')
+        self.assertEqual(utils.process_command_input('park KA-01-HH-7777 Red north ev'), 'Allocated slot number: 10')
+        self.assertEqual(utils.park_vehicle('KA-01-HH-2701', 'Blue', 'north', 'ev'), -1)
+        self.assertEqual(utils.process_command_input('park KA-01-HH-2701 Blue south'), 'Sorry, there is no entrance south')
+        self.assertEqual(utils.process_command_input('park KA-01-HH-2701 Blue north truck'), 'Sorry, truck is not a slot type (standard, compact, ev, disabled)')
+        # Test the errors are checked in the same order by both storage backends: slot type, repeated parking, entrance
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1234', 'White', 'south', 'truck'), -4)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1234', 'White', None, 'truck'), -4)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1234', 'White', 'south'), -2)
+
+        # Test the queues of the entrances and the lowest numbered free slot share the free slots
+        self.assertEqual(utils.park_vehicle('KA-01-HH-2701', 'Blue'), 1)
+        self.assertTrue(utils.unpark_vehicle(5))
+        self.assertEqual(utils.park_vehicle('KA-01-HH-3141', 'Black', 'ramp'), 7)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-3142', 'Black', 'north'), 5)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-3143', 'Black', 'north'), 3)
+
+        # Test moving an entrance, and new slots
+        self.assertEqual(utils.add_entrance('north', 1, 9, 0), 'north')
+        self.assertEqual(utils.resize_parking_lot(11), 11)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-3144', 'Black', 'north'), 9)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-3145', 'Black', 'north'), 8)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-3146', 'Black', 'north'), 2)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-3147', 'Black', 'north'), 11)
 
     def test_repeated_park_vehicle(self):
         # Call test_park_vehicle to re-use code
@@ -72,7 +255,7 @@ class ParkingLotTests(unittest.TestCase):
         self.assertEqual(utils.park_vehicle('KA-01-HH-1234', 'White'), -2)
 
         # Test no change in count
-        self.assertEqual(models.Parking.query.filter(models.Parking.active.is_(True)).count(), self.total_slots)
+        self.assertEqual(self.active_parkings_count(), self.total_slots)
 
     def test_park_vehicle_full_parking(self):
         # Call test_park_vehicle to re-use code
@@ -82,7 +265,7 @@ class ParkingLotTests(unittest.TestCase):
         self.assertEqual(utils.park_vehicle('KA-01-HH-1235', 'White'), -1)
 
         # Test no change in count
-        self.assertEqual(models.Parking.query.filter(models.Parking.active.is_(True)).count(), self.total_slots)
+        self.assertEqual(self.active_parkings_count(), self.total_slots)
 
     def test_park_vehicle_first_empty(self):
         # Call test_park_vehicle to re-use code
@@ -94,20 +277,20 @@ class ParkingLotTests(unittest.TestCase):
         self.assertTrue(utils.unpark_vehicle(5))
 
         # Test the count after unparking
-        self.assertEqual(models.Parking.query.filter(models.Parking.active.is_(True)).count(), 3)
+        self.assertEqual(self.active_parkings_count(), 3)
 
         # Park the vehicle
         self.assertEqual(utils.park_vehicle('KA-01-HH-1235', 'White'), 2)
 
         # Test the count after parking
-        self.assertEqual(models.Parking.query.filter(models.Parking.active.is_(True)).count(), 4)
+        self.assertEqual(self.active_parkings_count(), 4)
 
         # Complete the parking
         self.assertEqual(utils.park_vehicle('KA-01-HH-9999', 'White'), 4)
         self.assertEqual(utils.park_vehicle('KA-01-HH-7777', 'Red'), 5)
 
         # Test final count
-        self.assertEqual(models.Parking.query.filter(models.Parking.active.is_(True)).count(), self.total_slots)
+        self.assertEqual(self.active_parkings_count(), self.total_slots)
 
     def test_unpark_vehicle(self):
         # Call test_park_vehicle to re-use code
@@ -119,29 +302,29 @@ class ParkingLotTests(unittest.TestCase):
         self.assertTrue(utils.unpark_vehicle(5))
 
         # Test the count after unparking
-        self.assertEqual(models.Parking.query.filter(models.Parking.active.is_(True)).count(), 3)
+        self.assertEqual(self.active_parkings_count(), 3)
 
         # Unpark the same slot
         self.assertTrue(utils.unpark_vehicle(4))
 
         # Test the count after unparking
-        self.assertEqual(models.Parking.query.filter(models.Parking.active.is_(True)).count(), 3)
+        self.assertEqual(self.active_parkings_count(), 3)
 
         # Unpark 100
         self.assertFalse(utils.unpark_vehicle(100))
 
         # Test the count after unparking
-        self.assertEqual(models.Parking.query.filter(models.Parking.active.is_(True)).count(), 3)
+        self.assertEqual(self.active_parkings_count(), 3)
 
 
     def test_parking_lot_status(self):
         # Initial empty parking lot
-        self.assertEqual(utils.parking_lot_status(), [])
+        self.assertEqual(list(utils.parking_lot_status()), [])
 
         # Call test_park_vehicle to re-use code
         self.test_park_vehicle()
         # Test full parking lot
-        self.assertEqual(utils.parking_lot_status(), [
+        self.assertEqual(list(utils.parking_lot_status()), [
             {"slot_id": 1, "registration_number": "KA-01-HH-1234", "colour": "White"},
             {"slot_id": 2, "registration_number": "KA-01-HH-9999", "colour": "White"},
             {"slot_id": 3, "registration_number": "KA-01-BB-0001", "colour": "Black"},
@@ -155,7 +338,7 @@ class ParkingLotTests(unittest.TestCase):
         self.assertTrue(utils.unpark_vehicle(2))
         self.assertTrue(utils.unpark_vehicle(5))
         # Test partial parking lot
-        self.assertEqual(utils.parking_lot_status(), [
+        self.assertEqual(list(utils.parking_lot_status()), [
             {"slot_id": 1, "registration_number": "KA-01-HH-1234", "colour": "White"},
             {"slot_id": 3, "registration_number": "KA-01-BB-0001", "colour": "Black"},
             {"slot_id": 6, "registration_number": "KA-01-HH-3141", "colour": "Black"},
@@ -164,7 +347,7 @@ class ParkingLotTests(unittest.TestCase):
         # Park the vehicle
         self.assertEqual(utils.park_vehicle('KA-01-HH-1235', 'White'), 2)
         # Test partial parking lot with new vehicle
-        self.assertEqual(utils.parking_lot_status(), [
+        self.assertEqual(list(utils.parking_lot_status()), [
             {"slot_id": 1, "registration_number": "KA-01-HH-1234", "colour": "White"},
             {"slot_id": 2, "registration_number": "KA-01-HH-1235", "colour": "White"},
             {"slot_id": 3, "registration_number": "KA-01-BB-0001", "colour": "Black"},
@@ -175,7 +358,7 @@ class ParkingLotTests(unittest.TestCase):
         self.assertEqual(utils.park_vehicle('KA-01-HH-9999', 'White'), 4)
         self.assertEqual(utils.park_vehicle('KA-01-HH-7777', 'Red'), 5)
         # Test full parking lot
-        self.assertEqual(utils.parking_lot_status(), [
+        self.assertEqual(list(utils.parking_lot_status()), [
             {"slot_id": 1, "registration_number": "KA-01-HH-1234", "colour": "White"},
             {"slot_id": 2, "registration_number": "KA-01-HH-1235", "colour": "White"},
             {"slot_id": 3, "registration_number": "KA-01-BB-0001", "colour": "Black"},
@@ -221,6 +404,23 @@ class ParkingLotTests(unittest.TestCase):
         # Test change in white
         self.assertEqual(utils.info_for_vehicles_with_colour("White", "slot_id"), [1, 4])  # White
 
+    def test_colour_key(self):
+        # Test the colours are matched case insensitively and without the surrounding whitespace
+        self.assertEqual([models.colour_key(colour) for colour in ['White', 'WHITE', ' white\t', 'wHiTe \n']], ['white']*4)
+        utils.create_parking_lot(self.total_slots)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1234', 'White'), 1)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-9999', ' WHITE '), 2)
+        self.assertEqual(utils.park_vehicle('KA-01-BB-0001', 'Black'), 3)
+        self.assertEqual(utils.info_for_vehicles_with_colour(' wHite\t', 'slot_id'), [1, 2])
+        self.assertEqual(utils.info_for_vehicles_with_colour('WHITE', 'registration_number'), ['KA-01-HH-1234', 'KA-01-HH-9999'])
+        self.assertEqual(utils.count_vehicles_with_colour('white '), 2)
+        self.assertEqual(utils.process_command_input('check_consistency'), 'Counters are consistent')
+
+        # Test the colour is kept as given, the searches use its key
+        if self.storage_backend == 'sql':
+            self.assertEqual(db.session.query(models.Parking.colour, models.Parking.colour_key).order_by(models.Parking.slot_id).all(),
+                             [('White', 'white'), (' WHITE ', 'white'), ('Black', 'black')])
+
     def test_slot_number_for_registration_number(self):
         # Call test_park_vehicle to re-use code
         self.test_park_vehicle()
@@ -271,9 +471,44 @@ class ParkingLotTests(unittest.TestCase):
         for input_string, output_string in input_output:
             self.assertEqual(utils.process_command_input(input_string), output_string)
 
+        self.assertEqual(utils.process_command_input('resize_parking_lot 3'), 'Sorry, slots beyond 3 are occupied')
+        self.assertEqual(utils.process_command_input('resize_parking_lot 10'), 'Resized the parking lot to 10 slots')
+
         self.assertEqual(utils.process_command_input('exit'), 0)
         self.assertEqual(utils.process_command_input(''), 0)
 
+    def test_invalid_commands(self):
+        utils.create_parking_lot(self.total_slots)
+        self.assertEqual(utils.process_command_input('fly KA-01-HH-1234'), 'Invalid Command')
+        self.assertEqual(utils.process_command_input('park KA-01-HH-1234'), 'Invalid Command. Usage: park <registration_number> <colour> [<entrance>] [<slot_type>]')
+        self.assertEqual(utils.process_command_input('leave one'), 'Invalid Command. one is not a valid slot_number')
+        self.assertEqual(utils.process_command_input('create_parking_lot'), 'Invalid Command. Usage: create_parking_lot <number_of_slots>')
+
+    def test_registered_command(self):
+        self.park_vehicles()
+
+        # Test a command registered by another module is dispatched, with its arguments parsed
+        self.addCleanup(commands.__setitem__, 'count_cars_with_colour', commands['count_cars_with_colour'])
+        register_command('count_cars_with_colour', lambda colour: len(utils.info_for_vehicles_with_colour(colour, 'slot_id')),
+                         [('colour', str)], lambda count, colour: '{} {} cars'.format(count, colour))
+        self.assertEqual(utils.process_command_input('count_cars_with_colour White'), '2 White cars')
+        self.assertEqual(utils.process_command_input('count_cars_with_colour'), 'Invalid Command. Usage: count_cars_with_colour <colour>')
+
+    def test_process_command_output(self):
+        output = StringIO()
+        self.assertIsNone(utils.process_command_output('create_parking_lot 6', output))
+        self.assertIsNone(utils.process_command_output('status', output))
+        self.assertIsNone(utils.process_command_output('park KA-01-HH-1234 White', output))
+        self.assertIsNone(utils.process_command_output('park KA-01-HH-9999 White', output))
+
+        # Test the streamed status is the same as the status message
+        status_output = StringIO()
+        self.assertIsNone(utils.process_command_output('status', status_output))
+        self.assertEqual(status_output.getvalue(), '{}\n'.format(utils.process_command_input('status')))
+
+        self.assertEqual(output.getvalue(), 'Created a parking lot with 6 slots\nParking Lot is empty\nAllocated slot number: 1\nAllocated slot number: 2\n')
+        self.assertEqual(utils.process_command_output('exit', output), 0)
+
     def test_process_command_input_file(self):
         output = [
             'Created a parking lot with 6 slots',
@@ -298,3 +533,960 @@ class ParkingLotTests(unittest.TestCase):
                 command_input = command_input.rstrip('\n').rstrip()
                 self.assertEqual(utils.process_command_input(command_input), output[output_index])
                 output_index += 1
+
+    def test_journal_recovery(self):
+        journal_path = self.enable_journal(4)
+        command_inputs = ['create_parking_lot 6', 'park KA-01-HH-1234 White', 'park KA-01-HH-9999 White', 'park KA-01-BB-0001 Black',
+                          'leave 2', 'status', 'park KA-01-HH-7777 Red', 'resize_parking_lot 8', 'leave 1', 'park KA-01-HH-2701 Blue']
+        for command_input in command_inputs:
+            utils.process_command_output(command_input, StringIO())
+        status = list(utils.parking_lot_status())
+
+        # Test the write commands are journaled, and a checkpoint written every 4 of them
+        entries = [json.loads(payload) for _, payload, _ in read_frames(journal_path)]
+        self.assertEqual([entry[2] if entry[0] == utils.TIME_PREFIX else entry[0] for entry in entries],
+                         [command_input.split()[0] for command_input in command_inputs if command_input != 'status'])
+        self.assertEqual(utils.command_journal().checkpoint_sequence, 8)
+
+        # Test the recovery restores the checkpoint and replays the commands after it, without journaling them again
+        with utils.without_journal():
+            utils.create_parking_lot(2)
+        self.assertEqual(utils.recover_parking_lot(), (2, 1))
+        self.assertEqual(list(utils.parking_lot_status()), status)
+        self.assertEqual(utils.command_journal().sequence, 9)
+
+        # Test the recovery without a checkpoint replays the whole journal
+        os.remove(utils.checkpoint_path(journal_path))
+        self.assertEqual(utils.recover_parking_lot(), (0, 9))
+        self.assertEqual(list(utils.parking_lot_status()), status)
+
+
+    def test_lot_scoped_commands(self):
+        self.assertEqual(utils.process_command_input('create_parking_lot 2'), 'Created a parking lot with 2 slots')
+        self.assertEqual(utils.process_command_input('lot 2 create_parking_lot 3'), 'Created a parking lot with 3 slots')
+
+        # Test the lots are independent: slots, registration numbers and colours are per lot
+        self.assertEqual(utils.process_command_input('park KA-01-HH-1234 White'), 'Allocated slot number: 1')
+        self.assertEqual(utils.process_command_input('lot 2 park KA-01-HH-1234 White'), 'Allocated slot number: 1')
+        self.assertEqual(utils.process_command_input('lot 2 park KA-01-HH-9999 White'), 'Allocated slot number: 2')
+        self.assertEqual(utils.process_command_input('lot 2 leave 1'), 'Slot number 1 is free')
+        self.assertEqual(utils.process_command_input('slot_number_for_registration_number KA-01-HH-1234'), '1')
+        self.assertEqual(utils.process_command_input('lot 2 slot_number_for_registration_number KA-01-HH-1234'), 'Not found')
+        self.assertEqual(utils.process_command_input('lot 2 registration_numbers_for_cars_with_colour White'), 'KA-01-HH-9999')
+        self.assertEqual(utils.process_command_input('lot 2 status'), 'Slot No.    Registration No    Colour\n2           KA-01-HH-9999      White')
+        self.assertEqual(utils.process_command_input('lot 3 status'), 'Parking Lot is empty')
+
+        # Test creating a lot again leaves the other lots as they are
+        self.assertEqual(utils.process_command_input('lot 2 create_parking_lot 1'), 'Created a parking lot with 1 slots')
+        self.assertEqual(utils.process_command_input('status'), 'Slot No.    Registration No    Colour\n1           KA-01-HH-1234      White')
+        self.assertEqual(list(utils.parking_lot_status(lot_id=2)), [])
+
+        # Test the invalid lot prefixes
+        self.assertEqual(utils.process_command_input('lot 0 status'), 'Invalid Command. 0 is not a valid lot_id')
+        self.assertEqual(utils.process_command_input('lot 2'), 'Invalid Command. Usage: lot <lot_id> <command>')
+        self.assertEqual(utils.process_command_input('lot 2 stats'), 'Invalid Command. stats is not run per lot')
+
+    def test_search_registration(self):
+        self.park_vehicles()
+
+        def searched_slots(pattern):
+            return [parking['slot_id'] for parking in utils.search_registration_numbers(pattern)]
+
+        # Test prefixes, suffixes, other wildcards and exact registration numbers, in slot order
+        self.assertEqual(searched_slots('KA-01-HH-*'), [1, 2, 4, 5, 6])
+        self.assertEqual(searched_slots('*1'), [3, 5, 6])
+        self.assertEqual(searched_slots('*HH*7*'), [4, 5])
+        self.assertEqual(searched_slots('KA-01-??-[0-2]*'), [1, 3, 5])
+        self.assertEqual(searched_slots('KA-01-HH-1234'), [1])
+        self.assertEqual(searched_slots('ka-01-hh-*'), [])
+
+        # Test the searches follow the parkings
+        self.assertTrue(utils.unpark_vehicle(2))
+        self.assertTrue(utils.unpark_vehicle(3))
+        self.assertEqual(utils.park_vehicle('KA-01-HH-0001', 'Red'), 2)
+        self.assertEqual(searched_slots('KA-01-HH-*'), [1, 2, 4, 5, 6])
+        self.assertEqual(searched_slots('*1'), [2, 5, 6])
+
+        self.assertEqual(utils.process_command_input('search_registration *01'), 'Slot No.    Registration No    Colour\n2           KA-01-HH-0001      Red\n5           KA-01-HH-2701      Blue')
+        self.assertEqual(utils.process_command_input('search_registration MH-*'), 'Not found')
+        self.assertEqual(utils.process_command_input('lot 2 search_registration *'), 'Not found')
+
+    def test_occupancy_counters(self):
+        self.assertEqual(utils.process_command_input('occupancy'), 'Occupied 0 of 0 slots')
+        self.park_vehicles()
+        self.assertEqual(utils.process_command_input('occupancy'), 'Occupied 6 of 6 slots')
+        self.assertEqual(utils.process_command_input('count_cars_with_colour white'), '2')
+        self.assertEqual(utils.process_command_input('count_cars_with_colour Green'), '0')
+
+        # Test the counters follow the writes, and match a recount
+        self.assertTrue(utils.unpark_vehicle(1))
+        self.assertTrue(utils.unpark_vehicle(6))
+        self.assertEqual(utils.resize_parking_lot(5), 5)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1235', 'WHITE'), 1)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-9999', 'Red'), -2)
+        self.assertEqual(utils.occupancy(), (5, 5))
+        self.assertEqual([utils.count_vehicles_with_colour(colour) for colour in ['White', 'Black', 'Red']], [2, 1, 1])
+        self.assertEqual(utils.process_command_input('check_consistency'), 'Counters are consistent')
+
+        # Test the counters are per lot, and reset with the lot
+        self.assertEqual(utils.process_command_input('lot 2 create_parking_lot 3'), 'Created a parking lot with 3 slots')
+        self.assertEqual(utils.process_command_input('lot 2 park KA-01-HH-1234 White'), 'Allocated slot number: 1')
+        self.assertEqual(utils.process_command_input('lot 2 occupancy'), 'Occupied 1 of 3 slots')
+        self.assertEqual(utils.process_command_input('lot 2 count_cars_with_colour White'), '1')
+        self.assertEqual(utils.create_parking_lot(4), 4)
+        self.assertEqual((utils.occupancy(), utils.count_vehicles_with_colour('White')), ((0, 4), 0))
+        self.assertEqual(utils.check_consistency(lot_id=2), [])
+
+    def test_journal_recovery_lots(self):
+        journal_path = self.enable_journal(3)
+        self.set_time(1767225600)
+        command_inputs = ['create_parking_lot 2', 'lot 2 create_parking_lot 3', 'lot 2 park KA-01-HH-1234 White',
+                          'park KA-01-HH-9999 White', 'lot 2 park KA-01-BB-0001 Black', 'lot 2 leave 1']
+        for command_input in command_inputs:
+            utils.process_command_output(command_input, StringIO())
+        statuses = [list(utils.parking_lot_status(lot_id=lot_id)) for lot_id in [1, 2]]
+
+        # Test the entries of another lot than the default one are prefixed, and every lot has a checkpoint
+        self.assertEqual([json.loads(payload)[:5] for _, payload, _ in read_frames(journal_path)][:3],
+                         [['create_parking_lot', 2], ['lot', 2, 'create_parking_lot', 3], ['lot', 2, 'at', 1767225600, 'park']])
+        self.assertEqual([lot_id for lot_id, _ in utils.lot_checkpoint_paths(journal_path)], [1, 2])
+
+        # Test the recovery restores the lots, and only replays the commands after the checkpoint of their lot
+        with utils.without_journal():
+            utils.create_parking_lot(1, lot_id=2)
+        self.assertEqual(utils.recover_parking_lot(), (2, 0))
+        self.assertEqual([list(utils.parking_lot_status(lot_id=lot_id)) for lot_id in [1, 2]], statuses)
+        os.remove(utils.checkpoint_path(journal_path, 1))
+        self.assertEqual(utils.recover_parking_lot(), (1, 2))
+        self.assertEqual([list(utils.parking_lot_status(lot_id=lot_id)) for lot_id in [1, 2]], statuses)
+
+class MemoryParkingLotTests(ParkingLotTests):
+    storage_backend = 'memory'
+
+    def test_sorted_registration_numbers(self):
+        # Test the sorted registration numbers are loaded and kept up to date by the writes, not built by a search (in a
+        # reader thread, while the writer changes the parkings)
+        lot = MemoryParkingLot()
+        lot.load([(slot_id, True) for slot_id in xrange(1, 5)], [(3, 'KA-01-HH-9999', 'White'), (1, 'KA-01-HH-1234', 'White')])
+        self.assertEqual(lot.registration_numbers, ['KA-01-HH-1234', 'KA-01-HH-9999'])
+        self.assertEqual(lot.park_vehicle('KA-01-BB-0001', 'Black'), 2)
+        self.assertTrue(lot.unpark_vehicle(3))
+        self.assertEqual(lot.registration_numbers, ['KA-01-BB-0001', 'KA-01-HH-1234'])
+        self.assertEqual(lot.reversed_registration_numbers, ['1000-BB-10-AK', '4321-HH-10-AK'])
+        self.assertEqual([parking['slot_id'] for parking in lot.search_registration_numbers('*1')], [2])
+
+
+class SQLParkingLotTests(ParkingLotTestCase):
+
+    def test_park_vehicle_rebuilt_free_slot_index(self):
+        self.park_vehicles()
+
+        # Unpark 5 and 3, and rebuild the free slot index from the database
+        self.assertTrue(utils.unpark_vehicle(5))
+        self.assertTrue(utils.unpark_vehicle(3))
+        utils.free_slots.invalidate()
+
+        # Test the nearest slot is allotted first
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1235', 'White'), 3)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1236', 'White'), 5)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1237', 'White'), -1)
+
+    def test_park_vehicle_inactive_slot(self):
+        utils.create_parking_lot(self.total_slots)
+
+        # Mark slot 1 inactive and rebuild the free slot index from the database
+        models.Slot.query.filter_by(id=1).update(dict(active=False))
+        db.session.commit()
+        utils.free_slots.invalidate()
+
+        # Test the inactive slot is skipped
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1234', 'White'), 2)
+
+    def test_park_vehicle_concurrent_writer(self):
+        self.park_vehicles()
+
+        # Another process unparks 3 and records the change of the parking lot
+        db.engine.execute('UPDATE parking SET active = 0 WHERE active = 1 AND slot_id = 3')
+        db.engine.execute('UPDATE lot SET generation = generation + 1')
+
+        # Test the free slot index is rebuilt, and the freed slot allotted
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1235', 'White'), 3)
+
+        # Another process parks in slot 3 behind the index's back
+        self.assertTrue(utils.unpark_vehicle(3))
+        db.engine.execute("INSERT INTO parking (slot_id, registration_number, colour, colour_key, active) VALUES (3, 'KA-01-HH-1236', 'Red', 'red', 1)")
+
+        # Test the taken slot is not allotted twice
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1237', 'White'), -1)
+        self.assertEqual(utils.slot_number_for_registration_number('KA-01-HH-1236'), 3)
+        self.assertEqual(self.active_parkings_count(), self.total_slots)
+
+    def test_unique_active_parking(self):
+        self.park_vehicles()
+
+        # Test a slot and a registration number can only be in a single active parking
+        for slot_id, registration_number in [(1, 'KA-01-HH-1235'), (2, 'KA-01-HH-1234')]:
+            db.session.add(models.Parking(slot_id=slot_id, registration_number=registration_number, colour='White', colour_key='white'))
+            with self.assertRaises(IntegrityError):
+                db.session.commit()
+            db.session.rollback()
+
+        # Test closed parkings are not constrained
+        self.assertTrue(utils.unpark_vehicle(1))
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1234', 'White'), 1)
+
+    def test_process_command_batch(self):
+        fixture_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), '../fixtures/file_input.txt')
+
+        # Per-line output
+        per_line_output = StringIO()
+        with open(fixture_path, 'rU') as input_file:
+            for command_input in input_file:
+                per_line_output.write('{}\n'.format(utils.process_command_input(command_input.rstrip('\n').rstrip())))
+
+        # Test the batched output is the same, for batches of different sizes
+        for batch_size in [2, 4, 100]:
+            batch_output = StringIO()
+            with open(fixture_path, 'rU') as input_file:
+                utils.process_command_batch(input_file, batch_size, batch_output)
+            self.assertEqual(batch_output.getvalue(), per_line_output.getvalue())
+
+    def test_process_command_batch_failure(self):
+        def fail():
+            models.Parking.query.update(dict(active=False))
+            raise RuntimeError('Failed')
+        register_command('fail', fail, writes=True)
+        self.addCleanup(commands.pop, 'fail')
+
+        output = StringIO()
+        with self.assertRaises(RuntimeError):
+            utils.process_command_batch(['create_parking_lot 6', 'park KA-01-HH-1234 White', 'fail'], 10, output)
+
+        # Test the commands before the failing one are committed and printed
+        self.assertEqual(output.getvalue(), 'Created a parking lot with 6 slots\nAllocated slot number: 1\n')
+        db.session.close()
+        self.assertEqual(models.Slot.query.count(), self.total_slots)
+        self.assertEqual(self.active_parkings_count(), 1)
+
+        # Test the exit command stops the batch
+        output = StringIO()
+        utils.process_command_batch(['park KA-01-HH-9999 White', 'exit', 'park KA-01-BB-0001 Black'], 10, output)
+        self.assertEqual(output.getvalue(), 'Allocated slot number: 2\n')
+
+    def test_load_memory_lot(self):
+        self.park_vehicles()
+        self.assertTrue(utils.unpark_vehicle(2))
+        self.assertEqual(utils.resize_parking_lot(8), 8)
+
+        # Load the SQL state in the memory parking lot
+        self.assertEqual(utils.load_memory_lot(), 5)
+        self.assertEqual(list(utils.memory_lot.parking_lot_status()), list(utils.parking_lot_status()))
+        self.assertEqual(utils.memory_lot.info_for_vehicles_with_colour('black', 'slot_id'), [3, 6])
+        self.assertEqual(utils.memory_lot.park_vehicle('KA-01-HH-1235', 'White'), 2)
+        self.assertEqual(utils.memory_lot.park_vehicle('KA-01-HH-1236', 'White'), 7)
+
+    def test_compact_parking_history(self):
+        self.park_vehicles()
+
+        # Unpark 4, 2, and 5
+        self.assertTrue(utils.unpark_vehicle(4))
+        self.assertTrue(utils.unpark_vehicle(2))
+        self.assertTrue(utils.unpark_vehicle(5))
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1235', 'White'), 2)
+
+        # Test only the closed parkings are moved, in chunks smaller than the table
+        self.assertEqual(utils.compact_parking_history(2), 3)
+        self.assertEqual(models.Parking.query.count(), 4)
+        self.assertEqual(sorted(parking.registration_number for parking in models.ParkingHistory.query), ['KA-01-HH-2701', 'KA-01-HH-7777', 'KA-01-HH-9999'])
+        self.assertEqual(utils.compact_parking_history(2), 0)
+
+        # Test the lookups after compaction
+        self.assertEqual(utils.info_for_vehicles_with_colour('White', 'slot_id'), [1, 2])
+        self.assertEqual(utils.slot_number_for_registration_number('KA-01-HH-1235'), 2)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-7777', 'Red'), 4)
+
+        # Test the history is dropped with the parking lot
+        utils.create_parking_lot(self.total_slots)
+        self.assertEqual(models.ParkingHistory.query.count(), 0)
+
+    def test_sqlite_durability(self):
+        # Test the connections are in WAL mode, synced at every commit by default
+        self.assertEqual(db.session.execute('PRAGMA journal_mode').scalar(), 'wal')
+        self.assertEqual(db.session.execute('PRAGMA synchronous').scalar(), 2)
+        self.assertEqual(db.session.execute('PRAGMA temp_store').scalar(), 2)
+        db.session.commit()
+
+        # Test the new connections take the durability level
+        def restore_durability(durability):
+            parking_lot.config['SQLITE_DURABILITY'] = durability
+            db.session.remove()
+            db.engine.dispose()
+        self.addCleanup(restore_durability, parking_lot.config['SQLITE_DURABILITY'])
+        restore_durability('volatile')
+        self.assertEqual(db.session.execute('PRAGMA synchronous').scalar(), 0)
+        db.session.commit()
+
+        self.assertRaises(ValueError, sqlite_pragmas, dict(parking_lot.config, SQLITE_DURABILITY='careless'))
+
+    def test_billing_report(self):
+        start = 1767225600  # 2026-01-01 00:00 UTC
+        self.set_time(start)
+        self.park_vehicles()
+        for slot_id, minutes in [(1, 10), (2, 90), (3, 26*60)]:
+            self.set_time(start + minutes*60)
+            self.assertTrue(utils.unpark_vehicle(slot_id))
+        utils.compact_parking_history(2)
+        self.set_time(start + (30*60+30)*60)
+        self.assertTrue(utils.unpark_vehicle(4))
+
+        # Test the times are recorded, the parked vehicles have not left
+        self.assertEqual(db.session.query(models.Parking.entered_at, models.Parking.exited_at).filter_by(slot_id=4).one(), (start, start + (30*60+30)*60))
+        self.assertEqual(db.session.query(models.ParkingHistory.entered_at, models.ParkingHistory.exited_at).filter_by(slot_id=2).one(), (start, start + 90*60))
+        self.assertIsNone(models.Parking.query.filter_by(slot_id=5).one().exited_at)
+
+        # Test the fees of 10 minutes, 90 minutes, 26 hours and 30 and a half hours, read in chunks from both tables
+        report = billing.billing_report(billing.Tariff(15, 200, 2000), chunk_size=2)
+        self.assertEqual((report.parkings, report.revenue), (4, 0 + 400 + 2400 + 3400))
+        self.assertEqual([report.dwell_time_percentile(percentile) for percentile in [50, 90]], [90, 30*60+30])
+        first_hour, occupancy = report.hourly_occupancy()
+        self.assertEqual((first_hour, len(occupancy)), (start//3600, 31))
+        self.assertEqual([round(vehicles, 2) for vehicles in occupancy[[0, 1, 2, 25, 26, 30]]], [3.17, 2.5, 2, 2, 1, 0.5])
+        self.assertEqual(list(report.report_lines())[:7], ['Parkings: 4', 'Revenue: 62.00', 'Mean fee: 15.50', 'Dwell time p50: 1h30m',
+                                                           'Dwell time p90: 30h30m', 'Dwell time p99: 30h30m', 'Longest dwell time: 30h30m'])
+        self.assertEqual(list(report.report_lines())[-1], 'Peak hour: 2026-01-01 00:00 UTC, 3.2 vehicles')
+
+        # Test the parkings are billed by exit time
+        self.assertEqual(billing.billing_report(billing.Tariff(15, 200, 2000), since=start + 3600, until=start + 27*3600).revenue, 400 + 2400)
+        self.assertEqual(list(billing.billing_report(billing.Tariff(15, 200, 2000), lot_id=2).report_lines()), ['Parkings: 0', 'Revenue: 0.00'])
+
+    def lookups(self):
+        return (list(utils.parking_lot_status()), list(utils.parking_lot_status(2, 2)), utils.info_for_vehicles_with_colour('White', 'slot_id'),
+                utils.info_for_vehicles_with_colour('white', 'registration_number'), utils.slot_number_for_registration_number('KA-01-HH-9999'),
+                utils.slot_number_for_registration_number('KA-01-HH-1235'))
+
+    def uncached_lookups(self):
+        utils.lookup_cache.clear()
+        return self.lookups()
+
+    def test_lookup_cache_write_through(self):
+        self.park_vehicles()
+        self.assertEqual(self.lookups(), self.uncached_lookups())
+
+        # Test the cached lookups are the same as the SQL ones, after every change
+        for change in [lambda: utils.unpark_vehicle(2), lambda: utils.park_vehicle('KA-01-HH-1235', 'White'),
+                       lambda: utils.unpark_vehicle(1), lambda: utils.resize_parking_lot(8), lambda: utils.park_vehicle('KA-01-HH-9999', 'White')]:
+            change()
+            cached_lookups = self.lookups()
+            self.assertEqual(cached_lookups, self.uncached_lookups())
+
+        # Test the lookups are answered by the cache, and the status snapshot is dropped by the changes
+        for counter in utils.lookup_cache.counters.values():
+            counter.hits = counter.misses = 0
+        utils.park_vehicle('KA-01-HH-1236', 'Black')
+        self.lookups()
+        self.assertEqual([(lookup, counter.hits, counter.misses) for lookup, counter in utils.lookup_cache.counters.items()],
+                         [('registration', 2, 0), ('colour', 2, 0), ('status', 1, 1)])
+        self.assertEqual(utils.process_command_input('cache_stats').split('\n')[0].split()[:5], ['registration', '2', 'hits', '0', 'misses'])
+
+        # Test a new parking lot drops the cache
+        utils.create_parking_lot(self.total_slots)
+        self.assertEqual(self.lookups(), ([], [], [], [], -1, -1))
+
+    def test_lookup_cache_concurrent_writer(self):
+        self.park_vehicles()
+        self.assertEqual(utils.slot_number_for_registration_number('KA-01-HH-9999'), 2)
+        self.assertEqual(utils.info_for_vehicles_with_colour('White', 'slot_id'), [1, 2])
+        db.session.commit()
+
+        # Another process unparks 2 and records the change of the parking lot
+        db.engine.execute('UPDATE parking SET active = 0 WHERE active = 1 AND slot_id = 2')
+        db.engine.execute('UPDATE lot SET generation = generation + 1')
+
+        # Test the cache is dropped, and not updated by the next change of this process
+        self.assertEqual(utils.slot_number_for_registration_number('KA-01-HH-9999'), -1)
+        db.session.commit()
+        db.engine.execute('UPDATE lot SET generation = generation + 1')
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1235', 'Red'), 2)
+        self.assertEqual(utils.info_for_vehicles_with_colour('White', 'slot_id'), [1])
+        self.assertEqual(self.lookups(), self.uncached_lookups())
+
+    def test_deactivated_slots_rebuilt_free_slot_index(self):
+        utils.create_parking_lot(self.total_slots)
+        self.assertEqual(utils.deactivate_slots('1-2'), (2, []))
+        self.assertEqual(utils.deactivate_slots('5'), (1, []))
+
+        # Test the free slot index is rebuilt with the ranges of inactive slots
+        utils.free_slots.invalidate()
+        self.assertEqual([utils.park_vehicle('KA-01-HH-123{}'.format(index), 'White') for index in xrange(4)], [3, 4, 6, -1])
+        self.assertEqual(list(utils.free_slots.inactive), [(1, 2), (5, 5)])
+
+    def test_slot_ranges(self):
+        ranges = SlotRanges([(10, 19), (30, 39)])
+        ranges.add(20, 24)
+        ranges.add(50, 50)
+        self.assertEqual((list(ranges), len(ranges)), ([(10, 24), (30, 39), (50, 50)], 26))
+        ranges.remove(15, 32)
+        self.assertEqual((list(ranges), len(ranges)), ([(10, 14), (33, 39), (50, 50)], 13))
+        ranges.add(1, 100)
+        self.assertEqual((list(ranges), len(ranges)), ([(1, 100)], 100))
+        self.assertEqual((ranges.find(0), ranges.find(1), ranges.find(100), 101 in ranges), (None, (1, 100), (1, 100), False))
+
+    def test_free_slot_index_inactive_ranges(self):
+        index = FreeSlotIndex()
+        index.load(xrange(1, 11), inactive=[(1, 3)])
+        index.deactivate(5, 8)
+        self.assertEqual(len(index), 3)
+        self.assertEqual([index.pop(), index.pop(), index.pop(), index.pop()], [4, 9, 10, None])
+
+        # Test the freed slots beyond the index and the activated slots
+        index.push(20)
+        index.activate(2, 6)
+        self.assertEqual([index.pop() for _ in xrange(5)], [2, 3, 5, 6, 20])
+        index.push(9)
+        self.assertEqual((len(index), index.pop()), (1, 9))
+        index.activate(1, 1)
+        self.assertEqual((len(index), index.pop(), index.pop()), (1, 1, None))
+
+    def test_lookup_cache_eviction(self):
+        cache = LookupCache(max_registrations=2, max_colours=1, max_status_rows=1)
+        cache.validate(1)
+        for registration_number, slot_id in [('KA-01-HH-1234', 1), ('KA-01-HH-9999', 2)]:
+            cache.store_slot_for_registration_number(1, registration_number, slot_id)
+        cache.store_vehicles_with_colour(1, 'white', [1, 2], ['KA-01-HH-1234', 'KA-01-HH-9999'])
+
+        # Test the least recently used registration number and colour are evicted
+        self.assertEqual(cache.slot_for_registration_number('KA-01-HH-1234'), 1)
+        cache.store_slot_for_registration_number(1, 'KA-01-BB-0001', -1)
+        cache.store_vehicles_with_colour(1, 'black', [], [])
+        self.assertEqual(cache.slot_for_registration_number('KA-01-HH-9999'), None)
+        self.assertEqual(cache.slot_for_registration_number('KA-01-HH-1234'), 1)
+        self.assertEqual(cache.vehicles_with_colour('white'), None)
+
+        # Test the status snapshot is only kept up to its bound, and nothing is stored for another generation
+        cache.store_status(1, [(1, 'KA-01-HH-1234', 'White'), (2, 'KA-01-HH-9999', 'White')])
+        self.assertEqual(cache.status(), None)
+        cache.store_status(2, [(1, 'KA-01-HH-1234', 'White')])
+        self.assertEqual(cache.status(), None)
+
+        # Test a change is not applied to a stale cache
+        self.assertFalse(cache.advance(2, 3))
+        self.assertEqual(cache.slot_for_registration_number('KA-01-HH-1234'), None)
+        self.assertTrue(cache.advance(3, 4))
+
+    def snapshot_path(self):
+        snapshot_directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, snapshot_directory)
+        snapshot_path = os.path.join(snapshot_directory, 'parking_lot.snapshot')
+        self.addCleanup(lambda: os.path.exists(snapshot_path) and os.remove(snapshot_path))
+        return snapshot_path
+
+    def snapshot_lookups(self, lot):
+        return (list(lot.parking_lot_status()), list(lot.parking_lot_status(2, 2)), list(lot.parking_lot_status(6)),
+                lot.info_for_vehicles_with_colour('White', 'slot_id'), lot.info_for_vehicles_with_colour('WHITE', 'registration_number'),
+                lot.info_for_vehicles_with_colour('Green', 'slot_id'), lot.slot_number_for_registration_number('KA-01-HH-3141'),
+                lot.slot_number_for_registration_number('KA-01-HH-1235'), lot.slot_number_for_registration_number('KA-01-HH-9999'),
+                lot.occupancy(), lot.count_vehicles_with_colour('White'), lot.check_consistency(),
+                lot.search_registration_numbers('KA-01-HH-*'), lot.search_registration_numbers('*1'))
+
+    def test_snapshot_parking_lot(self):
+        self.park_vehicles()
+        self.assertTrue(utils.unpark_vehicle(2))
+        self.assertTrue(utils.unpark_vehicle(6))
+        self.assertEqual(utils.resize_parking_lot(5), 5)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1235', 'white'), 2)
+        sql_lookups = self.snapshot_lookups(utils)
+
+        # Test the mapped snapshot answers the reads like the database
+        snapshot_path = self.snapshot_path()
+        self.assertEqual(utils.snapshot_parking_lot(snapshot_path), 5)
+        snapshot = MappedSnapshot(snapshot_path)
+        self.addCleanup(snapshot.close)
+        self.assertEqual(snapshot.generation, utils.lot_generation())
+        self.assertEqual(self.snapshot_lookups(snapshot), sql_lookups)
+        self.assertEqual(list(snapshot.slots()), [(1, True), (2, True), (3, True), (4, True), (5, True), (6, False)])
+
+        # Test the snapshot is only mapped while it is the current state of the parking lot
+        self.assertIsNotNone(utils.map_snapshot(snapshot_path))
+        utils.unmap_snapshot()
+        self.assertTrue(utils.unpark_vehicle(1))
+        self.assertIsNone(utils.map_snapshot(snapshot_path))
+
+        # Test a restore brings the parking lot back, in the database and in memory
+        self.assertEqual(utils.restore_parking_lot(snapshot_path), 5)
+        self.assertEqual(self.snapshot_lookups(utils), sql_lookups)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1236', 'Green'), -1)
+        self.assertTrue(utils.unpark_vehicle(3))
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1236', 'Green'), 3)
+        self.assertEqual(utils.memory_lot.restore_parking_lot(snapshot_path), 5)
+        self.assertEqual(self.snapshot_lookups(utils.memory_lot), sql_lookups)
+
+    def test_check_consistency(self):
+        self.park_vehicles()
+        self.assertEqual(utils.check_consistency(), [])
+
+        # Test drifted counters are reported against the recount
+        models.Lot.query.filter_by(id=utils.LOT_ID).update(dict(parked_vehicles=5))
+        models.LotColour.query.filter_by(colour_key='black').delete()
+        db.session.commit()
+        self.assertEqual(utils.check_consistency(), [('parked_vehicles', 5, 6), ('colour black', 0, 2)])
+        self.assertEqual(utils.process_command_input('check_consistency'), 'parked_vehicles: recorded 5, counted 6\ncolour black: recorded 0, counted 2')
+
+    def test_snapshot_layout(self):
+        utils.create_parking_lot(6)
+        utils.layout_slots(1, 3, 0, 10, 5, 'disabled')
+        utils.layout_slots(4, 6, 1, 0, 0, 'compact')
+        utils.add_entrance('north', 1, 6, 0)
+        layout = list(utils.slot_layout())
+
+        # Test the layout and the entrances are kept by the snapshots, in the database and in memory
+        snapshot_path = self.snapshot_path()
+        utils.snapshot_parking_lot(snapshot_path)
+        snapshot = MappedSnapshot(snapshot_path)
+        self.addCleanup(snapshot.close)
+        self.assertEqual(list(snapshot.layout()), layout)
+        self.assertEqual(list(snapshot.entrances()), [('north', 1, 6, 0)])
+        utils.create_parking_lot(6)
+        self.assertEqual(utils.restore_parking_lot(snapshot_path), 0)
+        self.assertEqual(list(utils.slot_layout()), layout)
+        self.assertEqual(utils.park_vehicle('KA-01-HH-1234', 'White', 'north', 'compact'), 6)
+        self.assertEqual(utils.load_memory_lot(), 1)
+        self.assertEqual(utils.memory_lot.park_vehicle('KA-01-HH-9999', 'White', 'north', 'compact'), 5)
+        self.assertEqual(utils.memory_lot.restore_parking_lot(snapshot_path), 0)
+        self.assertEqual(utils.memory_lot.park_vehicle('KA-01-HH-9999', 'White', 'north', 'disabled'), 1)
+
+    def test_journal_batch(self):
+        journal_path = self.enable_journal(100)
+        self.set_time(1767225600)
+        register_command('fail', lambda: 1/0, writes=True)
+        self.addCleanup(commands.pop, 'fail')
+
+        # Test the commands of a batch are journaled once committed, and those rolled back are not
+        with self.assertRaises(ZeroDivisionError):
+            utils.process_command_batch(['create_parking_lot 6', 'park KA-01-HH-1234 White', 'fail'], 10, StringIO())
+        output = StringIO()
+        utils.process_command_batch(['park KA-01-HH-9999 White', 'status', 'leave 1'], 10, output)
+        db.session.begin_nested()
+        utils.park_vehicle('KA-01-BB-0001', 'Black')
+        db.session.rollback()
+        self.assertEqual([json.loads(payload) for _, payload, _ in read_frames(journal_path)],
+                         [['create_parking_lot', 6], ['at', 1767225600, 'park', 'KA-01-HH-1234', 'White'], ['at', 1767225600, 'park', 'KA-01-HH-9999', 'White'],
+                          ['at', 1767225600, 'leave', 1]])
+
+    def parking_times(self):
+        return [sorted(db.session.query(model.registration_number, model.entered_at, model.exited_at).all())
+                for model in [models.Parking, models.ParkingHistory]]
+
+    def test_journal_recovery_parking_times(self):
+        start = 1767225600  # 2026-01-01 00:00 UTC
+        self.enable_journal(4)
+        for minutes, command_input in [(0, 'create_parking_lot 3'), (0, 'park KA-01-HH-1234 White'), (1, 'park KA-01-HH-9999 White'), (10, 'leave 1'),
+                                       (20, 'park KA-01-BB-0001 Black'), (30, 'leave 2')]:
+            self.set_time(start + minutes*60)
+            utils.process_command_output(command_input, StringIO())
+            if command_input == 'leave 1':  # The checkpoint, written after 4 commands
+                self.assertEqual(utils.compact_parking_history(10), 1)
+        parking_times = self.parking_times()
+        self.assertEqual(parking_times, [[('KA-01-BB-0001', start + 20*60, None), ('KA-01-HH-9999', start + 60, start + 30*60)],
+                                         [('KA-01-HH-1234', start, start + 10*60)]])
+
+        # Test the recovery keeps the parkings closed before the checkpoint, and replays the others at their journaled times
+        self.set_time(start + 24*3600)
+        self.assertEqual(utils.recover_parking_lot(), (1, 2))
+        self.assertEqual(self.parking_times(), parking_times)
+        self.assertEqual(utils.process_command_input('check_consistency'), 'Counters are consistent')
+        self.assertEqual(billing.billing_report(billing.Tariff(15, 200, 2000)).revenue, 200)
+
+    def test_journal_torn_frame(self):
+        journal_directory = tempfile.mkdtemp()
+        journal_path = os.path.join(journal_directory, 'parking_lot.journal')
+        self.addCleanup(os.rmdir, journal_directory)
+        self.addCleanup(os.remove, journal_path)
+
+        journal = Journal(journal_path, group_size=2)
+        self.assertEqual(journal.append(['first', 'second']), 2)
+        self.assertEqual(journal.unsynced, 0)
+        self.assertEqual(journal.append(['third']), 3)
+        self.assertEqual(journal.unsynced, 1)
+        journal.close()
+
+        # Test a torn frame is dropped when the journal is opened again, and the sequence carries on
+        with open(journal_path, 'ab') as journal_file:
+            journal_file.write('\x05\x00\x00\x00\x00')
+        journal = Journal(journal_path)
+        self.assertEqual(journal.append(['fourth']), 4)
+        journal.close()
+        self.assertEqual([(sequence, payload) for sequence, payload, _ in read_frames(journal_path)], [(1, 'first'), (2, 'second'), (3, 'third'), (4, 'fourth')])
+
+        # Test the frames after an offset are read
+        offset = list(read_frames(journal_path))[1][2]
+        self.assertEqual([payload for _, payload, _ in read_frames(journal_path, offset)], ['third', 'fourth'])
+
+    def test_journal_single_writer(self):
+        journal_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_directory)
+        journal_path = os.path.join(journal_directory, 'parking_lot.journal')
+
+        # Test the journal cannot be opened by a second writer, which would truncate and number frames of its own
+        journal = Journal(journal_path)
+        journal.append(['first'])
+        self.assertRaises(IOError, Journal, journal_path)
+        self.assertEqual(journal.append(['second']), 2)
+        journal.close()
+        journal = Journal(journal_path)
+        self.assertEqual(journal.append(['third']), 3)
+        journal.close()
+        self.assertEqual([payload for _, payload, _ in read_frames(journal_path)], ['first', 'second', 'third'])
+
+    def test_instrumentation(self):
+        self.assertEqual(utils.process_command_input('stats'), 'Instrumentation is disabled')
+
+        instrumentation.reset()
+        instrumentation.enable()
+        try:
+            output = StringIO()
+            for command_input in ['create_parking_lot 6', 'park KA-01-HH-1234 White', 'park KA-01-HH-9999 White', 'status']:
+                utils.process_command_output(command_input, output)
+        finally:
+            instrumentation.disable()
+
+        # Test the nested calls are accounted once, to the outermost command
+        self.assertEqual(instrumentation.commands['park'].latency.count, 2)
+        self.assertEqual(instrumentation.commands['status'].latency.count, 1)
+        self.assertGreater(instrumentation.commands['park'].queries, 0)
+        self.assertEqual(instrumentation.commands['park'].commits, 2)
+
+        # Test the report, and that nothing is recorded once disabled
+        utils.process_command_input('park KA-01-BB-0001 Black')
+        self.assertEqual(instrumentation.commands['park'].latency.count, 2)
+        instrumentation.enable()
+        try:
+            report = utils.process_command_input('stats').split('\n')
+        finally:
+            instrumentation.disable()
+        self.assertTrue(report[0].startswith('Command'))
+        self.assertEqual([line.split()[0] for line in report[1:]], ['create_parking_lot', 'park', 'status'])
+
+    def test_histogram_percentile(self):
+        histogram = Histogram()
+        for latency in [0.001]*90 + [0.1]*10:
+            histogram.add(latency)
+        self.assertAlmostEqual(histogram.percentile(50), 0.001, delta=0.0002)
+        self.assertAlmostEqual(histogram.percentile(99), 0.1, delta=0.02)
+        self.assertAlmostEqual(histogram.mean, 0.0109)
+
+
+class ApiTests(ParkingLotTestCase):
+
+    def post_json(self, url, data, method='post'):
+        return getattr(self.app, method)(url, data=json.dumps(data), content_type='application/json')
+
+    def test_park_and_leave(self):
+        self.assertEqual(self.post_json('/api/parking_lot', {'slots': 2}).status_code, 201)
+
+        response = self.post_json('/api/parkings', {'registration_number': 'KA-01-HH-1234', 'colour': 'White'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.data), {'slot_id': 1})
+        self.assertEqual(self.post_json('/api/parkings', {'registration_number': 'KA-01-HH-1234', 'colour': 'White'}).status_code, 409)
+        self.assertEqual(self.post_json('/api/parkings', {'registration_number': 'KA-01-HH-9999', 'colour': 'White'}).status_code, 201)
+
+        # Test the full parking lot and the missing fields
+        response = self.post_json('/api/parkings', {'registration_number': 'KA-01-BB-0001', 'colour': 'Black'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.data), {'error': 'Sorry, parking lot is full'})
+        self.assertEqual(self.post_json('/api/parkings', {'registration_number': 'KA-01-BB-0001'}).status_code, 400)
+        self.assertEqual(self.post_json('/api/parking_lot', {'slots': '6'}).status_code, 400)
+
+        # Test leave and resize
+        self.assertEqual(self.app.delete('/api/slots/1/parking').status_code, 200)
+        self.assertEqual(self.app.delete('/api/slots/3/parking').status_code, 404)
+        self.assertEqual(self.post_json('/api/parking_lot', {'slots': 1}, 'put').status_code, 409)
+        self.assertEqual(self.post_json('/api/parking_lot', {'slots': 3}, 'put').status_code, 200)
+        self.assertEqual(json.loads(self.post_json('/api/parkings', {'registration_number': 'KA-01-BB-0001', 'colour': 'Black'}).data), {'slot_id': 1})
+
+    def test_parking_lot_without_slots(self):
+        self.assertEqual(self.post_json('/api/parking_lot', {'slots': 2}).status_code, 201)
+
+        # Test zero and negative numbers of slots are refused, on creation and on resize
+        for slots in [0, -3]:
+            for method in ['post', 'put']:
+                response = self.post_json('/api/parking_lot', {'slots': slots}, method)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.data), {'error': 'Field slots is required, as an integer of at least 1'})
+            self.assertEqual(self.post_json('/api/lots/2/parking_lot', {'slots': slots}).status_code, 400)
+        self.assertEqual(utils.process_command_input('occupancy'), 'Occupied 0 of 2 slots')
+        self.assertEqual(utils.process_command_input('check_consistency'), 'Counters are consistent')
+
+    def test_status_pages(self):
+        self.park_vehicles()
+        self.assertTrue(utils.unpark_vehicle(2))
+
+        # Test the pages follow each other, until the last one
+        parkings = []
+        url = '/api/status?limit=2'
+        while url:
+            page = json.loads(self.app.get(url).data)
+            self.assertLessEqual(len(page['parkings']), 2)
+            parkings.extend(page['parkings'])
+            url = page['next']
+        self.assertEqual(parkings, list(utils.parking_lot_status()))
+        self.assertEqual([parking['slot_id'] for parking in parkings], [1, 3, 4, 5, 6])
+
+    def test_lookups(self):
+        self.park_vehicles()
+
+        self.assertEqual(json.loads(self.app.get('/api/colours/white/registration_numbers').data), {'registration_numbers': ['KA-01-HH-1234', 'KA-01-HH-9999']})
+        self.assertEqual(json.loads(self.app.get('/api/colours/Black/slots').data), {'slot_ids': [3, 6]})
+        self.assertEqual(json.loads(self.app.get('/api/registration_numbers/KA-01-HH-3141/slot').data), {'slot_id': 6})
+        self.assertEqual(json.loads(self.app.get('/api/occupancy').data), {'parked_vehicles': 6, 'slots': 6})
+        self.assertEqual(json.loads(self.app.get('/api/registration_numbers?pattern=*1').data), {'parkings': [
+            {'slot_id': 3, 'registration_number': 'KA-01-BB-0001', 'colour': 'Black'},
+            {'slot_id': 5, 'registration_number': 'KA-01-HH-2701', 'colour': 'Blue'},
+            {'slot_id': 6, 'registration_number': 'KA-01-HH-3141', 'colour': 'Black'},
+        ]})
+        self.assertEqual(self.app.get('/api/registration_numbers').status_code, 400)
+        self.assertEqual(json.loads(self.app.get('/api/colours/WHITE/count').data), {'count': 2})
+        response = self.app.get('/api/registration_numbers/MH-04-AY-1111/slot')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.data), {'error': 'Not found'})
+
+
+    def test_park_at_entrance(self):
+        self.park_vehicles()
+        self.assertTrue(utils.unpark_vehicle(2))
+        self.assertTrue(utils.unpark_vehicle(5))
+        utils.add_entrance('north', 0, 0, 0)
+        utils.layout_slots(5, 6, 0, 0, 0, 'ev')
+        self.assertEqual(json.loads(self.post_json('/api/parkings', {'registration_number': 'KA-01-HH-1235', 'colour': 'White', 'entrance': 'north', 'slot_type': 'ev'}).data), {'slot_id': 5})
+        self.assertEqual(json.loads(self.post_json('/api/parkings', {'registration_number': 'KA-01-HH-1236', 'colour': 'White', 'entrance': 'south'}).data), {'error': 'Sorry, there is no entrance south'})
+        self.assertEqual(self.post_json('/api/parkings', {'registration_number': 'KA-01-HH-1236', 'colour': 'White', 'entrance': 'north', 'slot_type': 'truck'}).status_code, 400)
+
+    def test_lot_routes(self):
+        self.park_vehicles()
+        self.assertEqual(self.post_json('/api/lots/2/parking_lot', {'slots': 2}).status_code, 201)
+        self.assertEqual(json.loads(self.post_json('/api/lots/2/parkings', {'registration_number': 'KA-01-HH-1234', 'colour': 'White'}).data), {'slot_id': 1})
+        self.assertEqual(json.loads(self.app.get('/api/lots/2/colours/white/registration_numbers').data), {'registration_numbers': ['KA-01-HH-1234']})
+        self.assertEqual(json.loads(self.app.get('/api/lots/2/status?limit=1').data),
+                         {'parkings': [{'slot_id': 1, 'registration_number': 'KA-01-HH-1234', 'colour': 'White'}], 'next': '/api/lots/2/status?after=1&limit=1'})
+        self.assertEqual(self.app.delete('/api/lots/2/slots/1/parking').status_code, 200)
+        self.assertEqual(self.app.get('/api/lots/2/registration_numbers/KA-01-HH-1234/slot').status_code, 404)
+        self.assertEqual(json.loads(self.app.get('/api/registration_numbers/KA-01-HH-1234/slot').data), {'slot_id': 1})
+        self.assertEqual(self.app.get('/api/lots/0/status').status_code, 404)
+
+
+class MemoryApiTests(ApiTests):
+    storage_backend = 'memory'
+
+
+class DaemonTests(ParkingLotTestCase):
+
+    def test_line_protocol(self):
+        socket_path = os.path.join(tempfile.mkdtemp(), 'parking_lot.sock')
+        daemon = ParkingLotDaemon(socket_path, LineProtocolHandler)
+        daemon_thread = threading.Thread(target=daemon.serve_forever)
+        daemon_thread.start()
+        try:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(socket_path)
+            connection.sendall('create_parking_lot 2\npark KA-01-HH-1234 White\nstatus\n')
+            reply_file = connection.makefile('rb')
+
+            # Test every reply ends with an empty line
+            self.assertEqual([reply_file.readline() for _ in xrange(7)], [
+                'Created a parking lot with 2 slots\n', '\n',
+                'Allocated slot number: 1\n', '\n',
+                'Slot No.    Registration No    Colour\n', '1           KA-01-HH-1234      White\n', '\n',
+            ])
+
+            # Test the daemon closes the connection on exit, and keeps serving
+            connection.sendall('exit\n')
+            self.assertEqual(reply_file.readline(), '')
+            connection.close()
+            self.assertFalse(remove_stale_socket(socket_path))
+        finally:
+            daemon.shutdown()
+            daemon.server_close()
+            daemon_thread.join()
+
+        # Test the socket of a stopped daemon is removed
+        self.assertTrue(remove_stale_socket(socket_path))
+        self.assertFalse(os.path.exists(socket_path))
+        os.rmdir(os.path.dirname(socket_path))
+
+
+class GateServerTests(ParkingLotTestCase):
+
+    def read_reply(self, reply_file):
+        lines = list(iter(reply_file.readline, '\n'))
+        return ''.join(lines)
+
+    def test_gate_connections(self):
+        server = GateServer('127.0.0.1', 0)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+        try:
+            first_gate = socket.create_connection(server.address)
+            first_replies = first_gate.makefile('rb')
+            second_gate = socket.create_connection(server.address)
+            second_replies = second_gate.makefile('rb')
+
+            # Test the pipelined commands of a gate are answered in order, reads after the writes before them
+            first_gate.sendall('create_parking_lot 3\npark KA-01-HH-1234 White\nslot_number_for_registration_number KA-01-HH-1234\npark\n')
+            self.assertEqual(self.read_reply(first_replies), 'Created a parking lot with 3 slots\n')
+            self.assertEqual(self.read_reply(first_replies), 'Allocated slot number: 1\n')
+            self.assertEqual(self.read_reply(first_replies), '1\n')
+            self.assertEqual(self.read_reply(first_replies), 'Invalid Command. Usage: park <registration_number> <colour> [<entrance>] [<slot_type>]\n')
+
+            # Test the writes of a gate are seen by the others
+            second_gate.sendall('park KA-01-HH-9999 Red\nstatus\nregistration_numbers_for_cars_with_colour white\n')
+            self.assertEqual(self.read_reply(second_replies), 'Allocated slot number: 2\n')
+            self.assertEqual(self.read_reply(second_replies), 'Slot No.    Registration No    Colour\n1           KA-01-HH-1234      White\n2           KA-01-HH-9999      Red\n')
+            self.assertEqual(self.read_reply(second_replies), 'KA-01-HH-1234\n')
+
+            # Test exit closes the connection only
+            second_gate.sendall('exit\n')
+            self.assertEqual(second_replies.readline(), '')
+            first_gate.sendall('leave 1\n')
+            self.assertEqual(self.read_reply(first_replies), 'Slot number 1 is free\n')
+            first_gate.close()
+            second_gate.close()
+        finally:
+            server.stop()
+            server_thread.join()
+
+        # Test the writes are in the database
+        self.assertEqual(utils.slot_number_for_registration_number('KA-01-HH-9999'), 2)
+        self.assertEqual(self.active_parkings_count(), 1)
+
+
+    def test_gate_server_snapshot(self):
+        self.park_vehicles()
+        snapshot_directory = tempfile.mkdtemp()
+        snapshot_path = os.path.join(snapshot_directory, 'parking_lot.snapshot')
+        utils.snapshot_parking_lot(snapshot_path)
+        db.session.remove()
+
+        server = GateServer('127.0.0.1', 0, snapshot_path)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+        try:
+            # Test the reads are answered from the snapshot or the memory parking lot loaded from it, then the writes
+            gate = socket.create_connection(server.address)
+            replies = gate.makefile('rb')
+            gate.sendall('slot_number_for_registration_number KA-01-HH-2701\nleave 5\nslot_numbers_for_cars_with_colour white\npark KA-01-HH-1235 Red\n')
+            self.assertEqual(self.read_reply(replies), '5\n')
+            self.assertEqual(self.read_reply(replies), 'Slot number 5 is free\n')
+            self.assertEqual(self.read_reply(replies), '1, 2\n')
+            self.assertEqual(self.read_reply(replies), 'Allocated slot number: 5\n')
+            self.assertIsNone(utils.mapped_snapshot)
+            gate.close()
+        finally:
+            server.stop()
+            server_thread.join()
+            os.remove(snapshot_path)
+            os.rmdir(snapshot_directory)
+
+
+class ShardTests(ParkingLotTestCase):
+
+    def test_shard_pool(self):
+        shard_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, shard_directory)
+        self.assertEqual([shards.shard_of(shards.lot_of(command_input), 2) for command_input in ['status', 'lot 2 status', 'lot 3 status', 'lot x status']], [1, 0, 1, 1])
+
+        # Test the messages come back in the order of the commands, each lot run by the worker of its shard
+        pool = shards.ShardPool(2, 'sqlite:///' + os.path.join(shard_directory, 'shard{shard}.db'))
+        try:
+            self.assertEqual(pool.run_commands(['create_parking_lot 2', 'lot 2 create_parking_lot 3', 'lot 2 park KA-01-HH-1234 White', 'park KA-01-HH-1234 White',
+                                                'lot 3 status', 'lot 2 slot_number_for_registration_number KA-01-HH-1234', 'lot 0 status']),
+                             ['Created a parking lot with 2 slots', 'Created a parking lot with 3 slots', 'Allocated slot number: 1', 'Allocated slot number: 1',
+                              'Parking Lot is empty', '1', 'Invalid Command. 0 is not a valid lot_id'])
+        finally:
+            pool.close()
+        self.assertEqual(sorted(os.listdir(shard_directory)), ['shard0.db', 'shard1.db'])
+
+        # Test the databases are refused with another number of shards, as lot 3 would go to shard 0
+        with self.assertRaisesRegexp(ValueError, 'The database of shard 0 belongs to shard 0 of 2 shards, not of 3'):
+            shards.ShardPool(3, 'sqlite:///' + os.path.join(shard_directory, 'shard{shard}.db'))
+        pool = shards.ShardPool(2, 'sqlite:///' + os.path.join(shard_directory, 'shard{shard}.db'))
+        try:
+            self.assertEqual(pool.run_commands(['lot 3 status', 'lot 2 slot_number_for_registration_number KA-01-HH-1234']), ['Parking Lot is empty', '1'])
+        finally:
+            pool.close()
+
+
+
+class SimulationTests(ParkingLotTestCase):
+
+    def test_simulate(self):
+        input_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, input_directory)
+        files = {'small.txt': ['create_parking_lot 2', 'park KA-01-HH-1234 White', 'status', 'exit', 'park KA-01-HH-9999 White'],
+                 'large.txt': ['create_parking_lot 3', 'park KA-01-HH-1234 White', 'park KA-01-HH-9999 Black', 'leave 1', 'park KA-01-BB-0001 White',
+                               'registration_numbers_for_cars_with_colour White', 'status']}
+        for name, command_inputs in files.items():
+            with open(os.path.join(input_directory, name), 'w') as input_file:
+                input_file.write(''.join('{}\n'.format(command_input) for command_input in command_inputs))
+        os.mkdir(os.path.join(input_directory, 'results'))
+        self.assertEqual([os.path.basename(path) for path in simulations.simulation_files(input_directory)], ['large.txt', 'small.txt'])
+
+        # Test every file runs against a new database, with the output of the file run alone
+        expected_outputs = {}
+        for name in files:
+            self.tearDown()
+            self.setUp()
+            output = StringIO()
+            with open(os.path.join(input_directory, name)) as input_file:
+                utils.play_file(input_file, output)
+            expected_outputs[name] = output.getvalue()
+        file_paths = simulations.simulation_files(input_directory) + [os.path.join(input_directory, 'missing.txt')]
+        # The workers log the failed runs to a file, their handler is that of the forked process
+        log_handle, log_path = tempfile.mkstemp()
+        os.close(log_handle)
+        self.addCleanup(os.remove, log_path)
+        log_handler = logging.FileHandler(log_path)
+        self.addCleanup(log_handler.close)
+        simulations.logger.addHandler(log_handler)
+        self.addCleanup(simulations.logger.removeHandler, log_handler)
+        for database_dir in [None, input_directory]:
+            results = dict((os.path.basename(result['file']), result) for result in simulations.run_simulations(file_paths, 2, database_dir))
+            self.assertEqual(dict((name, results[name]['output']) for name in files), expected_outputs)
+            self.assertEqual([results[name]['commands'] for name in ['large.txt', 'small.txt', 'missing.txt']], [7, 4, 0])
+            self.assertIsNone(results['small.txt']['error'])
+            self.assertTrue(results['missing.txt']['error'].startswith('IOError'))
+        self.assertEqual(sorted(os.listdir(input_directory)), ['large.txt', 'results', 'small.txt'])
+        with open(log_path) as log_file:
+            self.assertEqual([line for line in log_file if line.startswith('Simulation of')],
+                             ['Simulation of {} failed\n'.format(os.path.join(input_directory, 'missing.txt'))]*2)
+
+        summary = simulations.write_summary(os.path.join(input_directory, 'results'), results.values(), 2, 1.0)
+        self.assertEqual((summary['files'], summary['failed'], summary['commands']), (3, 1, 11))
+        with open(os.path.join(input_directory, 'results', 'large.txt.out')) as output_file:
+            self.assertEqual(output_file.read(), expected_outputs['large.txt'])
+        with open(os.path.join(input_directory, 'results', simulations.SUMMARY_FILE_NAME)) as summary_file:
+            self.assertEqual(json.load(summary_file)['runs'][1]['output'], os.path.join(input_directory, 'results', 'missing.txt.out'))
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    def test_workload_is_seeded(self):
+        first = workload.WorkloadGenerator(100, seed=7)
+        second = workload.WorkloadGenerator(100, seed=7)
+        self.assertEqual(list(first.setup()) + list(first.generate(500)), list(second.setup()) + list(second.generate(500)))
+
+    def test_workload_mix(self):
+        generator = workload.WorkloadGenerator(10, workload.parse_mix('park=1,status=1'), seed=0)
+        list(generator.setup())
+        self.assertEqual(set(command.split()[0] for command in generator.generate(100)), set(['park', 'status']))
+        self.assertRaises(ValueError, workload.parse_mix, 'fly=1')
+
+    def test_tariff(self):
+        tariff = billing.Tariff(15, 200, 2000)
+        dwell_times = numpy.array([0, 15*60, 15*60+1, 3600, 3601, 9*3600, 10*3600, 86400, 86401, 2*86400+3600])
+        self.assertEqual(list(tariff.fees(dwell_times)), [0, 0, 200, 200, 400, 1800, 2000, 2000, 2200, 4200])
+
+    def test_percentile(self):
+        values = range(1, 11)
+        self.assertEqual(runner.percentile(values, 50), 5)
+        self.assertEqual(runner.percentile(values, 95), 10)
+        self.assertEqual(runner.percentile(values, 0), 1)
+        self.assertIsNone(runner.percentile([], 50))
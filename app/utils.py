@@ -1,122 +1,1466 @@
-from app import db, models
+import bisect
+import contextlib
+import fnmatch
+import functools
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
 
-def create_parking_lot(number_of_slots):
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import IntegrityError
+
+from app import db, models, parking_lot
+from app.commands import LOT_PREFIX, commands, find_command, register_command, run_command_input
+from app.free_slots import FreeSlotIndex, slot_id_ranges
+from app.instrumentation import instrumentation
+from app.journal import Journal, read_frames
+from app.lookup_cache import LookupCache
+from app.memory import MemoryParkingLot
+from app.snapshot import MappedSnapshot, write_snapshot
+
+# The default parking lot, that of the commands given without a lot (see app.commands.LOT_PREFIX)
+LOT_ID = models.DEFAULT_LOT_ID
+
+# Free slots of the default parking lot, loaded lazily from the database on the first park
+free_slots = FreeSlotIndex()
+
+# The default parking lot of the 'memory' storage backend
+memory_lot = MemoryParkingLot()
+
+# Snapshot of the default parking lot answering the reads of the 'snapshot' storage backend, while the memory parking
+# lot loads (see map_snapshot)
+mapped_snapshot = None
+
+# Lookups of the 'sql' storage backend, checked against the generation of the parking lot (see cached_lot_generation)
+lookup_cache = LookupCache()
+
+# Free slot indexes, memory parking lots and lookup caches of the lots, by lot id. Those of the other lots than the
+# default one are created on their first use (see lot_state).
+free_slot_indexes = {LOT_ID: free_slots}
+memory_lots = {LOT_ID: memory_lot}
+lookup_caches = {LOT_ID: lookup_cache}
+
+def lot_state(states, lot_id, factory):
+    """
+    State of a lot kept by the process, e.g. its free slot index
+
+    Parameters:
+    states (dict): The states of the lots, by lot id
+    lot_id (int): The lot
+    factory (type): Creates the state of a lot, on its first use
+
+    Returns:
+    The state of the lot
+    """
+    state = states.get(lot_id)
+    if state is None:
+        state = states.setdefault(lot_id, factory())
+    return state
+
+def invalidate_free_slots():
+    """
+    Drops the free slot indexes of all the lots, e.g. after a failed transaction or in a forked process
+    """
+    for index in free_slot_indexes.values():
+        index.invalidate()
+
+def forget_lots():
+    """
+    Drops all the state of the lots kept by the process: free slot indexes, lookup caches and memory parking lots
+    """
+    invalidate_free_slots()
+    for cache in lookup_caches.values():
+        cache.clear()
+    for lot in memory_lots.values():
+        lot.clear()
+
+# Serialises the state changing operations of the threads of a process, which share the free slot index and the
+# memory parking lot. Across processes, writes are serialised by the database write lock (see begin_write).
+write_lock = threading.RLock()
+
+def serialised(function):
+    """
+    Decorator running the call under the write lock of the process
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with write_lock:
+            return function(*args, **kwargs)
+    return wrapper
+
+# Storage backend of the current thread, overriding the configured one (see using_storage_backend)
+thread_storage_backend = threading.local()
+
+@contextlib.contextmanager
+def using_storage_backend(backend):
+    """
+    Context manager running the calls of the current thread on the given storage backend, e.g. to mirror SQL writes
+    on the memory parking lot
+
+    Parameters:
+    backend (string): 'sql' or 'memory'
+    """
+    previous_backend = getattr(thread_storage_backend, 'name', None)
+    thread_storage_backend.name = backend
+    try:
+        yield
+    finally:
+        thread_storage_backend.name = previous_backend
+
+def current_storage_backend():
+    """
+    The storage backend of the current thread, or the configured one
+    """
+    return getattr(thread_storage_backend, 'name', None) or parking_lot.config['STORAGE_BACKEND']
+
+def storage_backend(function):
+    """
+    Decorator routing the call to the same named method of the memory parking lot, if 'memory' is the storage backend
+    (of the thread, or the configured one), or of the mapped snapshot for the read-only 'snapshot' backend. The
+    memory parking lot is that of the lot_id keyword argument, the default lot without it. The SQL implementation
+    stays available as the `sql` attribute of the decorated function.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        backend = current_storage_backend()
+        if backend == 'memory':
+            return getattr(lot_state(memory_lots, kwargs.pop('lot_id', LOT_ID), MemoryParkingLot), function.__name__)(*args, **kwargs)
+        if backend == 'snapshot':
+            # The snapshot is that of the default lot. The memory parking lot, once the snapshot is dropped.
+            lot_id = kwargs.pop('lot_id', LOT_ID)
+            snapshot = mapped_snapshot if lot_id == LOT_ID else None
+            return getattr(snapshot or lot_state(memory_lots, lot_id, MemoryParkingLot), function.__name__)(*args, **kwargs)
+        return function(*args, **kwargs)
+
+    wrapper.sql = function
+    return wrapper
+
+def stored_lot_ids():
+    """
+    The lots of the storage backend
+
+    Parameters:
+    None
+
+    Returns:
+    list: The lot ids, in order, the default lot among them
+    """
+    if current_storage_backend() == 'memory':
+        lot_ids = memory_lots.keys()
+    else:
+        lot_ids = [lot_id for (lot_id,) in db.session.query(models.Lot.id)]
+    return sorted(set(lot_ids) | set([LOT_ID]))
+
+def load_memory_lot(snapshot=None, lot_id=LOT_ID):
+    """
+    Loads the memory parking lot from the SQL tables, or from a snapshot of them
+
+    Parameters:
+    snapshot (MappedSnapshot): The snapshot to load, the SQL tables if None
+    lot_id (int): The lot
+
+    Returns:
+    int: number of active parkings loaded
+    """
+    lot = lot_state(memory_lots, lot_id, MemoryParkingLot)
+    if snapshot is not None:
+        lot.load(snapshot.slots(), snapshot.parkings(), snapshot.layout(), snapshot.entrances())
+    else:
+        lot.load(
+            db.session.query(models.Slot.id, models.Slot.active).filter(models.Slot.lot_id==lot_id),
+            db.session.query(models.Parking.slot_id, models.Parking.registration_number, models.Parking.colour).filter(models.Parking.active==True, models.Parking.lot_id==lot_id),
+            slot_layout(lot_id),
+            db.session.query(models.Entrance.name, models.Entrance.level, models.Entrance.x, models.Entrance.y).filter(models.Entrance.lot_id==lot_id),
+        )
+    return len(lot.parkings)
+
+def slot_layout(lot_id=LOT_ID):
+    """
+    The slots laid out (see layout_slots)
+
+    Parameters:
+    lot_id (int): The lot
+
+    Returns:
+    Query: (slot_id, level, x, y, slot_type) of the slots not at level 0, (0, 0) or not of the first slot type
+    """
+    slots = models.Slot
+    return db.session.query(slots.id, slots.level, slots.x, slots.y, slots.slot_type).filter(
+        slots.lot_id==lot_id, db.or_(slots.level!=0, slots.x!=0, slots.y!=0, slots.slot_type!=models.SLOT_TYPES[0]))
+
+def load_memory_lots(lot_ids=None):
+    """
+    Loads the memory parking lots from the SQL tables
+
+    Parameters:
+    lot_ids (iterable): The lots to load, all the lots of the database if None
+
+    Returns:
+    int: number of active parkings loaded
+    """
+    with using_storage_backend('sql'):
+        lot_ids = stored_lot_ids() if lot_ids is None else lot_ids
+    return sum(load_memory_lot(lot_id=lot_id) for lot_id in lot_ids)
+
+def map_snapshot(snapshot_path):
+    """
+    Maps the snapshot file for the reads of the 'snapshot' storage backend, if it is the current state of the default
+    parking lot
+
+    Parameters:
+    snapshot_path (string): The path of the snapshot file
+
+    Returns:
+    MappedSnapshot: The mapped snapshot, None if there is no snapshot or the parking lot changed since it was written
+    """
+    global mapped_snapshot
+    if not os.path.exists(snapshot_path):
+        return None
+    snapshot = MappedSnapshot(snapshot_path)
+    if snapshot.generation != lot_generation():
+        snapshot.close()
+        return None
+    mapped_snapshot = snapshot
+    return snapshot
+
+def unmap_snapshot():
+    """
+    Drops the mapped snapshot, the reads of the 'snapshot' storage backend go to the memory parking lot from now on.
+    The map is closed once the reads in progress are done with it.
+    """
+    global mapped_snapshot
+    mapped_snapshot = None
+
+# Journals of the write commands by path, opened on the first write (see command_journal)
+journals = {}
+
+# Whether the write commands of the current thread are journaled (see without_journal)
+thread_journal = threading.local()
+
+# Prefix of the time of a journal entry, e.g. ["at", 1767225600, "park", "KA-01-HH-1234", "White"]
+TIME_PREFIX = 'at'
+
+@contextlib.contextmanager
+def without_journal():
+    """
+    Context manager running the write commands of the current thread without journaling them, e.g. to replay the
+    journal or to mirror journaled commands
+    """
+    previous_suspended = getattr(thread_journal, 'suspended', False)
+    thread_journal.suspended = True
+    try:
+        yield
+    finally:
+        thread_journal.suspended = previous_suspended
+
+def checkpoint_path(journal_path, lot_id=LOT_ID):
+    if lot_id == LOT_ID:
+        return '{}.checkpoint'.format(journal_path)
+    return '{}.checkpoint.{}'.format(journal_path, lot_id)
+
+def lot_checkpoint_paths(journal_path):
+    """
+    The checkpoints of the lots, see checkpoint_journal
+
+    Parameters:
+    journal_path (string): The path of the journal file
+
+    Returns:
+    list: (lot_id, checkpoint path) pairs, by lot
+    """
+    directory, file_name = os.path.split(checkpoint_path(journal_path))
+    paths = []
+    for checkpoint_file_name in os.listdir(directory or os.curdir):
+        lot_suffix = checkpoint_file_name[len(file_name)+1:]
+        if checkpoint_file_name == file_name:
+            paths.append((LOT_ID, os.path.join(directory, checkpoint_file_name)))
+        elif checkpoint_file_name.startswith(file_name + '.') and lot_suffix.isdigit():
+            paths.append((int(lot_suffix), os.path.join(directory, checkpoint_file_name)))
+    return sorted(paths)
+
+def command_journal():
+    """
+    The journal of the write commands (see app.journal), opened after the latest checkpoint of the default lot
+
+    Parameters:
+    None
+
+    Returns:
+    Journal: The journal of JOURNAL_PATH, None if the journal is disabled
+    """
+    journal_path = parking_lot.config['JOURNAL_PATH']
+    if not journal_path:
+        return None
+    journal = journals.get(journal_path)
+    if journal is None or journal.pid != os.getpid():
+        offset, sequence = 0, 0
+        if os.path.exists(checkpoint_path(journal_path)):
+            checkpoint = MappedSnapshot(checkpoint_path(journal_path))
+            offset, sequence = checkpoint.journal_offset, checkpoint.journal_sequence
+            checkpoint.close()
+        journal = journals[journal_path] = Journal(journal_path, parking_lot.config['JOURNAL_GROUP_SIZE'], offset, sequence)
+        journal.checkpoint_sequence = sequence
+    return journal
+
+def journaled(command_name, timed=False):
+    """
+    Decorator appending the calls of a write command to the journal, once they are committed. Inside a batch, the
+    commands are appended when the batch transaction commits, with a single write and fsync, and dropped if it rolls
+    back.
+
+    Entries are the words of the command input, as a JSON list, e.g. ["park", "KA-01-HH-1234", "White"] or
+    ["lot", 2, "leave", 4] for another lot than the default one. The entries of timed commands start with the time
+    they stamped the parking with, e.g. ["at", 1767225600, "leave", 4], which the replay stamps it with again.
+
+    Parameters:
+    command_name (string): The command the calls are replayed with (see replay_journal)
+    timed (bool): Whether the command stamps the parkings with the current time (see current_time)
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            journal = command_journal()
+            if journal is None or getattr(thread_journal, 'suspended', False):
+                return function(*args, **kwargs)
+
+            batched = db.session().transaction.nested
+            lot_id = kwargs.get('lot_id', LOT_ID)
+            prefix = [LOT_PREFIX, lot_id] if lot_id != LOT_ID else []
+            if timed:
+                stamped_at = current_time()
+                prefix += [TIME_PREFIX, stamped_at]
+                with frozen_time(stamped_at):
+                    result = function(*args, **kwargs)
+            else:
+                result = function(*args, **kwargs)
+            entry = json.dumps(prefix + [command_name] + list(args))
+            if batched:
+                db.session().info.setdefault('journal_entries', []).append(entry)
+            else:
+                journal.append([entry])
+                checkpoint_journal()
+            return result
+        return wrapper
+    return decorator
+
+# The events of savepoints are skipped, the entries of a batch wait for the batch transaction
+@event.listens_for(db.session, 'after_commit')
+def append_journal_entries(session):
+    if session.transaction.nested:
+        return
+    entries = session.info.pop('journal_entries', None)
+    journal = command_journal()
+    if entries and journal is not None:
+        journal.append(entries)
+        journal.sync()
+
+@event.listens_for(db.session, 'after_rollback')
+def drop_journal_entries(session):
+    if not session.transaction.nested:
+        session.info.pop('journal_entries', None)
+
+def checkpoint_journal(force=False):
+    """
+    Writes a checkpoint of the journal, a snapshot of every lot recording the last journaled command, once
+    JOURNAL_CHECKPOINT_INTERVAL commands are journaled since the previous one. Recovery starts from it.
+
+    The checkpoint of the default lot is written last, the journal is replayed from it: should a crash interrupt the
+    checkpoint, the lots already written skip the commands they hold (see replay_journal).
+
+    Parameters:
+    force (bool): Whether the checkpoint is written whatever the number of commands since the previous one
+
+    Returns:
+    int: The sequence of the last journaled command, None if no checkpoint was written
+    """
+    journal = command_journal()
+    if journal is None or (not force and journal.sequence-journal.checkpoint_sequence < parking_lot.config['JOURNAL_CHECKPOINT_INTERVAL']):
+        return None
+    with write_lock:
+        journal.sync()
+        for lot_id in sorted(stored_lot_ids(), key=lambda lot_id: lot_id == LOT_ID):
+            snapshot_parking_lot(checkpoint_path(journal.path, lot_id), journal.sequence, journal.end, lot_id=lot_id)
+        journal.checkpoint_sequence = journal.sequence
+    return journal.sequence
+
+# Journaled commands replayed in a single transaction, with the SQL storage backend
+REPLAY_BATCH_SIZE = 1000
+
+def _replay_handler(function, backend):
+    """
+    The implementation of a journaled storage_backend function, called with the lot id and the arguments
+    """
+    if backend == 'memory':
+        method = getattr(MemoryParkingLot, function.__name__)
+        return lambda lot_id, *args: method(lot_state(memory_lots, lot_id, MemoryParkingLot), *args)
+    return lambda lot_id, *args: function.sql(*args, lot_id=lot_id)
+
+def replay_journal(journal_path, offset=0, checkpoint_sequences=None):
+    """
+    Runs the journaled commands again, straight through the storage backend: there is no parsing of command inputs nor
+    formatting of messages, and the write lock is taken once for the whole replay. With the SQL storage backend, the
+    commands are run in batches, each in a single transaction.
+
+    Parameters:
+    journal_path (string): The path of the journal file
+    offset (int): The offset of the first frame replayed
+    checkpoint_sequences (dict): The sequence of the checkpoint of every lot, the commands of a lot up to it are
+        skipped
+
+    Returns:
+    int: number of commands replayed
+    """
+    backend = current_storage_backend()
+    checkpoint_sequences = checkpoint_sequences or {}
+    handlers = {}
+    replayed = 0
+    with write_lock, without_journal():
+        for sequence, payload, _ in read_frames(journal_path, offset):
+            entry = json.loads(payload)
+            lot_id, stamped_at = LOT_ID, None
+            if entry[0] == LOT_PREFIX:
+                lot_id, entry = entry[1], entry[2:]
+            if entry[0] == TIME_PREFIX:
+                stamped_at, entry = entry[1], entry[2:]
+            if sequence <= checkpoint_sequences.get(lot_id, 0):
+                continue
+            handler = handlers.get(entry[0])
+            if handler is None:
+                handler = handlers[entry[0]] = _replay_handler(commands[entry[0]].handler, backend)
+
+            if backend == 'sql':
+                if replayed % REPLAY_BATCH_SIZE == 0:
+                    db.session.commit()
+                    begin_write()
+                savepoint = db.session.begin_nested()
+                with frozen_time(stamped_at):
+                    handler(lot_id, *entry[1:])
+                if savepoint.is_active:
+                    savepoint.commit()
+            else:
+                handler(lot_id, *entry[1:])
+            replayed += 1
+        db.session.commit()
+    return replayed
+
+def recover_parking_lot():
+    """
+    Recovers the parking lots from the journal: the latest checkpoints are restored, then the commands journaled after
+    them are replayed
+
+    Parameters:
+    None
+
+    Returns:
+    tuple: The number of parkings restored from the checkpoints and the number of commands replayed
+    """
+    journal_path = parking_lot.config['JOURNAL_PATH']
+    restored, offset = 0, 0
+    checkpoint_sequences = {}
+    with without_journal():
+        for lot_id, lot_checkpoint_path in lot_checkpoint_paths(journal_path):
+            checkpoint = MappedSnapshot(lot_checkpoint_path)
+            checkpoint_sequences[lot_id] = checkpoint.journal_sequence
+            if lot_id == LOT_ID:
+                offset = checkpoint.journal_offset
+            checkpoint.close()
+            restored += restore_parking_lot(lot_checkpoint_path, lot_id=lot_id)
+        return restored, replay_journal(journal_path, offset, checkpoint_sequences)
+
+# Attempts of a park, when the allocated slot turns out to be taken
+PARK_ATTEMPTS = 3
+
+# Time the parkings of the current thread are stamped with, instead of the clock (see frozen_time)
+thread_clock = threading.local()
+
+@contextlib.contextmanager
+def frozen_time(seconds):
+    """
+    Context manager stamping the parkings of the current thread with the given time, e.g. the journaled time of a
+    replayed command. None leaves the clock as it is.
+
+    Parameters:
+    seconds (int): Seconds since the epoch
+    """
+    previous_seconds = getattr(thread_clock, 'seconds', None)
+    thread_clock.seconds = seconds if seconds is not None else previous_seconds
+    try:
+        yield
+    finally:
+        thread_clock.seconds = previous_seconds
+
+def current_time():
+    """
+    The time parkings are stamped with, at entry and exit
+
+    Returns:
+    int: Seconds since the epoch, the frozen time if any (see frozen_time)
+    """
+    seconds = getattr(thread_clock, 'seconds', None)
+    if seconds is not None:
+        return seconds
+    return int(time.time())
+
+def lot_generation(lot_id=LOT_ID):
+    """
+    The generation of the parking lot, bumped by every change of it
+
+    Parameters:
+    lot_id (int): The lot
+
+    Returns:
+    int: The generation, 0 for a new lot
+    """
+    return db.session.query(models.Lot.generation).filter_by(id=lot_id).scalar() or 0
+
+# Connection of the thread reading the generation for the lookup cache
+generation_connection = threading.local()
+
+def cached_lot_generation(lot_id=LOT_ID):
+    """
+    The generation of the parking lot, read for the lookup cache on a connection of its own. Opening a session
+    connection costs more than the cached lookup saves, so the generation is read with a persistent connection of the
+    thread (re-opened in a forked process or for another database).
+
+    Parameters:
+    lot_id (int): The lot
+
+    Returns:
+    int: The generation, None if the lookup cache is not to be used: inside a batch, whose uncommitted changes only
+    its session sees, or for a database other than a SQLite file
+    """
+    if db.session().transaction.nested:
+        return None
+
+    database_uri = parking_lot.config['SQLALCHEMY_DATABASE_URI']
+    if getattr(generation_connection, 'key', None) != (database_uri, os.getpid()):
+        generation_connection.key = (database_uri, os.getpid())
+        url = make_url(database_uri)
+        if url.get_backend_name() == 'sqlite' and url.database not in [None, '', ':memory:']:
+            generation_connection.connection = sqlite3.connect(url.database, timeout=parking_lot.config['SQLITE_BUSY_TIMEOUT']/1000.0, isolation_level=None)
+        else:
+            generation_connection.connection = None
+
+    if generation_connection.connection is None:
+        return None
+    row = generation_connection.connection.execute('SELECT generation FROM lot WHERE id = ?', (lot_id,)).fetchone()
+    return row[0] if row else 0
+
+def _advance_lookup_cache(previous_generation, generation, batched, lot_id=LOT_ID):
+    """
+    Moves the lookup cache of the lot to the generation committed by this process
+
+    Parameters:
+    previous_generation (int): The generation the change was made on
+    generation (int): The new generation
+    batched (bool): Whether the change was made in a savepoint of a batch, which may still be rolled back
+    lot_id (int): The lot
+
+    Returns:
+    bool: Whether the change is to be applied to the cache. The cache is cleared instead for a batched change, or if it
+    did not reflect the previous generation.
+    """
+    cache = lot_state(lookup_caches, lot_id, LookupCache)
+    if batched:
+        cache.clear()
+        return False
+    return cache.advance(previous_generation, generation)
+
+def _bump_lot_generation(generation, lot_id=LOT_ID, **counters):
+    """
+    Records a change of the parking lot in the current transaction, with the counters it changes
+
+    Parameters:
+    generation (int): The current generation
+    lot_id (int): The lot
+    counters: New values of the counters of the lot (see models.Lot), in the same update. Increments, e.g.
+        `models.Lot.parked_vehicles+1`, are only given for an existing lot: the lot row is created by the writes
+        setting its counters (create_parking_lot, resize_parking_lot and restore_parking_lot).
+
+    Returns:
+    int: The new generation
+    """
+    if not models.Lot.query.filter_by(id=lot_id).update(dict(counters, generation=generation+1), synchronize_session=False):
+        db.session.add(models.Lot(id=lot_id, generation=generation+1, **counters))
+    return generation+1
+
+def _count_colour(colour_key, change, lot_id=LOT_ID):
+    """
+    Adds to the number of parked vehicles of a colour in the current transaction
+
+    Parameters:
+    colour_key (string): The colour, see models.colour_key
+    change (int): The number of vehicles parked (or left, if negative)
+    lot_id (int): The lot
+    """
+    lot_colour = models.LotColour.query.filter_by(lot_id=lot_id, colour_key=colour_key)
+    if not lot_colour.update(dict(parked_vehicles=models.LotColour.parked_vehicles+change), synchronize_session=False):
+        db.session.add(models.LotColour(lot_id=lot_id, colour_key=colour_key, parked_vehicles=change))
+
+def begin_write(lot_id=LOT_ID):
+    """
+    Starts the transaction of a state changing operation with BEGIN IMMEDIATE, taking the database write lock up
+    front. Writers sharing the database (e.g. the processes of several gates) are serialised on the lock instead of
+    reading the same free slot, and a read transaction is never upgraded to a write one, which SQLite can only fail.
+    Inside a batch (a savepoint is active), the batch transaction already holds the lock.
+
+    The free slot index of the lot is dropped if another process changed the lot since the index was built.
+
+    Parameters:
+    lot_id (int): The lot written
+
+    Returns:
+    int: The generation of the parking lot
+    """
+    if not db.session().transaction.nested:
+        db.session.commit()  # Ends the read transaction of a previous command, if any
+        db.session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
+
+    generation = lot_generation(lot_id)
+    lot_free_slots = lot_state(free_slot_indexes, lot_id, FreeSlotIndex)
+    if lot_free_slots.generation != generation:
+        lot_free_slots.invalidate()
+    return generation
+
+def free_slot_index(generation, lot_id=LOT_ID):
+    """
+    The free slot index of the lot, (re-)built from the database if it is not loaded
+
+    Parameters:
+    generation (int): The current generation of the parking lot
+    lot_id (int): The lot
+
+    Returns:
+    FreeSlotIndex: The index of free and active slots
+    """
+    lot_free_slots = lot_state(free_slot_indexes, lot_id, FreeSlotIndex)
+    if not lot_free_slots.loaded:
+        # Two linear scans, instead of a correlated sub-query or binding every occupied slot id as a parameter
+        occupied_slots = set(slot_id for (slot_id,) in db.session.query(models.Parking.slot_id).filter(models.Parking.active==True, models.Parking.lot_id==lot_id))
+        slots = db.session.query(models.Slot.id).filter(models.Slot.lot_id==lot_id)
+        inactive_slots = slot_id_ranges(slot_id for (slot_id,) in slots.filter(models.Slot.active.is_(False)).order_by(models.Slot.id))
+        lot_free_slots.load((slot_id for (slot_id,) in slots if slot_id not in occupied_slots), generation, inactive_slots)
+    return lot_free_slots
+
+# Slots are inserted in chunks to bound the memory used by the insert parameters
+SLOT_INSERT_CHUNK_SIZE = 10000
+
+def _insert_slots(first_slot_id, last_slot_id, lot_id=LOT_ID):
+    """
+    Bulk inserts the slots in the current transaction
+
+    Parameters:
+    first_slot_id (int): The first slot number
+    last_slot_id (int): The last slot number (inclusive)
+    lot_id (int): The lot
+
+    Returns:
+    None
+    """
+    for chunk_start in xrange(first_slot_id, last_slot_id+1, SLOT_INSERT_CHUNK_SIZE):
+        chunk_end = min(chunk_start+SLOT_INSERT_CHUNK_SIZE, last_slot_id+1)
+        db.session.bulk_insert_mappings(models.Slot, [dict(lot_id=lot_id, id=slot, active=True) for slot in xrange(chunk_start, chunk_end)])
+
+@serialised
+@journaled('create_parking_lot')
+@storage_backend
+def create_parking_lot(number_of_slots, lot_id=LOT_ID):
     """
     Creates the parking lot
 
     Parameters:
     number_of_slots (int): The number of parking slots
+    lot_id (int): The lot, the other lots are left as they are
 
     Returns:
-    int: number of slots created
+    int: number of slots created, ValueError is raised if number_of_slots is below 1
     """
+    models.checked_number_of_slots(number_of_slots)
+    previous_generation = begin_write(lot_id)
+    batched = db.session().transaction.nested
+    lot_free_slots = lot_state(free_slot_indexes, lot_id, FreeSlotIndex)
+    lot_free_slots.invalidate()
+
     # Check if the parking lot is already created or not. If yes, drop and create again.
-    if models.Slot.query.count() > 0:
-        models.Slot.query.delete()
-        models.Parking.query.delete()
+    if models.Slot.query.filter_by(lot_id=lot_id).count() > 0:
+        models.ParkingHistory.query.filter_by(lot_id=lot_id).delete()
+        models.Parking.query.filter_by(lot_id=lot_id).delete()
+        models.Slot.query.filter_by(lot_id=lot_id).delete()
+        models.LotColour.query.filter_by(lot_id=lot_id).delete()
+        models.Entrance.query.filter_by(lot_id=lot_id).delete()
 
-    for slot in xrange(1, number_of_slots+1):
-        db.session.add(models.Slot(id=slot))
+    # All the slots are created in a single transaction
+    _insert_slots(1, number_of_slots, lot_id)
+    generation = _bump_lot_generation(previous_generation, lot_id, active_slots=number_of_slots, parked_vehicles=0)
+    db.session.commit()
+
+    lot_free_slots.load(xrange(1, number_of_slots+1), generation)
+    if _advance_lookup_cache(previous_generation, generation, batched, lot_id):
+        lot_state(lookup_caches, lot_id, LookupCache).clear(generation)
+
+    return number_of_slots
+
+@serialised
+@journaled('resize_parking_lot')
+@storage_backend
+def resize_parking_lot(number_of_slots, lot_id=LOT_ID):
+    """
+    Resizes the parking lot by adding or retiring slots at the end. Retired slots are marked inactive, their parking
+    history is kept.
+
+    Parameters:
+    number_of_slots (int): The new number of parking slots
+    lot_id (int): The lot
+
+    Returns:
+    int: number of slots or -1 if a slot to be retired is occupied, ValueError is raised if number_of_slots is below 1
+    """
+    models.checked_number_of_slots(number_of_slots)
+    previous_generation = begin_write(lot_id)
+    batched = db.session().transaction.nested
+
+    # Slots to be retired need to be free
+    if models.Parking.query.filter(models.Parking.active==True, models.Parking.lot_id==lot_id, models.Parking.slot_id > number_of_slots).first():
         db.session.commit()
+        return -1
+
+    slots = models.Slot.query.filter(models.Slot.lot_id==lot_id)
+    last_slot_id = slots.with_entities(db.func.max(models.Slot.id)).scalar() or 0
+
+    slots.filter(models.Slot.id > number_of_slots).update(dict(active=False), synchronize_session=False)
+    slots.filter(models.Slot.id <= number_of_slots).update(dict(active=True), synchronize_session=False)
+    _insert_slots(last_slot_id+1, number_of_slots, lot_id)
+    generation = _bump_lot_generation(previous_generation, lot_id, active_slots=number_of_slots)
+    db.session.commit()
+
+    # The parked vehicles are unchanged
+    _advance_lookup_cache(previous_generation, generation, batched, lot_id)
+
+    lot_free_slots = lot_state(free_slot_indexes, lot_id, FreeSlotIndex)
+    if lot_free_slots.loaded:
+        lot_free_slots.drop_queues()  # The new slots are in none of them
+        lot_free_slots.push_all(xrange(last_slot_id+1, number_of_slots+1))
+        lot_free_slots.activate(1, number_of_slots)
+        if number_of_slots < last_slot_id:
+            lot_free_slots.deactivate(number_of_slots+1, last_slot_id)
+        lot_free_slots.generation = generation
 
     return number_of_slots
 
-def park_vehicle(registration_number, colour):
+@serialised
+@journaled('layout_slots')
+@storage_backend
+def layout_slots(first_slot_id, last_slot_id, level, x, y, slot_type, lot_id=LOT_ID):
+    """
+    Places a row of slots: the slots from first_slot_id to last_slot_id are given the level, the type and consecutive
+    x coordinates from x
+
+    Parameters:
+    first_slot_id (int): The first slot of the row
+    last_slot_id (int): The last slot of the row (inclusive)
+    level (int): The level of the row
+    x (int): The x coordinate of the first slot
+    y (int): The y coordinate of the row
+    slot_type (string): The type of the slots, one of models.SLOT_TYPES
+    lot_id (int): The lot
+
+    Returns:
+    int: number of slots laid out or -1 if the slot type is unknown
+    """
+    if slot_type not in models.SLOT_TYPES:
+        return -1
+
+    previous_generation = begin_write(lot_id)
+    batched = db.session().transaction.nested
+    laid_out = models.Slot.query.filter(models.Slot.lot_id==lot_id, models.Slot.id >= first_slot_id, models.Slot.id <= last_slot_id).update(
+        dict(level=level, x=x+models.Slot.id-first_slot_id, y=y, slot_type=slot_type), synchronize_session=False)
+    generation = _bump_lot_generation(previous_generation, lot_id)
+    db.session.commit()
+
+    # The parked vehicles are unchanged, the queues of the entrances are built again
+    _advance_lookup_cache(previous_generation, generation, batched, lot_id)
+    lot_free_slots = lot_state(free_slot_indexes, lot_id, FreeSlotIndex)
+    if lot_free_slots.loaded:
+        lot_free_slots.drop_queues()
+        lot_free_slots.generation = generation
+    return laid_out
+
+@serialised
+@journaled('add_entrance')
+@storage_backend
+def add_entrance(name, level, x, y, lot_id=LOT_ID):
+    """
+    Adds an entrance to the parking lot, or moves the one with the same name
+
+    Parameters:
+    name (string): The name the entrance is given by when parking
+    level (int): The level of the entrance
+    x (int): The x coordinate of the entrance
+    y (int): The y coordinate of the entrance
+    lot_id (int): The lot
+
+    Returns:
+    string: The name of the entrance
+    """
+    previous_generation = begin_write(lot_id)
+    batched = db.session().transaction.nested
+    db.session.merge(models.Entrance(lot_id=lot_id, name=name, level=level, x=x, y=y))
+    generation = _bump_lot_generation(previous_generation, lot_id)
+    db.session.commit()
+
+    _advance_lookup_cache(previous_generation, generation, batched, lot_id)
+    lot_free_slots = lot_state(free_slot_indexes, lot_id, FreeSlotIndex)
+    if lot_free_slots.loaded:
+        lot_free_slots.drop_queues()
+        lot_free_slots.generation = generation
+    return name
+
+@serialised
+@journaled('deactivate_slots')
+@storage_backend
+def deactivate_slots(slots, lot_id=LOT_ID):
+    """
+    Marks a range of slots inactive, e.g. a floor closed for repairs: no vehicle is parked in them until they are
+    activated again (or the parking lot is resized over them). The vehicles already parked in them stay, and can leave.
+
+    The slots are updated by a single statement, and skipped by the free slot index a range at a time: the cost does
+    not depend on the number of slots.
+
+    Parameters:
+    slots (string): The range of slots, `first-last` (see models.slot_range)
+    lot_id (int): The lot
+
+    Returns:
+    tuple: The number of slots deactivated, those of the range which were active, and the status of the vehicles
+    parked in the range
+    """
+    first_slot_id, last_slot_id = models.slot_range(slots)
+    previous_generation = begin_write(lot_id)
+    batched = db.session().transaction.nested
+    range_slots = models.Slot.query.filter(models.Slot.lot_id==lot_id, models.Slot.id >= first_slot_id, models.Slot.id <= last_slot_id)
+    deactivated = range_slots.filter(models.Slot.active.is_(True)).update(dict(active=False), synchronize_session=False)
+    last_slot_id = min(last_slot_id, range_slots.with_entities(db.func.max(models.Slot.id)).scalar() or 0)
+    parkings = db.session.query(models.Parking.slot_id, models.Parking.registration_number, models.Parking.colour).filter(
+        models.Parking.active==True, models.Parking.lot_id==lot_id, models.Parking.slot_id >= first_slot_id, models.Parking.slot_id <= last_slot_id).order_by(models.Parking.slot_id).all()
+    # A lot without a lot row has no slot to deactivate, its counter is only updated if slots changed
+    generation = _bump_lot_generation(previous_generation, lot_id, **(dict(active_slots=models.Lot.active_slots-deactivated) if deactivated else {}))
+    db.session.commit()
+
+    # The parked vehicles are unchanged
+    _advance_lookup_cache(previous_generation, generation, batched, lot_id)
+    lot_free_slots = lot_state(free_slot_indexes, lot_id, FreeSlotIndex)
+    if lot_free_slots.loaded:
+        if first_slot_id <= last_slot_id:
+            lot_free_slots.deactivate(first_slot_id, last_slot_id)
+        lot_free_slots.generation = generation
+    return deactivated, [{"slot_id": slot_id, "registration_number": registration_number, "colour": colour} for slot_id, registration_number, colour in parkings]
+
+@serialised
+@journaled('activate_slots')
+@storage_backend
+def activate_slots(slots, lot_id=LOT_ID):
+    """
+    Marks a range of slots active again, at the same cost whatever the number of slots (see deactivate_slots)
+
+    Parameters:
+    slots (string): The range of slots, `first-last` (see models.slot_range)
+    lot_id (int): The lot
+
+    Returns:
+    int: The number of slots activated, those of the range which were inactive
+    """
+    first_slot_id, last_slot_id = models.slot_range(slots)
+    previous_generation = begin_write(lot_id)
+    batched = db.session().transaction.nested
+    activated = models.Slot.query.filter(models.Slot.lot_id==lot_id, models.Slot.active.is_(False), models.Slot.id >= first_slot_id, models.Slot.id <= last_slot_id).update(
+        dict(active=True), synchronize_session=False)
+    generation = _bump_lot_generation(previous_generation, lot_id, **(dict(active_slots=models.Lot.active_slots+activated) if activated else {}))
+    db.session.commit()
+
+    _advance_lookup_cache(previous_generation, generation, batched, lot_id)
+    lot_free_slots = lot_state(free_slot_indexes, lot_id, FreeSlotIndex)
+    if lot_free_slots.loaded:
+        lot_free_slots.activate(first_slot_id, last_slot_id)
+        lot_free_slots.generation = generation
+    return activated
+
+def _entrance_queue(lot_free_slots, entrance, slot_type, lot_id=LOT_ID):
+    """
+    Loads the queue of the free slots of the type nearest the entrance in the free slot index, with the distances of
+    the slots computed once (see models.distance)
+
+    Returns:
+    tuple: The key of the queue, None if there is no such entrance
+    """
+    key = (entrance, slot_type)
+    if not lot_free_slots.has_queue(key):
+        position = db.session.query(models.Entrance.level, models.Entrance.x, models.Entrance.y).filter_by(lot_id=lot_id, name=entrance).first()
+        if position is None:
+            return None
+        slots = db.session.query(models.Slot.id, models.Slot.level, models.Slot.x, models.Slot.y).filter(models.Slot.lot_id==lot_id, models.Slot.slot_type==slot_type)
+        lot_free_slots.load_queue(key, dict((slot_id, models.distance(position, (level, x, y))) for slot_id, level, x, y in slots))
+    return key
+
+@serialised
+@journaled('park', timed=True)
+@storage_backend
+def park_vehicle(registration_number, colour, entrance=None, slot_type=models.SLOT_TYPES[0], lot_id=LOT_ID):
     """
     Parks the vehicle
 
     Parameters:
     registration_number (string): The registration number of the vehicle (car in our project)
     colour (string): The colour of the vehicle
+    entrance (string): The entrance the vehicle came in by, the nearest free slot of the type is allocated. Without
+        it, the lowest numbered free slot of any type.
+    slot_type (string): The type of slot needed, one of models.SLOT_TYPES
+    lot_id (int): The lot
 
     Returns:
-    int: Slot number or -1 for "parking lot full" or -2 for "repeated parking"
+    int: Slot number or -1 for "parking lot full" or -2 for "repeated parking" or -3 for an unknown entrance or -4 for
+    an unknown slot type
     """
-    # Check if the vehicle is already parked and not repeated parking
-    repeated_parking = models.Parking.query.filter(models.Parking.active.is_(True), models.Parking.registration_number==registration_number).first()
-    if repeated_parking:
-        slot_id = -2
-    else:
+    if slot_type not in models.SLOT_TYPES:
+        return -4
+
+    for attempt in xrange(PARK_ATTEMPTS):
+        previous_generation = begin_write(lot_id)
+        batched = db.session().transaction.nested
+
+        # Check if the vehicle is already parked and not repeated parking
+        if models.Parking.query.filter(models.Parking.active==True, models.Parking.lot_id==lot_id, models.Parking.registration_number==registration_number).first():
+            db.session.commit()
+            return -2
+
         # Find the available slot
-        occupied_slots = zip(*db.session.query(models.Slot.id).outerjoin(models.Parking).filter(models.Parking.active.is_(True), models.Slot.active.is_(True)).all())
-        slot = models.Slot.query.order_by(models.Slot.id).filter(~models.Slot.id.in_(occupied_slots[0] if occupied_slots else [])).first()
+        lot_free_slots = free_slot_index(previous_generation, lot_id)
+        if entrance is None:
+            slot_id = lot_free_slots.pop()
+        else:
+            key = _entrance_queue(lot_free_slots, entrance, slot_type, lot_id)
+            if key is None:
+                db.session.commit()
+                return -3
+            slot_id = lot_free_slots.pop_nearest(key)
+        if slot_id is None:
+            db.session.commit()
+            return -1
 
         # Park the vehicle in the available slot
-        if slot:
-            slot_id = slot.id
-            db.session.add(models.Parking(slot_id=slot_id, registration_number=registration_number, colour=colour))
+        try:
+            db.session.add(models.Parking(lot_id=lot_id, slot_id=slot_id, registration_number=registration_number, colour=colour, colour_key=models.colour_key(colour),
+                                          entered_at=current_time()))
+            _count_colour(models.colour_key(colour), 1, lot_id)
+            generation = _bump_lot_generation(previous_generation, lot_id, parked_vehicles=models.Lot.parked_vehicles+1)
             db.session.commit()
-        else:
-            slot_id = -1
-    return slot_id
+        except IntegrityError:
+            # The slot was taken behind the index's back (the unique index on the active parkings caught it). Rebuild
+            # the index and try again.
+            db.session.rollback()
+            lot_free_slots.invalidate()
+            continue
+        except:
+            # Give the slot back, it is still free
+            db.session.rollback()
+            lot_free_slots.push(slot_id)
+            raise
+
+        lot_free_slots.generation = generation
+        if _advance_lookup_cache(previous_generation, generation, batched, lot_id):
+            lot_state(lookup_caches, lot_id, LookupCache).park(slot_id, registration_number, models.colour_key(colour))
+        return slot_id
 
-def unpark_vehicle(slot_id):
+    raise RuntimeError('No free slot could be allocated in {} attempts'.format(PARK_ATTEMPTS))
+
+@serialised
+@journaled('leave', timed=True)
+@storage_backend
+def unpark_vehicle(slot_id, lot_id=LOT_ID):
     """
     Unparks the vehicle
 
     Parameters:
     slot_id (int): The slot id that needs to be unparked
+    lot_id (int): The lot
 
     Returns:
-    Boolean: True, if the parking slot was successfully unparked as a outcome of this operation. False, if the spot is inactive
+    Boolean: True, if the parking slot was successfully unparked as a outcome of this operation. False, if the spot is
+    inactive and empty. The vehicles parked in slots deactivated since (see deactivate_slots) can leave, the slots
+    stay inactive.
     """
-    if models.Slot.query.filter(models.Slot.active.is_(True), models.Slot.id==slot_id).first():
-        models.Parking.query.filter_by(slot_id=slot_id).update(dict(active=False))
+    generation = previous_generation = begin_write(lot_id)
+    batched = db.session().transaction.nested
+    parking = db.session.query(models.Parking.id, models.Parking.colour_key).filter(models.Parking.active==True, models.Parking.lot_id==lot_id, models.Parking.slot_id==slot_id).first()
+    if not parking and not models.Slot.query.filter(models.Slot.active.is_(True), models.Slot.lot_id==lot_id, models.Slot.id==slot_id).first():
         db.session.commit()
-        return True
-    else:
         return False
 
-def parking_lot_status():
+    if parking:
+        models.Parking.query.filter_by(id=parking.id).update(dict(active=False, exited_at=current_time()), synchronize_session=False)
+        _count_colour(parking.colour_key, -1, lot_id)
+        generation = _bump_lot_generation(previous_generation, lot_id, parked_vehicles=models.Lot.parked_vehicles-1)
+    db.session.commit()
+    lot_free_slots = lot_state(free_slot_indexes, lot_id, FreeSlotIndex)
+    if lot_free_slots.loaded:
+        lot_free_slots.push(slot_id)
+        lot_free_slots.generation = generation
+    if generation != previous_generation and _advance_lookup_cache(previous_generation, generation, batched, lot_id):
+        lot_state(lookup_caches, lot_id, LookupCache).unpark(slot_id)
+    return True
+
+def compact_parking_history(chunk_size, pause=0):
+    """
+    Moves the closed (inactive) parkings to the parking history, keeping the parking table to the active parkings.
+    Rows are moved in primary key chunks, each in its own short transaction, so that live traffic is not locked out.
+
+    Parameters:
+    chunk_size (int): The number of parking ids per chunk
+    pause (float): Seconds to sleep between the chunks
+
+    Returns:
+    int: number of parkings moved
+    """
+    parking = models.Parking.__table__
+    parking_history = models.ParkingHistory.__table__
+    columns = [parking.c.id, parking.c.lot_id, parking.c.slot_id, parking.c.registration_number, parking.c.colour, parking.c.colour_key,
+               parking.c.entered_at, parking.c.exited_at]
+
+    first_id, last_id = db.session.query(db.func.min(parking.c.id), db.func.max(parking.c.id)).one()
+    db.session.commit()
+
+    moved = 0
+    for chunk_start in xrange(first_id or 0, (last_id or 0)+1, chunk_size):
+        chunk = db.and_(parking.c.id >= chunk_start, parking.c.id < chunk_start+chunk_size, parking.c.active==False)
+        db.session.execute(parking_history.insert().from_select([column.name for column in columns], db.select(columns).where(chunk)))
+        moved += db.session.execute(parking.delete().where(chunk)).rowcount
+        db.session.commit()
+        if pause:
+            time.sleep(pause)
+    return moved
+
+@storage_backend
+def snapshot_parking_lot(snapshot_path, journal_sequence=0, journal_offset=0, lot_id=LOT_ID):
+    """
+    Writes the parking lot to a snapshot file, see app.snapshot.write_snapshot
+
+    Parameters:
+    snapshot_path (string): The path of the snapshot file
+    journal_sequence (int): The sequence of the last journaled command in the parking lot, for a checkpoint
+    journal_offset (int): The journal offset after that command
+    lot_id (int): The lot
+
+    Returns:
+    int: number of parkings written
+    """
+    # A single read transaction, so that the slots and the parkings are those of the generation
+    db.session.commit()
+    try:
+        return write_snapshot(
+            snapshot_path,
+            lot_generation(lot_id),
+            db.session.query(models.Slot.id, models.Slot.active).filter(models.Slot.lot_id==lot_id).yield_per(SLOT_INSERT_CHUNK_SIZE),
+            db.session.query(models.Parking.slot_id, models.Parking.registration_number, models.Parking.colour).filter(models.Parking.active==True, models.Parking.lot_id==lot_id).order_by(models.Parking.slot_id).yield_per(SLOT_INSERT_CHUNK_SIZE),
+            journal_sequence,
+            journal_offset,
+            slot_layout(lot_id).yield_per(SLOT_INSERT_CHUNK_SIZE),
+            db.session.query(models.Entrance.name, models.Entrance.level, models.Entrance.x, models.Entrance.y).filter(models.Entrance.lot_id==lot_id),
+            db.session.query(models.Parking.slot_id, models.Parking.id, models.Parking.entered_at).filter(models.Parking.active==True, models.Parking.lot_id==lot_id).yield_per(SLOT_INSERT_CHUNK_SIZE),
+            max(db.session.query(db.func.max(model.id)).filter(model.lot_id==lot_id).scalar() or 0 for model in [models.Parking, models.ParkingHistory]),
+        )
+    finally:
+        db.session.commit()
+
+# Parking ids deleted by a statement of the restore, below the limit of SQLite on the number of variables
+RESTORE_DELETE_CHUNK_SIZE = 500
+
+def restored_parking_id(parking_times, slot_id):
+    """
+    The id and the entry time of the parking of a slot restored from a snapshot, a new id if the snapshot has none
+
+    Returns:
+    dict: id (if known) and entered_at columns
+    """
+    parking_id, entered_at = parking_times.get(slot_id, (None, None))
+    if parking_id is None:
+        return dict(entered_at=entered_at)
+    return dict(id=parking_id, entered_at=entered_at)
+
+@serialised
+@storage_backend
+def restore_parking_lot(snapshot_path, lot_id=LOT_ID):
+    """
+    Replaces the parking lot with a snapshot of it. The parkings closed before the snapshot are kept, for the billing:
+    those closed after it, i.e. active in the snapshot or parked after it (by parking id, see write_snapshot), are
+    dropped, as the replay of the journal closes them again. The closed parkings of a snapshot without parking ids
+    (written by the memory storage backend or before version 4) are all kept.
+
+    Parameters:
+    snapshot_path (string): The path of the snapshot file
+    lot_id (int): The lot replaced, the other lots are left as they are
+
+    Returns:
+    int: number of parkings restored
+    """
+    snapshot = MappedSnapshot(snapshot_path)
+    try:
+        previous_generation = begin_write(lot_id)
+        batched = db.session().transaction.nested
+        lot_state(free_slot_indexes, lot_id, FreeSlotIndex).invalidate()
+
+        parking_times = dict((slot_id, (parking_id, entered_at)) for slot_id, parking_id, entered_at in snapshot.parking_times())
+        models.Parking.query.filter_by(lot_id=lot_id, active=True).delete()
+        if snapshot.last_parking_id is not None:
+            parking_ids = sorted(parking_id for parking_id, _ in parking_times.values() if parking_id)
+            for model in [models.Parking, models.ParkingHistory]:
+                model.query.filter(model.lot_id==lot_id, model.id > snapshot.last_parking_id).delete(synchronize_session=False)
+                for start in xrange(0, len(parking_ids), RESTORE_DELETE_CHUNK_SIZE):
+                    model.query.filter(model.lot_id==lot_id, model.id.in_(parking_ids[start:start+RESTORE_DELETE_CHUNK_SIZE])).delete(synchronize_session=False)
+        models.Slot.query.filter_by(lot_id=lot_id).delete()
+        models.LotColour.query.filter_by(lot_id=lot_id).delete()
+        models.Entrance.query.filter_by(lot_id=lot_id).delete()
+
+        # Bulk inserts in chunks, like the slots of a new parking lot
+        default_layout = (0, 0, 0, models.SLOT_TYPES[0])
+        layout = dict((row[0], row[1:]) for row in snapshot.layout())
+        slots = ((slot_id, active, layout.get(slot_id, default_layout)) for slot_id, active in snapshot.slots())
+        for insert_model, rows in [(models.Slot, (dict(lot_id=lot_id, id=slot_id, active=active, level=level, x=x, y=y, slot_type=slot_type) for slot_id, active, (level, x, y, slot_type) in slots)),
+                                   (models.Parking, (dict(restored_parking_id(parking_times, slot_id), lot_id=lot_id, slot_id=slot_id, registration_number=registration_number, colour=colour,
+                                                          colour_key=models.colour_key(colour), active=True) for slot_id, registration_number, colour in snapshot.parkings()))]:
+            chunk = list(itertools.islice(rows, SLOT_INSERT_CHUNK_SIZE))
+            while chunk:
+                db.session.bulk_insert_mappings(insert_model, chunk)
+                chunk = list(itertools.islice(rows, SLOT_INSERT_CHUNK_SIZE))
+        db.session.bulk_insert_mappings(models.LotColour, [dict(lot_id=lot_id, colour_key=colour_key, parked_vehicles=parked_vehicles)
+                                                           for colour_key, parked_vehicles in snapshot.colour_counts()])
+        db.session.bulk_insert_mappings(models.Entrance, [dict(lot_id=lot_id, name=name, level=level, x=x, y=y) for name, level, x, y in snapshot.entrances()])
+        generation = _bump_lot_generation(previous_generation, lot_id, active_slots=snapshot.active_slots(), parked_vehicles=snapshot.number_of_parkings)
+        db.session.commit()
+    finally:
+        snapshot.close()
+
+    if _advance_lookup_cache(previous_generation, generation, batched, lot_id):
+        lot_state(lookup_caches, lot_id, LookupCache).clear(generation)
+    return snapshot.number_of_parkings
+
+# Number of rows read at a time by the status query
+STATUS_CHUNK_SIZE = 1000
+
+@storage_backend
+def parking_lot_status(after_slot_id=0, limit=None, lot_id=LOT_ID):
     """
     Status of the parking lot
 
     Parameters:
-    None
+    after_slot_id (int): Only the slots after this one are returned, to page through the status
+    limit (int): The maximum number of slots returned, all of them if None
+    lot_id (int): The lot
 
     Returns:
-    list: A list of dictionaries of parking slots data
+    generator: Dictionaries of parking slots data, ordered by slot number
     """
 
-    parking_slots = []
-    for parking_slot in models.Parking.query.order_by(models.Parking.slot_id).filter(models.Parking.active.is_(True)).all():
-        parking_slots.append({
-            "slot_id": parking_slot.slot_id,
-            "registration_number": parking_slot.registration_number,
-            "colour": parking_slot.colour,
-        })
-    return parking_slots
+    cache = lot_state(lookup_caches, lot_id, LookupCache)
+    generation = cached_lot_generation(lot_id)
+    if generation is not None:
+        cache.validate(generation)
+        status = cache.status()
+        if status is not None:
+            start = bisect.bisect_left(status, (after_slot_id+1,))
+            for slot_id, registration_number, colour in status[start:start+limit if limit is not None else None]:
+                yield {
+                    "slot_id": slot_id,
+                    "registration_number": registration_number,
+                    "colour": colour,
+                }
+            return
+
+    # A full status read is kept as the snapshot of the cache, unless the parking lot is too big for it
+    status = [] if generation is not None and after_slot_id == 0 and limit is None else None
+
+    # Only the needed columns are read, in chunks, so that memory stays flat however big the parking lot is. Pages
+    # start with a range scan of the slot index, however deep they are.
+    query = db.session.query(models.Parking.slot_id, models.Parking.registration_number, models.Parking.colour).order_by(models.Parking.slot_id).filter(models.Parking.active==True, models.Parking.lot_id==lot_id, models.Parking.slot_id > after_slot_id)
+    if limit is not None:
+        query = query.limit(limit)
+    for slot_id, registration_number, colour in query.yield_per(STATUS_CHUNK_SIZE):
+        if status is not None:
+            status.append((slot_id, registration_number, colour))
+            if len(status) > cache.max_status_rows:
+                status = None
+        yield {
+            "slot_id": slot_id,
+            "registration_number": registration_number,
+            "colour": colour,
+        }
 
-def info_for_vehicles_with_colour(colour, info):
+    if status is not None:
+        cache.store_status(generation, status)
+
+def parking_lot_status_lines(parking_slots_status=None):
+    """
+    Lines of the status message of the parking lot
+
+    Parameters:
+    parking_slots_status (iterable): The status of the parking lot, read if None
+
+    Returns:
+    generator: The header and a line per parking slot or the empty parking lot message
+    """
+    parking_slots_status = iter(parking_slots_status if parking_slots_status is not None else parking_lot_status())
+    parking_slot_status = next(parking_slots_status, None)
+    if parking_slot_status is None:
+        yield 'Parking Lot is empty'
+        return
+
+    yield 'Slot No.    Registration No    Colour'
+    while parking_slot_status is not None:
+        yield '{}           {}      {}'.format(parking_slot_status['slot_id'], parking_slot_status['registration_number'], parking_slot_status['colour'])
+        parking_slot_status = next(parking_slots_status, None)
+
+@storage_backend
+def info_for_vehicles_with_colour(colour, info, lot_id=LOT_ID):
     """
     Status of the parking lot
 
     Parameters:
     colour (string): The colour of the vehicle
+    lot_id (int): The lot
 
     Returns:
     list: A list of registration numbers
     """
 
-    return [
-        getattr(parking_slot, info) for parking_slot in models.Parking.query.order_by(models.Parking.slot_id).filter(models.Parking.active.is_(True), models.Parking.colour.ilike(colour)).all()
-    ]
+    colour_key = models.colour_key(colour)
+    cache = lot_state(lookup_caches, lot_id, LookupCache)
+    generation = cached_lot_generation(lot_id)
+    if generation is not None:
+        cache.validate(generation)
+        vehicles = cache.vehicles_with_colour(colour_key)
+        if vehicles is not None:
+            return vehicles[0] if info == 'slot_id' else vehicles[1]
+
+    # Both the slot numbers and the registration numbers are read, for the cache to answer both lookups
+    slot_ids, registration_numbers = [], []
+    for slot_id, registration_number in db.session.query(models.Parking.slot_id, models.Parking.registration_number).order_by(models.Parking.slot_id).filter(models.Parking.active==True, models.Parking.lot_id==lot_id, models.Parking.colour_key==colour_key):
+        slot_ids.append(slot_id)
+        registration_numbers.append(registration_number)
+    if generation is not None:
+        cache.store_vehicles_with_colour(generation, colour_key, slot_ids, registration_numbers)
 
-def slot_number_for_registration_number(registration_number):
+    return slot_ids if info == 'slot_id' else registration_numbers
+
+@storage_backend
+def slot_number_for_registration_number(registration_number, lot_id=LOT_ID):
     """
     Status of the parking lot
 
     Parameters:
     registration_number (string): The registration number of the vehicle
+    lot_id (int): The lot
 
     Returns:
     int: Slot number of the parked vehicle or -1 (Not found)
     """
 
-    parking_slot = models.Parking.query.order_by(models.Parking.slot_id).filter(models.Parking.active.is_(True), models.Parking.registration_number==registration_number).first()
+    cache = lot_state(lookup_caches, lot_id, LookupCache)
+    generation = cached_lot_generation(lot_id)
+    if generation is not None:
+        cache.validate(generation)
+        slot_id = cache.slot_for_registration_number(registration_number)
+        if slot_id is not None:
+            return slot_id
+
+    parking_slot = models.Parking.query.order_by(models.Parking.slot_id).filter(models.Parking.active==True, models.Parking.lot_id==lot_id, models.Parking.registration_number==registration_number).first()
+    slot_id = parking_slot.slot_id if parking_slot else -1
+    if generation is not None:
+        cache.store_slot_for_registration_number(generation, registration_number, slot_id)
+
+    return slot_id
+
+def prefix_range(column, prefix):
+    """
+    Conditions of the values of the column starting with the prefix, as a range an index can be scanned for (unlike
+    LIKE, whose optimisation SQLite only applies for case insensitive indexes)
+
+    Parameters:
+    column (Column): The column
+    prefix (string): The prefix, not empty
+
+    Returns:
+    list: The conditions
+    """
+    return [column >= prefix, column < prefix[:-1] + unichr(ord(prefix[-1])+1)]
+
+@storage_backend
+def search_registration_numbers(pattern, lot_id=LOT_ID):
+    """
+    Parked vehicles whose registration number matches a pattern, e.g. `KA-01-HH-*` or `*1234`. The literal prefix of
+    the pattern is searched with a range scan of the registration number index, otherwise its literal suffix with
+    one of the reversed registration number index, and the candidates are matched with fnmatch.
+
+    Parameters:
+    pattern (string): The pattern, with the wildcards of fnmatch (`*`, `?` and character sets)
+    lot_id (int): The lot
+
+    Returns:
+    list: Dictionaries of parking slots data, ordered by slot number
+    """
+    prefix, suffix = models.registration_affixes(pattern)
+    query = db.session.query(models.Parking.slot_id, models.Parking.registration_number, models.Parking.colour).filter(models.Parking.active==True, models.Parking.lot_id==lot_id)
+    if prefix and len(prefix) >= len(suffix):
+        query = query.filter(*prefix_range(models.Parking.registration_number, prefix))
+    elif suffix:
+        query = query.filter(*prefix_range(models.Parking.reversed_registration_number, models.reversed_registration_number(suffix)))
+    if '[' not in pattern:
+        # SQLite's GLOB matches like fnmatch, but for the character sets. The rows are filtered in the database, instead
+        # of reading them all for a pattern without affixes.
+        query = query.filter(models.Parking.registration_number.op('GLOB')(pattern))
+
+    return [{
+        "slot_id": slot_id,
+        "registration_number": registration_number,
+        "colour": colour,
+    } for slot_id, registration_number, colour in sorted(query) if fnmatch.fnmatchcase(registration_number, pattern)]
+
+@storage_backend
+def occupancy(lot_id=LOT_ID):
+    """
+    Occupancy of the parking lot, read from the counters of the lot instead of counting the parkings
+
+    Parameters:
+    lot_id (int): The lot
+
+    Returns:
+    tuple: The number of parked vehicles and the number of active slots
+    """
+    counters = db.session.query(models.Lot.parked_vehicles, models.Lot.active_slots).filter_by(id=lot_id).first()
+    return tuple(counters) if counters else (0, 0)
+
+@storage_backend
+def count_vehicles_with_colour(colour, lot_id=LOT_ID):
+    """
+    Number of parked vehicles of a colour, read from the colour counters of the lot
+
+    Parameters:
+    colour (string): The colour of the vehicles
+    lot_id (int): The lot
+
+    Returns:
+    int: The number of vehicles
+    """
+    return db.session.query(models.LotColour.parked_vehicles).filter_by(lot_id=lot_id, colour_key=models.colour_key(colour)).scalar() or 0
+
+@storage_backend
+def check_consistency(lot_id=LOT_ID):
+    """
+    Recounts the parking lot and checks its counters (see occupancy and count_vehicles_with_colour) against the counts
+
+    Parameters:
+    lot_id (int): The lot
+
+    Returns:
+    list: (counter, recorded, counted) triples of the counters not matching the counts, empty if they all match
+    """
+    # A single read transaction, so that the counters and the counts are those of the same generation
+    db.session.commit()
+    try:
+        parkings = db.session.query(models.Parking).filter(models.Parking.active==True, models.Parking.lot_id==lot_id)
+        counts = [parkings.count(), models.Slot.query.filter(models.Slot.lot_id==lot_id, models.Slot.active.is_(True)).count()]
+        mismatches = [(counter, recorded, counted) for counter, recorded, counted in zip(['parked_vehicles', 'active_slots'], occupancy.sql(lot_id), counts) if recorded != counted]
+
+        recorded_colours = dict(db.session.query(models.LotColour.colour_key, models.LotColour.parked_vehicles).filter_by(lot_id=lot_id))
+        counted_colours = dict(parkings.with_entities(models.Parking.colour_key, db.func.count()).group_by(models.Parking.colour_key))
+    finally:
+        db.session.commit()
+    return mismatches + colour_mismatches(recorded_colours, counted_colours)
+
+def colour_mismatches(recorded_colours, counted_colours):
+    """
+    Parameters:
+    recorded_colours (dict): The colour counters, by colour key
+    counted_colours (dict): The counted vehicles, by colour key
+
+    Returns:
+    list: (counter, recorded, counted) triples of the colours whose counter does not match the count, by colour key
+    """
+    return [('colour {}'.format(key), recorded_colours.get(key, 0), counted_colours.get(key, 0))
+            for key in sorted(set(recorded_colours) | set(counted_colours))
+            if recorded_colours.get(key, 0) != counted_colours.get(key, 0)]
+
+def format_park(slot_id, registration_number, colour, entrance=None, slot_type=models.SLOT_TYPES[0]):
+    if slot_id == -4:
+        return 'Sorry, {} is not a slot type ({})'.format(slot_type, ', '.join(models.SLOT_TYPES))
+    elif slot_id == -3:
+        return 'Sorry, there is no entrance {}'.format(entrance)
+    elif slot_id == -2:
+        return 'This is a repeated parking. Car already in parking.'
+    elif slot_id == -1:
+        return 'Sorry, parking lot is full'
+    return 'Allocated slot number: {}'.format(slot_id)
+
+def format_deactivated(result, slots):
+    deactivated, parkings = result
+    if not parkings:
+        return 'Deactivated {} slots'.format(deactivated)
+    return '\n'.join(['Deactivated {} slots, vehicles are still parked in them:'.format(deactivated)] + list(parking_lot_status_lines(parkings)))
+
+def slot_range_argument(slots):
+    # Ranges of slots are checked when the command is parsed, and given to the handler (and journaled) as they are
+    models.slot_range(slots)
+    return slots
+
+def number_of_slots_argument(number_of_slots):
+    # Numbers of slots are checked when the command is parsed, those below 1 are refused like malformed ones
+    return models.checked_number_of_slots(int(number_of_slots))
+
+def format_list(values):
+    return ', '.join(map(str, values)) if values else 'Not found'
+
+def format_mismatches(mismatches):
+    if not mismatches:
+        return 'Counters are consistent'
+    return '\n'.join('{}: recorded {}, counted {}'.format(counter, recorded, counted) for counter, recorded, counted in mismatches)
 
-    return parking_slot.slot_id if parking_slot else -1
+# The commands of the game. Other modules can register theirs with app.commands.register_command.
+register_command('create_parking_lot', create_parking_lot, [('number_of_slots', number_of_slots_argument)],
+                 lambda number_of_slots, _: 'Created a parking lot with {} slots'.format(number_of_slots), writes=True, lot_scoped=True)
+register_command('resize_parking_lot', resize_parking_lot, [('number_of_slots', number_of_slots_argument)],
+                 lambda result, number_of_slots: 'Sorry, slots beyond {} are occupied'.format(number_of_slots) if result == -1 else 'Resized the parking lot to {} slots'.format(result), writes=True, lot_scoped=True)
+register_command('park', park_vehicle, [('registration_number', str), ('colour', str)], format_park, writes=True, lot_scoped=True,
+                 optional_arguments=[('entrance', str), ('slot_type', str)])
+register_command('layout_slots', layout_slots, [('first_slot_number', int), ('last_slot_number', int), ('level', int), ('x', int), ('y', int), ('slot_type', str)],
+                 lambda laid_out, first_slot_id, last_slot_id, level, x, y, slot_type: 'Sorry, {} is not a slot type ({})'.format(slot_type, ', '.join(models.SLOT_TYPES)) if laid_out == -1 else 'Laid out {} slots'.format(laid_out),
+                 writes=True, lot_scoped=True)
+register_command('add_entrance', add_entrance, [('name', str), ('level', int), ('x', int), ('y', int)],
+                 lambda name, *_: 'Added entrance {}'.format(name), writes=True, lot_scoped=True)
+register_command('deactivate_slots', deactivate_slots, [('slot_range', slot_range_argument)], format_deactivated, writes=True, lot_scoped=True)
+register_command('activate_slots', activate_slots, [('slot_range', slot_range_argument)],
+                 lambda activated, _: 'Activated {} slots'.format(activated), writes=True, lot_scoped=True)
+register_command('leave', unpark_vehicle, [('slot_number', int)],
+                 lambda freed, slot_id: 'Slot number {} is free'.format(slot_id) if freed else 'The parking slot is inactive', writes=True, lot_scoped=True)
+register_command('status', parking_lot_status, formatter=parking_lot_status_lines, streamed=True, lot_scoped=True)
+register_command('registration_numbers_for_cars_with_colour', functools.partial(info_for_vehicles_with_colour, info='registration_number'), [('colour', str)],
+                 lambda registration_numbers, _: format_list(registration_numbers), lot_scoped=True)
+register_command('slot_numbers_for_cars_with_colour', functools.partial(info_for_vehicles_with_colour, info='slot_id'), [('colour', str)],
+                 lambda slot_numbers, _: format_list(slot_numbers), lot_scoped=True)
+register_command('slot_number_for_registration_number', slot_number_for_registration_number, [('registration_number', str)],
+                 lambda slot_id, _: 'Not found' if slot_id == -1 else '{}'.format(slot_id), lot_scoped=True)
+register_command('search_registration', search_registration_numbers, [('pattern', str)],
+                 lambda parkings, _: '\n'.join(parking_lot_status_lines(parkings)) if parkings else 'Not found', lot_scoped=True)
+register_command('occupancy', occupancy, formatter=lambda counters: 'Occupied {} of {} slots'.format(*counters), lot_scoped=True)
+register_command('count_cars_with_colour', count_vehicles_with_colour, [('colour', str)],
+                 lambda count, _: '{}'.format(count), lot_scoped=True)
+register_command('check_consistency', check_consistency, formatter=format_mismatches, lot_scoped=True)
+register_command('stats', lambda: instrumentation.enabled,
+                 formatter=lambda enabled: '\n'.join(instrumentation.report_lines()) if enabled else 'Instrumentation is disabled')
+register_command('cache_stats', lambda lot_id=LOT_ID: lot_state(lookup_caches, lot_id, LookupCache),
+                 formatter=lambda cache: '\n'.join(cache.report_lines()), lot_scoped=True)
 
+@instrumentation.command
 def process_command_input(command_input):
     """
     Processes the input command from shell or file
@@ -125,44 +1469,139 @@ def process_command_input(command_input):
     command_input (string): The command given in the parking lot game
 
     Returns:
-    0 or None
+    0 (exit) or the message of the command
     """
-
     if command_input in ['exit', '']:
         return 0
+
+    command, message = run_command_input(command_input)
+    if command is not None and command.streamed:
+        return '\n'.join(message)
+    return message
+
+def is_streamed_command(command_input):
+    """
+    Whether the output of the command is streamed line by line, instead of being returned as a single message
+
+    Parameters:
+    command_input (string): The command given in the parking lot game
+
+    Returns:
+    Boolean: True, for the status command
+    """
+    command = find_command(command_input)
+    return command is not None and command.streamed
+
+@instrumentation.command
+def process_command_output(command_input, output):
+    """
+    Processes the input command, in its own transaction, and writes its message to the output. The status is written
+    row by row, as it is read from the parking lot.
+
+    Parameters:
+    command_input (string): The command given in the parking lot game
+    output (file): The stream the message is written to
+
+    Returns:
+    0 or None
+    """
+    exit_status = None
+    if command_input in ['exit', '']:
+        exit_status = 0
     else:
-        # Process the comman line input
-        command_inputs = command_input.split()
-
-        if command_inputs[0] == 'create_parking_lot': # create_parking_lot
-            message = 'Created a parking lot with {} slots'.format(create_parking_lot(int(command_inputs[1])))
-        elif command_inputs[0] == 'park':             # Park car
-            slot_id = park_vehicle(command_inputs[1], command_inputs[2])
-            if slot_id == -2:
-                message = 'This is a repeated parking. Car already in parking.'
-            elif slot_id == -1:
-                message =  'Sorry, parking lot is full'
-            else:
-                message =  'Allocated slot number: {}'.format(slot_id)
-        elif command_inputs[0] == 'leave':           # Unpark car
-            message = 'Slot number {} is free'.format(int(command_inputs[1])) if unpark_vehicle(int(command_inputs[1])) else 'The parking slot is inactive'
-        elif command_inputs[0] == 'status':          # Parking lot status
-            parking_slots_status = parking_lot_status()
-            if parking_slots_status:
-                message = 'Slot No.    Registration No    Colour'
-                for parking_slot_status in parking_slots_status:
-                    message =  '{}\n{}           {}      {}'.format(message, parking_slot_status['slot_id'], parking_slot_status['registration_number'], parking_slot_status['colour'])
-            else:
-                message = 'Parking Lot is empty'
-        elif command_inputs[0] == 'registration_numbers_for_cars_with_colour': # registration_numbers_for_cars_with_colour
-            registration_numbers = info_for_vehicles_with_colour(command_inputs[1], 'registration_number')
-            message = ', '.join(registration_numbers) if registration_numbers else 'Not found'
-        elif command_inputs[0] == 'slot_numbers_for_cars_with_colour':         # slot_numbers_for_cars_with_colour
-            slot_numbers = info_for_vehicles_with_colour(command_inputs[1], 'slot_id')
-            message = ', '.join(map(str, slot_numbers)) if slot_numbers else 'Not found'
-        elif command_inputs[0] == 'slot_number_for_registration_number':       # slot_number_for_registration_number
-            slot_id = slot_number_for_registration_number(command_inputs[1])
-            message = 'Not found' if slot_id == -1 else '{}'.format(slot_id)
+        command, message = run_command_input(command_input)
+        if command is not None and command.streamed:
+            for line in message:
+                output.write('{}\n'.format(line))
         else:
-            message = 'Invalid Command'
-        return message
+            output.write('{}\n'.format(message))
+
+    # End the read transaction of the command, so that it does not hold back writers in other processes
+    db.session.commit()
+
+    return exit_status
+
+def process_command_batch(command_inputs, batch_size, output):
+    """
+    Processes the input commands, running batch_size commands in a single transaction. Every command runs in its own
+    savepoint, so that a failing command is rolled back alone. The messages are written to the output once the batch
+    is committed.
+
+    Parameters:
+    command_inputs (iterable): The commands given in the parking lot game
+    batch_size (int): The number of commands per transaction
+    output (file): The stream the messages are written to
+
+    Returns:
+    None
+    """
+    messages = []
+    in_batch = False
+    try:
+        for command_input in command_inputs:
+            command_input = command_input.rstrip('\n').rstrip()
+
+            # Streamed commands end the batch, so that their output is written right after the previous messages
+            if is_streamed_command(command_input):
+                db.session.commit()
+                in_batch = False
+                output.write(''.join(messages))
+                messages = []
+                process_command_output(command_input, output)
+                continue
+
+            # The batch transaction takes the write lock up front
+            if not in_batch:
+                begin_write()
+                in_batch = True
+
+            savepoint = db.session.begin_nested()
+            try:
+                exit_status_or_message = process_command_input(command_input)
+                if savepoint.is_active:
+                    savepoint.commit()
+            except:
+                if savepoint.is_active:
+                    savepoint.rollback()
+                invalidate_free_slots()
+                raise
+
+            if exit_status_or_message == 0: # Exit status
+                break
+            messages.append('{}\n'.format(exit_status_or_message))
+
+            if len(messages) >= batch_size:
+                db.session.commit()
+                in_batch = False
+                output.write(''.join(messages))
+                messages = []
+    finally:
+        # Commit (and print) whatever ran successfully, like the per-line mode does
+        try:
+            db.session.commit()
+        except:
+            db.session.rollback()
+            invalidate_free_slots()
+            raise
+        output.write(''.join(messages))
+        output.flush()
+
+def play_file(input_file, output, batch_size=1):
+    """
+    Plays the game from an input file, up to its first exit command (or empty line)
+
+    Parameters:
+    input_file (iterable): The lines of the file, the commands given in the parking lot game
+    output (file): The stream the messages are written to
+    batch_size (int): The number of commands per transaction, every command in its own transaction by default
+
+    Returns:
+    None
+    """
+    if batch_size > 1:
+        process_command_batch(input_file, batch_size, output)
+        return
+    for command_input in input_file:
+        command_input = command_input.rstrip('\n').rstrip()
+        if process_command_output(command_input, output) == 0: # Exit status
+            return
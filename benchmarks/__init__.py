@@ -0,0 +1,7 @@
+"""
+Benchmarks of the parking lot game
+
+    * workload: seeded generator of command files
+    * runner: times every command type of a workload and writes the results as JSON
+    * compare: compares two result files, to catch regressions between commits
+"""
@@ -0,0 +1,95 @@
+import argparse
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import timeit
+
+from app import billing, db, models, parking_lot, utils
+from benchmarks.runner import reset_parking_lot
+from benchmarks.restart import COLOURS, SETUP_CHUNK_SIZE
+
+# Start of the year of history, 2026-01-01 00:00 UTC
+HISTORY_START = 1767225600
+
+
+def set_up(database_uri, number_of_slots, number_of_parkings, seed):
+    """
+    Creates the parking lot with a year of closed parkings in the parking history, with bulk inserts
+
+    Parameters:
+    database_uri (string): The SQL Alchemy database URI
+    number_of_slots (int): The parking lot size
+    number_of_parkings (int): The number of closed parkings
+    seed (int): The seed of the entry times and the dwell times
+    """
+    reset_parking_lot(database_uri, 'sql')
+    utils.create_parking_lot(number_of_slots)
+
+    random_generator = random.Random(seed)
+    chunk = []
+    for index in xrange(number_of_parkings):
+        entered_at = HISTORY_START + random_generator.randrange(365*billing.SECONDS_PER_DAY)
+        chunk.append(dict(id=index+1, slot_id=index % number_of_slots + 1, registration_number='KA-{:08d}'.format(index), colour=COLOURS[index % len(COLOURS)],
+                          colour_key=models.colour_key(COLOURS[index % len(COLOURS)]), entered_at=entered_at,
+                          exited_at=entered_at + int(random_generator.expovariate(1.0/(3*billing.SECONDS_PER_HOUR)))))
+        if len(chunk) == SETUP_CHUNK_SIZE:
+            db.session.execute(models.ParkingHistory.__table__.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(models.ParkingHistory.__table__.insert(), chunk)
+    db.session.commit()
+
+
+def orm_report(tariff, limit):
+    """
+    The report of the first closed parkings, computed row by row from ORM objects, for comparison
+
+    Returns:
+    int: The revenue
+    """
+    revenue = 0
+    for parking in models.ParkingHistory.query.order_by(models.ParkingHistory.id).limit(limit).yield_per(10000):
+        dwell_time = parking.exited_at - parking.entered_at
+        if dwell_time > tariff.free_minutes*60:
+            days, rest = divmod(dwell_time, billing.SECONDS_PER_DAY)
+            revenue += days*tariff.daily_maximum + min(-(-rest//billing.SECONDS_PER_HOUR)*tariff.hourly_rate, tariff.daily_maximum)
+    db.session.commit()
+    return revenue
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the billing report of a year of closed parkings, against a row by row report')
+    parser.add_argument('--slots', type=int, default=1000, help='Parking lot size')
+    parser.add_argument('--parkings', type=int, default=2000000, help='Number of closed parkings')
+    parser.add_argument('--orm-parkings', type=int, default=200000, help='Number of closed parkings of the row by row report')
+    parser.add_argument('--chunk-size', type=int, default=billing.REPORT_CHUNK_SIZE, help='Number of parking ids read at a time')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the parking times')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='parking_lot_billing')
+    try:
+        start = timeit.default_timer()
+        set_up('sqlite:///' + os.path.join(directory, 'billing.db'), args.slots, args.parkings, args.seed)
+        sys.stdout.write('{} closed parkings (set up in {:.1f} s)\n'.format(args.parkings, timeit.default_timer()-start))
+        tariff = billing.Tariff.from_config(parking_lot.config)
+
+        start = timeit.default_timer()
+        report = billing.billing_report(tariff, chunk_size=args.chunk_size)
+        elapsed = timeit.default_timer()-start
+        sys.stdout.write('{:>12}{:>12}{:>14}{:>16}\n'.format('report', 'seconds', 'parkings/sec', 'max RSS MiB'))
+        sys.stdout.write('{:>12}{:>12.2f}{:>14.0f}{:>16.1f}\n'.format('vectorised', elapsed, report.parkings/elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0))
+
+        start = timeit.default_timer()
+        orm_report(tariff, args.orm_parkings)
+        elapsed = timeit.default_timer()-start
+        sys.stdout.write('{:>12}{:>12.2f}{:>14.0f}{:>16}\n'.format('row by row', elapsed, min(args.orm_parkings, args.parkings)/elapsed, ''))
+    finally:
+        db.session.remove()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
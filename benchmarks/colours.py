@@ -0,0 +1,72 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+from app import db, models, utils
+from benchmarks.restart import COLOURS
+from benchmarks.search import set_up
+
+
+def colour_lookup(colour):
+    # The lookup of the colour commands, without the lookup cache: an ordered range scan of the colour_key index
+    return db.session.query(models.Parking.slot_id, models.Parking.registration_number).filter(
+        models.Parking.active==True, models.Parking.lot_id==utils.LOT_ID, models.Parking.colour_key==models.colour_key(colour)).order_by(models.Parking.slot_id).all()
+
+
+def ilike_lookup(colour):
+    # ILIKE over the colours of the parked vehicles, found with the active prefix of the colour_key index
+    return db.session.query(models.Parking.slot_id, models.Parking.registration_number).filter(
+        models.Parking.active==True, models.Parking.lot_id==utils.LOT_ID, models.Parking.colour.ilike(colour)).order_by(models.Parking.slot_id).all()
+
+
+def ilike_scan(colour):
+    # The lookup before the colour_key column: ILIKE without an index (a unary + keeps SQLite off the indexes of active
+    # and lot_id), every parking of the table is read
+    return db.session.query(models.Parking.slot_id, models.Parking.registration_number).filter(
+        db.text('+parking.active = 1 AND +parking.lot_id = :lot_id').bindparams(lot_id=utils.LOT_ID), models.Parking.colour.ilike(colour)).order_by(models.Parking.slot_id).all()
+
+
+def time_lookups(lookup, colours):
+    """
+    Returns:
+    tuple: The mean number of vehicles found and the mean milliseconds of a lookup
+    """
+    vehicles = 0
+    start = timeit.default_timer()
+    for colour in colours:
+        vehicles += len(lookup(colour))
+    return float(vehicles)/len(colours), (timeit.default_timer()-start)*1e3/len(colours)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the colour lookups with closed parkings left in the parking table, against an ILIKE scan')
+    parser.add_argument('--parkings', type=int, default=20000, help='Number of parked vehicles')
+    parser.add_argument('--history', type=int, default=2000000, help='Number of closed parkings')
+    parser.add_argument('--lookups', type=int, default=20, help='Number of timed lookups per kind')
+    parser.add_argument('--seed', type=int, default=0, help='Colour seed')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='parking_lot_colours')
+    try:
+        start = timeit.default_timer()
+        set_up('sqlite:///' + os.path.join(directory, 'colours.db'), args.parkings, args.history)
+        sys.stdout.write('{} parked vehicles, {} closed parkings (set up in {:.1f} s)\n'.format(args.parkings, args.history, timeit.default_timer()-start))
+
+        # Colours as they are given, in any case
+        random_generator = random.Random(args.seed)
+        colours = [random_generator.choice([str.lower, str.upper, str.title])(random_generator.choice(COLOURS)) for _ in xrange(args.lookups)]
+        sys.stdout.write('{:>12}{:>10}{:>10}\n'.format('lookup', 'vehicles', 'ms'))
+        for name, lookup in [('colour_key', colour_lookup), ('ILIKE', ilike_lookup), ('ILIKE scan', ilike_scan)]:
+            vehicles, milliseconds = time_lookups(lookup, colours)
+            sys.stdout.write('{:>12}{:>10.1f}{:>10.2f}\n'.format(name, vehicles, milliseconds))
+    finally:
+        db.session.remove()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
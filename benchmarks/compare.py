@@ -0,0 +1,51 @@
+import argparse
+import json
+import sys
+
+
+def compare(base, new, metric, threshold):
+    """
+    Compares the command latencies of two benchmark results
+
+    Parameters:
+    base (dict): The results of the base revision
+    new (dict): The results of the new revision
+    metric (string): The compared summary metric, e.g. p95_us
+    threshold (float): The allowed relative slow down, e.g. 0.1 for 10%
+
+    Returns:
+    list: (slots, command, base value, new value, ratio, regressed) tuples
+    """
+    base_runs = dict((run['slots'], run) for run in base['runs'])
+    comparison = []
+    for run in new['runs']:
+        if run['slots'] not in base_runs:
+            continue
+        base_commands = base_runs[run['slots']]['commands']
+        for command, summary in sorted(run['commands'].items()):
+            if command not in base_commands:
+                continue
+            base_value, new_value = base_commands[command][metric], summary[metric]
+            ratio = new_value/base_value if base_value else float('inf')
+            comparison.append((run['slots'], command, base_value, new_value, ratio, ratio > 1+threshold))
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files, exits with 1 on a regression')
+    parser.add_argument('base', help='Results of the base revision')
+    parser.add_argument('new', help='Results of the new revision')
+    parser.add_argument('--metric', default='p95_us', help='Latency metric to compare (default: p95_us)')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Allowed relative slow down (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    with open(args.base) as base_file, open(args.new) as new_file:
+        comparison = compare(json.load(base_file), json.load(new_file), args.metric, args.threshold)
+
+    for slots, command, base_value, new_value, ratio, regressed in comparison:
+        print '{:>8} {:<45}{:>12.1f}{:>12.1f}{:>8.2f}x{}'.format(slots, command, base_value, new_value, ratio, '  REGRESSION' if regressed else '')
+    sys.exit(1 if any(regressed for _, _, _, _, _, regressed in comparison) else 0)
+
+
+if __name__ == '__main__':
+    main()
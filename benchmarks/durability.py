@@ -0,0 +1,72 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from app import db, parking_lot, utils
+from benchmarks.runner import reset_parking_lot
+from benchmarks.workload import DEFAULT_MIX, WorkloadGenerator, parse_mix
+
+# The SQLite defaults the levels are compared to: rollback journal, synced at every commit, no other pragma
+DEFAULT_LEVEL = 'default'
+
+
+def time_commands(command_inputs, batch_size):
+    """
+    Returns:
+    float: commands/sec, every command in its own transaction or batch_size commands per transaction
+    """
+    with open(os.devnull, 'w') as null_output:
+        start = timeit.default_timer()
+        if batch_size > 1:
+            utils.process_command_batch(command_inputs, batch_size, null_output)
+        else:
+            for command_input in command_inputs:
+                utils.process_command_output(command_input, null_output)
+        return len(command_inputs)/(timeit.default_timer()-start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the commands by SQLite durability level (SQLITE_DURABILITY)')
+    parser.add_argument('--levels', default=','.join([DEFAULT_LEVEL, 'strict', 'batched', 'volatile']), help='Comma separated durability levels')
+    parser.add_argument('--slots', type=int, default=1000, help='Parking lot size')
+    parser.add_argument('--commands', type=int, default=5000, help='Number of timed commands per level')
+    parser.add_argument('--batch-size', type=int, default=100, help='Number of commands per transaction of the batched run')
+    parser.add_argument('--mix', help='Command mix, e.g. park=40,leave=30,status=1')
+    parser.add_argument('--directory', help='Directory of the databases, on the disk to measure (a temporary directory by default)')
+    parser.add_argument('--seed', type=int, default=0, help='Workload seed')
+    args = parser.parse_args(argv)
+
+    generator = WorkloadGenerator(args.slots, parse_mix(args.mix) if args.mix else DEFAULT_MIX, args.seed)
+    set_up = list(generator.setup(0.5))
+    command_inputs = list(generator.generate(args.commands))
+
+    config = parking_lot.config
+    durability, pragmas = config['SQLITE_DURABILITY'], config['SQLITE_PRAGMAS']
+    config['SQLITE_DURABILITY_LEVELS'][DEFAULT_LEVEL] = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+    directory = tempfile.mkdtemp(prefix='parking_lot_durability', dir=args.directory)
+    try:
+        sys.stdout.write('{} slots, {} commands\n'.format(args.slots, len(command_inputs)))
+        sys.stdout.write('{:>10}{:>24}{:>24}\n'.format('level', 'commands/sec', 'commands/sec batched'))
+        for level in args.levels.split(','):
+            config['SQLITE_DURABILITY'] = level
+            config['SQLITE_PRAGMAS'] = {} if level == DEFAULT_LEVEL else pragmas
+            throughputs = []
+            for batch_size in [1, args.batch_size]:
+                reset_parking_lot('sqlite:///' + os.path.join(directory, '{}_{}.db'.format(level, batch_size)), 'sql')
+                db.engine.dispose()  # The connections take the pragmas of the level
+                time_commands(set_up, args.batch_size)
+                throughputs.append(time_commands(command_inputs, batch_size))
+            sys.stdout.write('{:>10}{:>24.0f}{:>24.0f}\n'.format(level, *throughputs))
+    finally:
+        db.session.remove()
+        db.engine.dispose()
+        config['SQLITE_DURABILITY'], config['SQLITE_PRAGMAS'] = durability, pragmas
+        del config['SQLITE_DURABILITY_LEVELS'][DEFAULT_LEVEL]
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import asynchat
+import asyncore
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import timeit
+
+from app import db
+from app.gate_server import GateServer
+from benchmarks.runner import reset_parking_lot, summarise
+from benchmarks.workload import DEFAULT_MIX, WorkloadGenerator, parse_mix
+
+
+def serve(database_uri, ready):
+    """
+    Runs the gate server on a fresh database, in its own process
+
+    Parameters:
+    database_uri (string): The SQL Alchemy database URI
+    ready (Connection): Where the address of the server is sent, once it listens
+    """
+    reset_parking_lot(database_uri, 'sql')
+    db.session.remove()
+    server = GateServer('127.0.0.1', 0)
+    ready.send(server.address)
+    server.serve_forever()
+
+
+class Gate(asynchat.async_chat):
+    """
+    Simulated gate, sending its commands one at a time and timing every reply
+    """
+
+    def __init__(self, address, command_inputs, latencies, socket_map):
+        asynchat.async_chat.__init__(self, map=socket_map)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect(address)
+        self.set_terminator('\n\n')
+        self.command_inputs = iter(command_inputs)
+        self.latencies = latencies
+        self.send_next()
+
+    def send_next(self):
+        self.command_input = next(self.command_inputs, None)
+        if self.command_input is None:
+            self.push('exit\n')
+            self.close_when_done()
+            return
+        self.start = timeit.default_timer()
+        self.push('{}\n'.format(self.command_input))
+
+    def collect_incoming_data(self, data):
+        pass
+
+    def found_terminator(self):
+        self.latencies.setdefault(self.command_input.split()[0], []).append(timeit.default_timer()-self.start)
+        self.send_next()
+
+
+def run_gates(address, number_of_slots, number_of_commands, number_of_connections, mix, seed, occupancy):
+    """
+    Creates the parking lot, then runs the commands of a seeded workload from concurrent gate connections
+
+    Parameters:
+    address (tuple): The address of the gate server
+    number_of_slots (int): The number of parking slots
+    number_of_commands (int): The number of timed commands
+    number_of_connections (int): The number of gate connections
+    mix (dict): Weight by command
+    seed (int): The workload seed
+    occupancy (float): The share of slots occupied before the timed commands
+
+    Returns:
+    dict: The results
+    """
+    generator = WorkloadGenerator(number_of_slots, mix, seed)
+    socket_map = {}
+    Gate(address, list(generator.setup(occupancy)), {}, socket_map)
+    asyncore.loop(use_poll=True, map=socket_map)
+    commands = list(generator.generate(number_of_commands))
+
+    # Every gate sends an interleaved share of the workload
+    latencies = {}
+    for index in xrange(number_of_connections):
+        Gate(address, commands[index::number_of_connections], latencies, socket_map)
+    start = timeit.default_timer()
+    asyncore.loop(use_poll=True, map=socket_map)
+    elapsed = timeit.default_timer()-start
+
+    return {
+        'connections': number_of_connections,
+        'elapsed_seconds': elapsed,
+        'throughput': len(commands)/elapsed if elapsed else None,
+        'total': summarise([latency for command_latencies in latencies.values() for latency in command_latencies]),
+        'commands': dict((command, summarise(command_latencies)) for command, command_latencies in latencies.items()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the gate server (flask run-gate-server) with simulated gate connections')
+    parser.add_argument('--slots', type=int, default=1000, help='Parking lot size')
+    parser.add_argument('--commands', type=int, default=20000, help='Number of timed commands per number of connections')
+    parser.add_argument('--connections', default='10,100,1000', help='Comma separated numbers of gate connections')
+    parser.add_argument('--mix', help='Command mix, e.g. park=40,leave=30,status=1')
+    parser.add_argument('--occupancy', type=float, default=0.5, help='Share of slots occupied before the timed commands')
+    parser.add_argument('--seed', type=int, default=0, help='Workload seed')
+    parser.add_argument('--output', help='JSON file the results are written to')
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    results = {'slots': args.slots, 'seed': args.seed, 'mix': mix, 'runs': []}
+    database_dir = tempfile.mkdtemp(prefix='parking_lot_gates')
+    sys.stdout.write('{:>12}{:>14}{:>10}{:>10}{:>10}\n'.format('connections', 'commands/sec', 'p50 ms', 'p95 ms', 'p99 ms'))
+    try:
+        for number_of_connections in [int(connections) for connections in args.connections.split(',')]:
+            # A server per run, in its own process, so that the gates do not share its interpreter
+            ready, server_ready = multiprocessing.Pipe()
+            server = multiprocessing.Process(target=serve, args=('sqlite:///' + os.path.join(database_dir, 'gates.db'), server_ready))
+            server.start()
+            try:
+                run = run_gates(ready.recv(), args.slots, args.commands, number_of_connections, mix, args.seed, args.occupancy)
+            finally:
+                server.terminate()
+                server.join()
+            results['runs'].append(run)
+            sys.stdout.write('{:>12}{:>14.0f}{:>10.2f}{:>10.2f}{:>10.2f}\n'.format(
+                number_of_connections, run['throughput'] or 0, run['total']['p50_us']/1e3, run['total']['p95_us']/1e3, run['total']['p99_us']/1e3))
+    finally:
+        shutil.rmtree(database_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
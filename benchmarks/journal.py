@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from app import parking_lot, utils
+from app.journal import Journal, read_frames
+from benchmarks.runner import reset_parking_lot
+from benchmarks.workload import WorkloadGenerator, parse_mix
+
+# Write commands only, the reads are not journaled
+WRITE_MIX = 'park=50,leave=50'
+
+
+def time_appends(journal_path, number_of_frames, group_size):
+    """
+    Appends frames of the size of a park command, one at a time
+
+    Returns:
+    float: frames/sec
+    """
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+    journal = Journal(journal_path, group_size)
+    payload = '["park", "KA-01-HH-1234", "White"]'
+    start = timeit.default_timer()
+    for _ in xrange(number_of_frames):
+        journal.append([payload])
+    journal.close()
+    return number_of_frames/(timeit.default_timer()-start)
+
+
+def time_commands(command_inputs):
+    """
+    Returns:
+    float: commands/sec through process_command_output
+    """
+    with open(os.devnull, 'w') as null_output:
+        start = timeit.default_timer()
+        for command_input in command_inputs:
+            utils.process_command_output(command_input, null_output)
+        return len(command_inputs)/(timeit.default_timer()-start)
+
+
+def time_recovery(checkpoint):
+    """
+    Returns:
+    tuple: The number of commands replayed and the seconds taken by the recovery
+    """
+    utils.memory_lot.clear()
+    if not checkpoint and os.path.exists(utils.checkpoint_path(parking_lot.config['JOURNAL_PATH'])):
+        os.remove(utils.checkpoint_path(parking_lot.config['JOURNAL_PATH']))
+    start = timeit.default_timer()
+    _, replayed = utils.recover_parking_lot()
+    return replayed, timeit.default_timer()-start
+
+
+def time_formatted_replay():
+    """
+    Replays the whole journal through process_command_input, parsing the commands and formatting their messages, for
+    comparison with the replay of the recovery
+
+    Returns:
+    float: The seconds taken by the replay
+    """
+    utils.memory_lot.clear()
+    start = timeit.default_timer()
+    with utils.without_journal():
+        for _, payload, _ in read_frames(parking_lot.config['JOURNAL_PATH']):
+            entry = json.loads(payload)
+            if entry[0] == utils.TIME_PREFIX:  # Only the SQL storage backend stamps the parkings
+                entry = entry[2:]
+            utils.process_command_input(' '.join('{}'.format(value) for value in entry))
+    return timeit.default_timer()-start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the command journal: appends, journaled commands and recovery')
+    parser.add_argument('--slots', type=int, default=1000, help='Parking lot size')
+    parser.add_argument('--appends', type=int, default=20000, help='Number of timed appends per group size')
+    parser.add_argument('--group-sizes', default='1,16,64,1024', help='Comma separated numbers of frames per fsync')
+    parser.add_argument('--lengths', default='1000,10000,100000', help='Comma separated journal lengths (write commands) recovered')
+    parser.add_argument('--checkpoint-interval', type=int, default=30000, help='Journaled commands between two checkpoints')
+    parser.add_argument('--seed', type=int, default=0, help='Workload seed')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='parking_lot_journal')
+    journal_path = os.path.join(directory, 'parking_lot.journal')
+    try:
+        sys.stdout.write('{:>12}{:>16}\n'.format('group size', 'appends/sec'))
+        for group_size in [int(group_size) for group_size in args.group_sizes.split(',')]:
+            sys.stdout.write('{:>12}{:>16.0f}\n'.format(group_size, time_appends(journal_path, args.appends, group_size)))
+        os.remove(journal_path)
+
+        # The memory storage backend, so that the journal is not hidden behind the database
+        reset_parking_lot('sqlite:///' + os.path.join(directory, 'journal.db'), 'memory')
+        generator = WorkloadGenerator(args.slots, parse_mix(WRITE_MIX), args.seed)
+        command_inputs = list(generator.setup(0.5)) + list(generator.generate(max(int(length) for length in args.lengths.split(','))))
+        timed_inputs = command_inputs[:args.appends]
+        sys.stdout.write('\n{:>12}{:>16}\n'.format('journal', 'commands/sec'))
+        sys.stdout.write('{:>12}{:>16.0f}\n'.format('disabled', time_commands(timed_inputs)))
+        parking_lot.config['JOURNAL_PATH'] = journal_path
+        parking_lot.config['JOURNAL_CHECKPOINT_INTERVAL'] = args.checkpoint_interval
+        utils.memory_lot.clear()
+        sys.stdout.write('{:>12}{:>16.0f}\n'.format('enabled', time_commands(timed_inputs)))
+
+        sys.stdout.write('\n{:>12}{:>14}{:>12}{:>20}{:>12}{:>22}\n'.format('length', 'full replay', 'ms', 'from checkpoint', 'ms', 'formatted replay ms'))
+        for length in [int(length) for length in args.lengths.split(',')]:
+            utils.journals.pop(journal_path).close()
+            for file_path in [journal_path, utils.checkpoint_path(journal_path)]:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            utils.memory_lot.clear()
+            with open(os.devnull, 'w') as null_output:
+                for command_input in command_inputs[:length]:
+                    utils.process_command_output(command_input, null_output)
+            replayed_from_checkpoint, from_checkpoint = time_recovery(True)
+            replayed, full = time_recovery(False)
+            formatted = time_formatted_replay()
+            sys.stdout.write('{:>12}{:>14}{:>12.1f}{:>20}{:>12.1f}{:>22.1f}\n'.format(
+                length, replayed, full*1e3, replayed_from_checkpoint, from_checkpoint*1e3, formatted*1e3))
+    finally:
+        parking_lot.config['JOURNAL_PATH'] = None
+        for journal in utils.journals.values():
+            journal.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import json
+import sys
+import threading
+import timeit
+import urllib2
+
+from benchmarks.runner import summarise
+from benchmarks.workload import DEFAULT_MIX, WorkloadGenerator, parse_mix
+
+
+def http_request(command_input):
+    """
+    The JSON API request of a parking lot command
+
+    Parameters:
+    command_input (string): The command given in the parking lot game
+
+    Returns:
+    tuple: The method, path and JSON body (or None) of the request
+    """
+    command_inputs = command_input.split()
+    if command_inputs[0] == 'create_parking_lot':
+        return 'POST', '/api/parking_lot', {'slots': int(command_inputs[1])}
+    elif command_inputs[0] == 'park':
+        return 'POST', '/api/parkings', {'registration_number': command_inputs[1], 'colour': command_inputs[2]}
+    elif command_inputs[0] == 'leave':
+        return 'DELETE', '/api/slots/{}/parking'.format(command_inputs[1]), None
+    elif command_inputs[0] == 'status':
+        return 'GET', '/api/status', None
+    elif command_inputs[0] == 'registration_numbers_for_cars_with_colour':
+        return 'GET', '/api/colours/{}/registration_numbers'.format(command_inputs[1]), None
+    elif command_inputs[0] == 'slot_numbers_for_cars_with_colour':
+        return 'GET', '/api/colours/{}/slots'.format(command_inputs[1]), None
+    elif command_inputs[0] == 'slot_number_for_registration_number':
+        return 'GET', '/api/registration_numbers/{}/slot'.format(command_inputs[1]), None
+    raise ValueError('No API request for the command: {}'.format(command_input))
+
+
+def send(url, command_input):
+    """
+    Sends the request of a command
+
+    Parameters:
+    url (string): The base URL of the API, e.g. http://127.0.0.1:5000
+    command_input (string): The command given in the parking lot game
+
+    Returns:
+    int: The HTTP status code
+    """
+    method, path, body = http_request(command_input)
+    request = urllib2.Request(url + path, data=json.dumps(body) if body is not None else None, headers={'Content-Type': 'application/json'})
+    request.get_method = lambda: method
+    try:
+        response = urllib2.urlopen(request)
+    except urllib2.HTTPError as response:  # 4xx answers, e.g. a full parking lot, are regular outcomes
+        pass
+    response.read()
+    return response.code
+
+
+def client(url, command_inputs, latencies, status_codes):
+    timer = timeit.default_timer
+    for command_input in command_inputs:
+        start = timer()
+        status_code = send(url, command_input)
+        latencies.setdefault(command_input.split()[0], []).append(timer()-start)
+        status_codes[status_code] = status_codes.get(status_code, 0)+1
+
+
+def run_load(url, number_of_slots, number_of_requests, concurrency, mix, seed, occupancy):
+    """
+    Creates the parking lot and sends the requests of a seeded workload from concurrent clients
+
+    Parameters:
+    url (string): The base URL of the API
+    number_of_slots (int): The number of parking slots
+    number_of_requests (int): The number of timed requests
+    concurrency (int): The number of concurrent clients
+    mix (dict): Weight by command
+    seed (int): The workload seed
+    occupancy (float): The share of slots occupied before the timed requests
+
+    Returns:
+    dict: The results
+    """
+    generator = WorkloadGenerator(number_of_slots, mix, seed)
+    for command_input in generator.setup(occupancy):
+        send(url, command_input)
+    commands = list(generator.generate(number_of_requests))
+
+    # Every client sends an interleaved share of the workload, and keeps its own statistics
+    client_latencies = [{} for _ in xrange(concurrency)]
+    client_status_codes = [{} for _ in xrange(concurrency)]
+    clients = [threading.Thread(target=client, args=(url, commands[index::concurrency], client_latencies[index], client_status_codes[index]))
+               for index in xrange(concurrency)]
+    start = timeit.default_timer()
+    for client_thread in clients:
+        client_thread.start()
+    for client_thread in clients:
+        client_thread.join()
+    elapsed = timeit.default_timer()-start
+
+    latencies = {}
+    status_codes = {}
+    for index in xrange(concurrency):
+        for command, command_latencies in client_latencies[index].items():
+            latencies.setdefault(command, []).extend(command_latencies)
+        for status_code, count in client_status_codes[index].items():
+            status_codes[status_code] = status_codes.get(status_code, 0)+count
+
+    return {
+        'concurrency': concurrency,
+        'elapsed_seconds': elapsed,
+        'throughput': len(commands)/elapsed if elapsed else None,
+        'status_codes': status_codes,
+        'total': summarise([latency for command_latencies in latencies.values() for latency in command_latencies]),
+        'commands': dict((command, summarise(command_latencies)) for command, command_latencies in latencies.items()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load a running parking lot JSON API (flask serve_parking_lot) with a seeded workload')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Base URL of the API')
+    parser.add_argument('--slots', type=int, default=1000, help='Parking lot size')
+    parser.add_argument('--requests', type=int, default=5000, help='Number of timed requests')
+    parser.add_argument('--concurrency', default='1,4,16', help='Comma separated numbers of concurrent clients')
+    parser.add_argument('--mix', help='Command mix, e.g. park=40,leave=30,status=1')
+    parser.add_argument('--occupancy', type=float, default=0.5, help='Share of slots occupied before the timed requests')
+    parser.add_argument('--seed', type=int, default=0, help='Workload seed')
+    parser.add_argument('--output', help='JSON file the results are written to')
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    results = {'url': args.url, 'slots': args.slots, 'seed': args.seed, 'mix': mix, 'runs': []}
+    sys.stdout.write('{:>12}{:>14}{:>10}{:>10}{:>10}  {}\n'.format('concurrency', 'requests/sec', 'p50 ms', 'p95 ms', 'p99 ms', 'status codes'))
+    for concurrency in [int(clients) for clients in args.concurrency.split(',')]:
+        run = run_load(args.url, args.slots, args.requests, concurrency, mix, args.seed, args.occupancy)
+        results['runs'].append(run)
+        sys.stdout.write('{:>12}{:>14.0f}{:>10.2f}{:>10.2f}{:>10.2f}  {}\n'.format(
+            concurrency, run['throughput'] or 0, run['total']['p50_us']/1e3, run['total']['p95_us']/1e3, run['total']['p99_us']/1e3,
+            ', '.join('{}: {}'.format(status_code, count) for status_code, count in sorted(run['status_codes'].items()))))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from app import utils
+from benchmarks.runner import reset_parking_lot
+
+
+def time_toggles(number_of_slots, range_length, repeat):
+    """
+    Deactivates and activates again a range of slots in the middle of the parking lot
+
+    Returns:
+    tuple: The mean milliseconds of a deactivate_slots and of an activate_slots
+    """
+    first_slot_id = (number_of_slots-range_length)//2 + 1
+    slots = '{}-{}'.format(first_slot_id, first_slot_id+range_length-1)
+    deactivate = activate = 0
+    for _ in xrange(repeat):
+        start = timeit.default_timer()
+        utils.deactivate_slots(slots)
+        deactivate += timeit.default_timer()-start
+        start = timeit.default_timer()
+        utils.activate_slots(slots)
+        activate += timeit.default_timer()-start
+    return deactivate*1e3/repeat, activate*1e3/repeat
+
+
+def time_parks(number_of_parks):
+    """
+    Parks vehicles and frees their slots again
+
+    Returns:
+    float: The mean microseconds of a park and a leave
+    """
+    start = timeit.default_timer()
+    for index in xrange(number_of_parks):
+        utils.unpark_vehicle(utils.park_vehicle('KA-{:08d}'.format(index), 'White'))
+    return (timeit.default_timer()-start)*1e6/number_of_parks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time deactivate_slots and activate_slots by length of the range, and the parks behind an inactive range')
+    parser.add_argument('--slots', type=int, default=200000, help='Parking lot size')
+    parser.add_argument('--lengths', default='10,1000,100000', help='Comma separated lengths of the ranges of slots')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed toggles per length')
+    parser.add_argument('--parks', type=int, default=2000, help='Number of timed parks')
+    parser.add_argument('--backends', default='memory,sql', help='Comma separated storage backends')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='parking_lot_maintenance')
+    try:
+        lengths = [int(length) for length in args.lengths.split(',')]
+        for backend in args.backends.split(','):
+            reset_parking_lot('sqlite:///' + os.path.join(directory, '{}.db'.format(backend)), backend)
+            utils.create_parking_lot(args.slots)
+            sys.stdout.write('{} backend, {} slots\n'.format(backend, args.slots))
+            sys.stdout.write('{:>10}{:>16}{:>16}\n'.format('range', 'deactivate ms', 'activate ms'))
+            for length in lengths:
+                sys.stdout.write('{:>10}{:>16.3f}{:>16.3f}\n'.format(length, *time_toggles(args.slots, length, args.repeat)))
+
+            # The lowest numbered slots are inactive, every park jumps over them
+            sys.stdout.write('{:>10}{:>16}\n'.format('inactive', 'park+leave us'))
+            for length in [0] + lengths:
+                if length:
+                    utils.deactivate_slots('1-{}'.format(length))
+                sys.stdout.write('{:>10}{:>16.1f}\n'.format(length, time_parks(args.parks)))
+                if length:
+                    utils.activate_slots('1-{}'.format(length))
+    finally:
+        utils.forget_lots()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
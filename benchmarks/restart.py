@@ -0,0 +1,115 @@
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+from app import db, models, utils
+from benchmarks.runner import reset_parking_lot
+
+COLOURS = ['White', 'Black', 'Red', 'Blue', 'Silver', 'Grey', 'Green', 'Yellow']
+
+# Parkings inserted per statement during the set up
+SETUP_CHUNK_SIZE = 10000
+
+
+def set_up(database_uri, number_of_slots, occupancy, seed):
+    """
+    Creates the parking lot and parks vehicles in a seeded share of the slots, with bulk inserts
+
+    Parameters:
+    database_uri (string): The SQL Alchemy database URI
+    number_of_slots (int): The number of parking slots
+    occupancy (float): The share of slots occupied
+    seed (int): The seed of the occupied slots
+
+    Returns:
+    int: number of parkings
+    """
+    reset_parking_lot(database_uri, 'sql')
+    utils.create_parking_lot(number_of_slots)
+
+    random_generator = random.Random(seed)
+    parkings = [
+        dict(slot_id=slot_id, registration_number='KA-{:02d}-{:07d}'.format(slot_id % 100, slot_id), colour=COLOURS[slot_id % len(COLOURS)],
+             colour_key=models.colour_key(COLOURS[slot_id % len(COLOURS)]), active=True)
+        for slot_id in xrange(1, number_of_slots+1) if random_generator.random() < occupancy
+    ]
+    generation = utils.begin_write()
+    for chunk_start in xrange(0, len(parkings), SETUP_CHUNK_SIZE):
+        db.session.execute(models.Parking.__table__.insert(), parkings[chunk_start:chunk_start+SETUP_CHUNK_SIZE])
+    utils._bump_lot_generation(generation)
+    db.session.commit()
+    utils.free_slots.invalidate()
+    return len(parkings)
+
+
+def restart(method, snapshot_path, registration_number, results):
+    """
+    Starts the memory parking lot like the gate server does, in a separate process, from the SQL tables or from the
+    snapshot
+
+    Parameters:
+    method (string): 'sql' or 'snapshot'
+    snapshot_path (string): The path of the snapshot file
+    registration_number (string): The registration number of the first read
+    results (Queue): Where the (method, seconds to the first read, seconds to the loaded memory parking lot) result is put
+    """
+    # The parent's connections must not be shared with the child
+    db.engine.dispose()
+    utils.memory_lot.clear()
+
+    start = timeit.default_timer()
+    if method == 'snapshot' and utils.map_snapshot(snapshot_path) is not None:
+        with utils.using_storage_backend('snapshot'):
+            utils.slot_number_for_registration_number(registration_number)
+        first_read = timeit.default_timer()-start
+        utils.load_memory_lot(utils.mapped_snapshot)
+        utils.unmap_snapshot()
+    else:
+        utils.load_memory_lot()
+        with utils.using_storage_backend('memory'):
+            utils.slot_number_for_registration_number(registration_number)
+        first_read = timeit.default_timer()-start
+    loaded = timeit.default_timer()-start
+    db.session.remove()
+
+    results.put((method, first_read, loaded))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the start of the memory parking lot from the SQL tables and from a snapshot')
+    parser.add_argument('--slots', type=int, default=1000000, help='Parking lot size')
+    parser.add_argument('--occupancy', type=float, default=0.5, help='Share of slots occupied')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the occupied slots')
+    args = parser.parse_args(argv)
+
+    database_dir = tempfile.mkdtemp(prefix='parking_lot_restart')
+    snapshot_path = os.path.join(database_dir, 'restart.snapshot')
+    try:
+        number_of_parkings = set_up('sqlite:///' + os.path.join(database_dir, 'restart.db'), args.slots, args.occupancy, args.seed)
+        start = timeit.default_timer()
+        utils.snapshot_parking_lot(snapshot_path)
+        sys.stdout.write('{} slots, {} parkings, snapshot of {:.1f} MB written in {:.0f} ms\n'.format(
+            args.slots, number_of_parkings, os.path.getsize(snapshot_path)/1e6, (timeit.default_timer()-start)*1e3))
+        registration_number = next(utils.parking_lot_status(args.slots//2, 1))['registration_number']
+        db.session.remove()
+
+        sys.stdout.write('{:>10}{:>18}{:>14}\n'.format('start', 'first read ms', 'loaded ms'))
+        for method in ['sql', 'snapshot']:
+            # A process per start, so that nothing is left loaded by the previous one
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(target=restart, args=(method, snapshot_path, registration_number, results))
+            process.start()
+            _, first_read, loaded = results.get()
+            process.join()
+            sys.stdout.write('{:>10}{:>18.1f}{:>14.0f}\n'.format(method, first_read*1e3, loaded*1e3))
+    finally:
+        shutil.rmtree(database_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
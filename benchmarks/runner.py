@@ -0,0 +1,196 @@
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+from app import db, parking_lot, utils
+from benchmarks.workload import DEFAULT_MIX, WorkloadGenerator, parse_mix
+
+# Commands are run in batches of this size during the (untimed) set up of a workload
+SETUP_BATCH_SIZE = 10000
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile
+
+    Parameters:
+    sorted_values (list): The values, sorted
+    percent (float): The percentile, between 0 and 100
+
+    Returns:
+    float: The percentile value
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(percent/100.0*len(sorted_values)))
+    return sorted_values[min(max(rank, 1), len(sorted_values))-1]
+
+
+def summarise(latencies):
+    """
+    Summary statistics of command latencies
+
+    Parameters:
+    latencies (list): The latencies in seconds
+
+    Returns:
+    dict: Count, throughput (commands/sec) and latency percentiles (microseconds)
+    """
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        'count': len(latencies),
+        'throughput': len(latencies)/total if total else None,
+        'mean_us': total/len(latencies)*1e6,
+        'p50_us': percentile(latencies, 50)*1e6,
+        'p95_us': percentile(latencies, 95)*1e6,
+        'p99_us': percentile(latencies, 99)*1e6,
+        'max_us': latencies[-1]*1e6,
+    }
+
+
+def reset_parking_lot(database_uri, storage_backend):
+    """
+    Points the app to a fresh database and storage backend
+
+    Parameters:
+    database_uri (string): The SQL Alchemy database URI
+    storage_backend (string): 'sql' or 'memory'
+    """
+    db.session.remove()
+    parking_lot.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    parking_lot.config['STORAGE_BACKEND'] = storage_backend
+    db.drop_all()
+    db.create_all()
+    utils.forget_lots()
+
+
+def run_workload(command_inputs):
+    """
+    Runs the commands, timing each of them
+
+    Parameters:
+    command_inputs (iterable): The commands given in the parking lot game
+
+    Returns:
+    dict: Latencies in seconds by command
+    """
+    latencies = {}
+    timer = timeit.default_timer
+    with open(os.devnull, 'w') as null_output:
+        for command_input in command_inputs:
+            start = timer()
+            utils.process_command_output(command_input, null_output)
+            latencies.setdefault(command_input.split()[0], []).append(timer()-start)
+    return latencies
+
+
+def run_benchmark(number_of_slots, number_of_commands, mix, seed, occupancy, workload_path=None):
+    """
+    Sets up a parking lot and times the command mix against it
+
+    Parameters:
+    number_of_slots (int): The number of parking slots
+    number_of_commands (int): The number of timed commands
+    mix (dict): Weight by command
+    seed (int): The workload seed
+    occupancy (float): The share of slots occupied before the timed commands
+    workload_path (string): Optional file the workload is written to, to be replayed with run_parking_lot
+
+    Returns:
+    dict: The results
+    """
+    generator = WorkloadGenerator(number_of_slots, mix, seed)
+    setup_commands = list(generator.setup(occupancy))
+    commands = list(generator.generate(number_of_commands))
+
+    if workload_path:
+        with open(workload_path, 'w') as workload_file:
+            workload_file.writelines('{}\n'.format(command_input) for command_input in setup_commands+commands)
+
+    start = timeit.default_timer()
+    with open(os.devnull, 'w') as null_output:
+        utils.process_command_batch(setup_commands, SETUP_BATCH_SIZE, null_output)
+    setup_seconds = timeit.default_timer()-start
+
+    start = timeit.default_timer()
+    latencies = run_workload(commands)
+    elapsed = timeit.default_timer()-start
+
+    return {
+        'slots': number_of_slots,
+        'setup_seconds': setup_seconds,
+        'elapsed_seconds': elapsed,
+        'throughput': len(commands)/elapsed if elapsed else None,
+        'total': summarise([latency for command_latencies in latencies.values() for latency in command_latencies]),
+        'commands': dict((command, summarise(command_latencies)) for command, command_latencies in latencies.items()),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=parking_lot.config['BASEDIR'], stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, output):
+    for run in results['runs']:
+        output.write('\n{} slots: {:.0f} commands/sec (set up in {:.1f} s)\n'.format(run['slots'], run['throughput'] or 0, run['setup_seconds']))
+        output.write('{:<45}{:>8}{:>12}{:>12}{:>12}{:>14}\n'.format('command', 'count', 'p50 us', 'p95 us', 'p99 us', 'commands/sec'))
+        for command, summary in sorted(run['commands'].items()):
+            output.write('{:<45}{:>8}{:>12.1f}{:>12.1f}{:>12.1f}{:>14.0f}\n'.format(
+                command, summary['count'], summary['p50_us'], summary['p95_us'], summary['p99_us'], summary['throughput'] or 0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the parking lot commands on seeded workloads')
+    parser.add_argument('--slots', default='10,1000,100000', help='Comma separated parking lot sizes')
+    parser.add_argument('--commands', type=int, default=10000, help='Number of timed commands per parking lot size')
+    parser.add_argument('--mix', help='Command mix, e.g. park=40,leave=30,status=1 (default: {})'.format(
+        ','.join('{}={}'.format(command, weight) for command, weight in sorted(DEFAULT_MIX.items()))))
+    parser.add_argument('--occupancy', type=float, default=0.5, help='Share of slots occupied before the timed commands')
+    parser.add_argument('--seed', type=int, default=0, help='Workload seed')
+    parser.add_argument('--backend', choices=['sql', 'memory'], default='sql', help='Storage backend')
+    parser.add_argument('--output', help='JSON file the results are written to')
+    parser.add_argument('--save-workloads', metavar='DIR', help='Directory the generated workloads are written to')
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    results = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'backend': args.backend,
+        'seed': args.seed,
+        'mix': mix,
+        'occupancy': args.occupancy,
+        'runs': [],
+    }
+
+    database_dir = tempfile.mkdtemp(prefix='parking_lot_benchmark')
+    try:
+        for number_of_slots in [int(slots) for slots in args.slots.split(',')]:
+            reset_parking_lot('sqlite:///' + os.path.join(database_dir, 'benchmark.db'), args.backend)
+            workload_path = os.path.join(args.save_workloads, 'workload_{}.txt'.format(number_of_slots)) if args.save_workloads else None
+            results['runs'].append(run_benchmark(number_of_slots, args.commands, mix, args.seed, args.occupancy, workload_path))
+    finally:
+        db.session.remove()
+        shutil.rmtree(database_dir, ignore_errors=True)
+
+    print_results(results, sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
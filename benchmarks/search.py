@@ -0,0 +1,113 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+from app import db, models, utils
+from benchmarks.runner import reset_parking_lot
+from benchmarks.restart import COLOURS, SETUP_CHUNK_SIZE
+
+# Kinds of the timed patterns
+PATTERNS = ['prefix', 'suffix', 'infix']
+
+
+def registration_number(index):
+    return 'KA-{:02d}-{}-{:06d}'.format(index % 100, 'HH' if index % 2 else 'BB', index)
+
+
+def set_up(database_uri, number_of_parkings, number_of_historical_parkings):
+    """
+    Creates the parking lot with the parked vehicles and the closed parkings (not compacted), with bulk inserts
+
+    Parameters:
+    database_uri (string): The SQL Alchemy database URI
+    number_of_parkings (int): The number of parked vehicles, one per slot
+    number_of_historical_parkings (int): The number of closed parkings
+    """
+    reset_parking_lot(database_uri, 'sql')
+    utils.create_parking_lot(number_of_parkings)
+
+    generation = utils.begin_write()
+    rows = (dict(slot_id=index % number_of_parkings + 1, registration_number=registration_number(index), colour=COLOURS[index % len(COLOURS)],
+                 colour_key=models.colour_key(COLOURS[index % len(COLOURS)]), active=index >= number_of_historical_parkings)
+            for index in xrange(number_of_historical_parkings + number_of_parkings))
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == SETUP_CHUNK_SIZE:
+            db.session.execute(models.Parking.__table__.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(models.Parking.__table__.insert(), chunk)
+    utils._bump_lot_generation(generation, parked_vehicles=number_of_parkings)
+    db.session.commit()
+    utils.free_slots.invalidate()
+
+
+def patterns(kind, number_of_parkings, number_of_historical_parkings, number_of_searches, seed):
+    """
+    Seeded patterns of the registration numbers of parked vehicles
+
+    Returns:
+    list: The patterns
+    """
+    random_generator = random.Random(seed)
+    indexes = [random_generator.randrange(number_of_historical_parkings, number_of_historical_parkings + number_of_parkings) for _ in xrange(number_of_searches)]
+    if kind == 'prefix':
+        return [registration_number(index)[:-3] + '*' for index in indexes]
+    elif kind == 'suffix':
+        return ['*' + registration_number(index)[-4:] for index in indexes]
+    return ['*' + registration_number(index)[-5:-1] + '*' for index in indexes]
+
+
+def time_searches(search, search_patterns):
+    """
+    Returns:
+    tuple: The mean number of matches and the mean milliseconds of a search
+    """
+    matches = 0
+    start = timeit.default_timer()
+    for pattern in search_patterns:
+        matches += len(search(pattern))
+    return float(matches)/len(search_patterns), (timeit.default_timer()-start)*1e3/len(search_patterns)
+
+
+def like_scan(pattern):
+    # A search without the registration indexes: LIKE over the parked vehicles
+    return db.session.query(models.Parking.slot_id).filter(models.Parking.active==True, models.Parking.lot_id==utils.LOT_ID,
+                                                           models.Parking.registration_number.like(pattern.replace('*', '%'))).all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the registration number searches by pattern kind, with closed parkings left in the parking table')
+    parser.add_argument('--parkings', type=int, default=20000, help='Number of parked vehicles')
+    parser.add_argument('--history', type=int, default=1000000, help='Number of closed parkings')
+    parser.add_argument('--searches', type=int, default=50, help='Number of timed searches per pattern kind')
+    parser.add_argument('--seed', type=int, default=0, help='Pattern seed')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='parking_lot_search')
+    try:
+        start = timeit.default_timer()
+        set_up('sqlite:///' + os.path.join(directory, 'search.db'), args.parkings, args.history)
+        utils.load_memory_lot()
+        sys.stdout.write('{} parked vehicles, {} closed parkings (set up in {:.1f} s)\n'.format(args.parkings, args.history, timeit.default_timer()-start))
+        sys.stdout.write('{:>8}{:>10}{:>10}{:>12}{:>16}\n'.format('pattern', 'matches', 'sql ms', 'memory ms', 'LIKE scan ms'))
+        for kind in PATTERNS:
+            search_patterns = patterns(kind, args.parkings, args.history, args.searches, args.seed)
+            matches, sql = time_searches(utils.search_registration_numbers, search_patterns)
+            with utils.using_storage_backend('memory'):
+                utils.search_registration_numbers(search_patterns[0])  # Builds the sorted registration numbers
+                _, memory = time_searches(utils.search_registration_numbers, search_patterns)
+            _, scan = time_searches(like_scan, search_patterns)
+            sys.stdout.write('{:>8}{:>10.1f}{:>10.2f}{:>12.2f}{:>16.2f}\n'.format(kind, matches, sql, memory, scan))
+    finally:
+        db.session.remove()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from app import parking_lot
+from app.shards import ShardPool
+from benchmarks.workload import DEFAULT_MIX, WorkloadGenerator, parse_mix
+
+
+def lot_workloads(number_of_lots, number_of_slots, number_of_commands, mix, seed):
+    """
+    Generates the set up and the command mix of every lot, each lot with a seeded workload of its own
+
+    Parameters:
+    number_of_lots (int): The number of lots, numbered from 1
+    number_of_slots (int): The size of every lot
+    number_of_commands (int): The number of timed commands, over all the lots
+    mix (dict): The command mix
+    seed (int): The workload seed
+
+    Returns:
+    tuple: The set up commands and the timed commands, the lots interleaved like independent gates
+    """
+    set_up, workloads = [], []
+    for lot_id in xrange(1, number_of_lots+1):
+        generator = WorkloadGenerator(number_of_slots, mix, seed+lot_id)
+        set_up.extend('lot {} {}'.format(lot_id, command_input) for command_input in generator.setup(0.5))
+        workloads.append(['lot {} {}'.format(lot_id, command_input) for command_input in generator.generate(number_of_commands//number_of_lots)])
+    return set_up, [command_input for commands in zip(*workloads) for command_input in commands]
+
+
+def time_workers(workers, database_dir, set_up, command_inputs):
+    """
+    Runs the workload on a pool of workers, each owning the database of its shard
+
+    Returns:
+    float: commands/sec of the timed commands
+    """
+    pool = ShardPool(workers, 'sqlite:///' + os.path.join(database_dir, 'workers{}_shard{{shard}}.db'.format(workers)))
+    try:
+        pool.run_commands(set_up)
+        start = timeit.default_timer()
+        pool.run_commands(command_inputs)
+        return len(command_inputs)/(timeit.default_timer()-start)
+    finally:
+        pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time independent lots run by a pool of worker processes, by number of workers')
+    parser.add_argument('--workers', default='1,2,4,8', help='Comma separated numbers of worker processes')
+    parser.add_argument('--lots', type=int, default=16, help='Number of lots')
+    parser.add_argument('--slots', type=int, default=100, help='Size of every lot')
+    parser.add_argument('--commands', type=int, default=4000, help='Number of timed commands, over all the lots')
+    parser.add_argument('--mix', help='Command mix, e.g. park=40,leave=30,status=1')
+    parser.add_argument('--backend', default='sql', choices=['sql', 'memory'], help='Storage backend of the workers')
+    parser.add_argument('--seed', type=int, default=0, help='Workload seed')
+    args = parser.parse_args(argv)
+
+    parking_lot.config['STORAGE_BACKEND'] = args.backend
+    set_up, command_inputs = lot_workloads(args.lots, args.slots, args.commands, parse_mix(args.mix) if args.mix else DEFAULT_MIX, args.seed)
+
+    database_dir = tempfile.mkdtemp(prefix='parking_lot_shards')
+    try:
+        sys.stdout.write('{} lots of {} slots, {} commands, {} cores\n'.format(args.lots, args.slots, len(command_inputs), multiprocessing.cpu_count()))
+        sys.stdout.write('{:>10}{:>16}{:>10}\n'.format('workers', 'commands/sec', 'speedup'))
+        baseline = None
+        for workers in [int(workers) for workers in args.workers.split(',')]:
+            throughput = time_workers(workers, database_dir, set_up, command_inputs)
+            baseline = baseline or throughput
+            sys.stdout.write('{:>10}{:>16.0f}{:>9.2f}x\n'.format(workers, throughput, throughput/baseline))
+    finally:
+        shutil.rmtree(database_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from app.simulations import run_simulations
+from benchmarks.workload import DEFAULT_MIX, WorkloadGenerator, parse_mix
+
+
+def write_scenarios(directory, number_of_files, number_of_slots, number_of_commands, mix, seed):
+    """
+    Writes the scenario files, each with a seeded workload of its own
+
+    Returns:
+    list: The paths of the files
+    """
+    file_paths = []
+    for index in xrange(number_of_files):
+        generator = WorkloadGenerator(number_of_slots, mix, seed+index)
+        file_path = os.path.join(directory, 'scenario_{:04d}.txt'.format(index))
+        with open(file_path, 'w') as scenario_file:
+            for command_input in list(generator.setup(0.5)) + list(generator.generate(number_of_commands)):
+                scenario_file.write('{}\n'.format(command_input))
+        file_paths.append(file_path)
+    return file_paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the scenario files run by flask simulate, by number of workers')
+    parser.add_argument('--workers', default='1,2,4', help='Comma separated numbers of worker processes')
+    parser.add_argument('--files', type=int, default=32, help='Number of scenario files')
+    parser.add_argument('--slots', type=int, default=100, help='Parking lot size of every scenario')
+    parser.add_argument('--commands', type=int, default=500, help='Number of commands per scenario, after its set up')
+    parser.add_argument('--mix', help='Command mix, e.g. park=40,leave=30,status=1')
+    parser.add_argument('--database-dir', help='Directory of the databases of the runs (e.g. /dev/shm), in memory by default')
+    parser.add_argument('--seed', type=int, default=0, help='Workload seed')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='parking_lot_simulate')
+    try:
+        file_paths = write_scenarios(directory, args.files, args.slots, args.commands, parse_mix(args.mix) if args.mix else DEFAULT_MIX, args.seed)
+        sys.stdout.write('{} files of {} slots, {} commands each, {} cores\n'.format(args.files, args.slots, args.commands, os.sysconf('SC_NPROCESSORS_ONLN')))
+        sys.stdout.write('{:>10}{:>12}{:>12}{:>12}\n'.format('workers', 'seconds', 'files/sec', 'scaling'))
+        first_seconds = outputs = None
+        for workers in [int(workers) for workers in args.workers.split(',')]:
+            start = timeit.default_timer()
+            results = list(run_simulations(file_paths, workers, args.database_dir))
+            seconds = timeit.default_timer()-start
+            first_seconds = first_seconds or seconds
+
+            # The outputs do not depend on the number of workers
+            run_outputs = dict((result['file'], result['output']) for result in results)
+            if outputs is not None and run_outputs != outputs:
+                sys.exit('The outputs of {} workers differ'.format(workers))
+            outputs = run_outputs
+            sys.stdout.write('{:>10}{:>12.2f}{:>12.1f}{:>12.2f}\n'.format(workers, seconds, len(file_paths)/seconds, first_seconds/seconds))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
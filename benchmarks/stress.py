@@ -0,0 +1,121 @@
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+from app import db, utils
+from benchmarks.runner import reset_parking_lot
+
+
+def writer(worker_id, number_of_parks, seed, results):
+    """
+    Parks and unparks vehicles of its own, in a separate process sharing the database
+
+    Parameters:
+    worker_id (int): The worker number, part of the registration numbers
+    number_of_parks (int): The number of park commands
+    seed (int): The seed of the park/leave sequence
+    results (Queue): Where the (worker_id, parks, elapsed seconds, held slots, error) result is put
+    """
+    # The parent's connections and free slot index must not be shared with the child
+    db.engine.dispose()
+    utils.free_slots.invalidate()
+
+    random_generator = random.Random(seed+worker_id)
+    held_slots = []
+    parks = 0
+    error = None
+    start = timeit.default_timer()
+    try:
+        for index in xrange(number_of_parks):
+            slot_id = utils.park_vehicle('W{}-{}'.format(worker_id, index), 'White')
+            if slot_id > 0:
+                held_slots.append(slot_id)
+                parks += 1
+            # Leave one of its own slots, as often as it parks
+            if held_slots and random_generator.random() < 0.5:
+                utils.unpark_vehicle(held_slots.pop(random_generator.randrange(len(held_slots))))
+    except Exception as exception:
+        # Reported to the parent, which would otherwise wait for the result forever
+        error = repr(exception)
+    elapsed = timeit.default_timer()-start
+    db.session.remove()
+
+    results.put((worker_id, parks, elapsed, held_slots, error))
+
+
+def run_stress(database_uri, number_of_slots, number_of_workers, number_of_parks, seed):
+    """
+    Runs concurrent writer processes against a single database file
+
+    Parameters:
+    database_uri (string): The SQL Alchemy database URI
+    number_of_slots (int): The number of parking slots
+    number_of_workers (int): The number of writer processes
+    number_of_parks (int): The number of park commands per writer
+    seed (int): The seed of the park/leave sequences
+
+    Returns:
+    dict: The throughput, the number of slots held by more than one writer and the errors of the writers
+    """
+    reset_parking_lot(database_uri, 'sql')
+    utils.create_parking_lot(number_of_slots)
+    db.session.remove()
+    db.engine.dispose()
+
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=writer, args=(worker_id, number_of_parks, seed, results)) for worker_id in xrange(number_of_workers)]
+    start = timeit.default_timer()
+    for worker in workers:
+        worker.start()
+    worker_results = [results.get() for worker in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = timeit.default_timer()-start
+
+    # Every slot a writer believes it holds must be held by it alone, and parked in the database
+    held_slots = [slot_id for worker_result in worker_results for slot_id in worker_result[3]]
+    parked_slots = [status['slot_id'] for status in utils.parking_lot_status()]
+    db.session.remove()
+
+    return {
+        'workers': number_of_workers,
+        'parks': sum(worker_result[1] for worker_result in worker_results),
+        'elapsed_seconds': elapsed,
+        'double_allocations': len(held_slots)-len(set(held_slots)),
+        'lost_parkings': len(set(held_slots).symmetric_difference(parked_slots)),
+        'errors': [worker_result[4] for worker_result in worker_results if worker_result[4]],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run concurrent parking lot writer processes against a single database')
+    parser.add_argument('--slots', type=int, default=100, help='Parking lot size')
+    parser.add_argument('--workers', default='1,4,16', help='Comma separated numbers of writer processes')
+    parser.add_argument('--parks', type=int, default=200, help='Number of park commands per writer')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the park/leave sequences')
+    args = parser.parse_args(argv)
+
+    database_dir = tempfile.mkdtemp(prefix='parking_lot_stress')
+    failed = False
+    try:
+        sys.stdout.write('{:>8}{:>10}{:>14}{:>20}{:>16}\n'.format('workers', 'parks', 'parks/sec', 'double allocations', 'lost parkings'))
+        for number_of_workers in [int(workers) for workers in args.workers.split(',')]:
+            run = run_stress('sqlite:///' + os.path.join(database_dir, 'stress.db'), args.slots, number_of_workers, args.parks, args.seed)
+            sys.stdout.write('{:>8}{:>10}{:>14.0f}{:>20}{:>16}\n'.format(
+                run['workers'], run['parks'], run['parks']/run['elapsed_seconds'], run['double_allocations'], run['lost_parkings']))
+            for error in run['errors']:
+                sys.stdout.write('        error: {}\n'.format(error))
+            failed = failed or run['double_allocations'] or run['lost_parkings'] or run['errors']
+    finally:
+        shutil.rmtree(database_dir, ignore_errors=True)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import random
+
+from app.memory import MemoryParkingLot
+
+# Relative frequencies of the generated commands
+DEFAULT_MIX = {
+    'park': 40,
+    'leave': 30,
+    'status': 1,
+    'registration_numbers_for_cars_with_colour': 5,
+    'slot_numbers_for_cars_with_colour': 5,
+    'slot_number_for_registration_number': 19,
+}
+
+# Approximate share of the car colours on the road
+COLOURS = [('White', 35), ('Silver', 15), ('Grey', 14), ('Black', 13), ('Red', 9), ('Blue', 8), ('Brown', 3), ('Green', 2), ('Yellow', 1)]
+
+# Registration numbers are of the form KA-01-HH-1234, with the state codes weighted by their number of vehicles
+STATE_CODES = [('MH', 18), ('UP', 14), ('TN', 11), ('KA', 10), ('GJ', 9), ('DL', 8), ('RJ', 7), ('KL', 6), ('WB', 6), ('TS', 5), ('AP', 4), ('PB', 2)]
+
+# Share of the lookups for a vehicle which is not parked
+MISS_RATIO = 0.1
+
+
+def parse_mix(mix):
+    """
+    Parses a command mix given as "park=40,leave=30,..."
+
+    Parameters:
+    mix (string): Comma separated command=weight pairs
+
+    Returns:
+    dict: Weight by command
+    """
+    weights = {}
+    for item in mix.split(','):
+        command, weight = item.split('=')
+        if command not in DEFAULT_MIX:
+            raise ValueError('Unknown command in the mix: {}'.format(command))
+        weights[command] = float(weight)
+    return weights
+
+
+class WorkloadGenerator(object):
+    """
+    Seeded generator of parking lot commands
+
+    The generator plays the commands against a MemoryParkingLot, so that leaves mostly target occupied slots and
+    lookups mostly target parked vehicles, like they do at a real gate.
+    """
+
+    def __init__(self, number_of_slots, mix=None, seed=0):
+        self.number_of_slots = number_of_slots
+        self.random = random.Random(seed)
+        self.lot = MemoryParkingLot()
+        self.commands, weights = zip(*sorted((mix or DEFAULT_MIX).items()))
+        total = float(sum(weights))
+        self.cumulative_weights = [sum(weights[:index+1])/total for index in xrange(len(weights))]
+
+    def _weighted_choice(self, choices):
+        point = self.random.uniform(0, sum(weight for _, weight in choices))
+        for choice, weight in choices:
+            point -= weight
+            if point <= 0:
+                return choice
+        return choices[-1][0]
+
+    def registration_number(self):
+        return '{}-{:02d}-{}{}-{:04d}'.format(
+            self._weighted_choice(STATE_CODES),
+            self.random.randint(1, 99),
+            chr(self.random.randint(65, 90)),
+            chr(self.random.randint(65, 90)),
+            self.random.randint(1, 9999),
+        )
+
+    def colour(self):
+        return self._weighted_choice(COLOURS)
+
+    def _parked_registration_number(self):
+        if self.lot.parkings and self.random.random() >= MISS_RATIO:
+            return self.lot.parkings[self._occupied_slot()][0]
+        return self.registration_number()
+
+    def _occupied_slot(self):
+        # Rejection sampling, parked slots are found quickly unless the lot is nearly empty
+        for _ in xrange(32):
+            slot_id = self.random.randint(1, self.number_of_slots)
+            if slot_id in self.lot.parkings:
+                return slot_id
+        return next(iter(self.lot.parkings))
+
+    def command(self):
+        """
+        Generates the next command
+
+        Returns:
+        string: The command line
+        """
+        point = self.random.random()
+        command = next(command for command, weight in zip(self.commands, self.cumulative_weights) if point <= weight)
+
+        if command == 'park':
+            registration_number, colour = self.registration_number(), self.colour()
+            self.lot.park_vehicle(registration_number, colour)
+            return 'park {} {}'.format(registration_number, colour)
+        elif command == 'leave':
+            slot_id = self._occupied_slot() if self.lot.parkings else self.random.randint(1, self.number_of_slots)
+            self.lot.unpark_vehicle(slot_id)
+            return 'leave {}'.format(slot_id)
+        elif command == 'slot_number_for_registration_number':
+            return '{} {}'.format(command, self._parked_registration_number())
+        elif command in ['registration_numbers_for_cars_with_colour', 'slot_numbers_for_cars_with_colour']:
+            return '{} {}'.format(command, self.colour())
+        return command
+
+    def setup(self, occupancy=0.5):
+        """
+        Generates the set up of a workload: the parking lot creation and parks up to the initial occupancy
+
+        Parameters:
+        occupancy (float): The share of slots occupied before the command mix starts
+
+        Returns:
+        generator: The command lines
+        """
+        self.lot.create_parking_lot(self.number_of_slots)
+        yield 'create_parking_lot {}'.format(self.number_of_slots)
+
+        for _ in xrange(int(self.number_of_slots*occupancy)):
+            registration_number, colour = self.registration_number(), self.colour()
+            self.lot.park_vehicle(registration_number, colour)
+            yield 'park {} {}'.format(registration_number, colour)
+
+    def generate(self, number_of_commands):
+        """
+        Generates the command mix, to be run after the set up
+
+        Parameters:
+        number_of_commands (int): The number of commands
+
+        Returns:
+        generator: The command lines
+        """
+        for _ in xrange(number_of_commands):
+            yield self.command()
@@ -9,3 +9,54 @@ class Config(object):
     # SQL Alchemy settings
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(BASEDIR, APP_DB)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Milliseconds a SQLite write waits for the write lock held by another process
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 30000)
+    # Pragmas of every SQLite connection: memory-mapped reads, a page cache of 32 MiB (negative sizes are in KiB) and
+    # temporary tables in memory
+    SQLITE_PRAGMAS = {
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE') or 256*1024*1024),
+        'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE') or -32*1024),
+        'temp_store': 'MEMORY',
+    }
+    # Durability levels of SQLite, all of them in WAL mode so that the readers do not block the writer:
+    # - strict: every commit is synced, a committed command survives a power loss
+    # - batched: the WAL is synced at checkpoints, a power loss can lose the last commits but the database stays
+    #   consistent. With the journal (PARKING_LOT_JOURNAL), the lost commands are replayed by the recovery.
+    # - volatile: nothing is synced, the database survives a crash of the process but not of the system
+    SQLITE_DURABILITY_LEVELS = {
+        'strict': {'journal_mode': 'WAL', 'synchronous': 'FULL'},
+        'batched': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'},
+        'volatile': {'journal_mode': 'WAL', 'synchronous': 'OFF'},
+    }
+    SQLITE_DURABILITY = os.environ.get('SQLITE_DURABILITY') or 'strict'
+
+    # Storage backend of the parking lot: 'sql' (SQL Alchemy models) or 'memory' (app.memory.MemoryParkingLot)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND') or 'sql'
+
+    # Unix socket of the resident daemon (flask run-parking-lot-daemon), used by bin/parking_lot when it is listening
+    DAEMON_SOCKET = os.environ.get('PARKING_LOT_SOCKET') or os.path.join(BASEDIR, 'parking_lot.sock')
+
+    # Snapshot file of the parking lot (flask snapshot-parking-lot), the gate server answers reads from it while it starts
+    SNAPSHOT_PATH = os.environ.get('PARKING_LOT_SNAPSHOT') or os.path.join(BASEDIR, 'parking_lot.snapshot')
+
+    # Journal of the write commands, disabled if not set. fsync is grouped by JOURNAL_GROUP_SIZE commands (and done at
+    # the end of every batch transaction), a checkpoint is written every JOURNAL_CHECKPOINT_INTERVAL commands.
+    JOURNAL_PATH = os.environ.get('PARKING_LOT_JOURNAL')
+    JOURNAL_GROUP_SIZE = int(os.environ.get('JOURNAL_GROUP_SIZE') or 64)
+    JOURNAL_CHECKPOINT_INTERVAL = int(os.environ.get('JOURNAL_CHECKPOINT_INTERVAL') or 100000)
+
+    # Databases of the shards of `flask run-sharded-parking-lot`, formatted with the shard number
+    SHARD_DATABASE_URI = os.environ.get('SHARD_DATABASE_URL') or 'sqlite:///' + os.path.join(BASEDIR, 'parking_lot_shard{shard}.db')
+
+    # Databases of the runs of `flask simulate`, one temporary file per run in this directory (e.g. /dev/shm, a tmpfs),
+    # in-memory SQLite databases if not set
+    SIMULATION_DATABASE_DIR = os.environ.get('SIMULATION_DATABASE_DIR')
+
+    # Per-command latency and SQL query instrumentation, reported by the `stats` command
+    INSTRUMENTATION = bool(os.environ.get('INSTRUMENTATION'))
+
+    # Tariff of the billing report (flask billing-report), in cents: parkings up to TARIFF_FREE_MINUTES are free, the
+    # others pay TARIFF_HOURLY_RATE per started hour, at most TARIFF_DAILY_MAXIMUM per started day
+    TARIFF_FREE_MINUTES = int(os.environ.get('TARIFF_FREE_MINUTES') or 15)
+    TARIFF_HOURLY_RATE = int(os.environ.get('TARIFF_HOURLY_RATE') or 200)
+    TARIFF_DAILY_MAXIMUM = int(os.environ.get('TARIFF_DAILY_MAXIMUM') or 2000)
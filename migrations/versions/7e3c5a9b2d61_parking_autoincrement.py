@@ -0,0 +1,45 @@
+"""Parking ids never reused (AUTOINCREMENT)
+
+Revision ID: 7e3c5a9b2d61
+Revises: 2f6b8a1d4c93
+Create Date: 2026-10-19 09:12:44.318506
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e3c5a9b2d61'
+down_revision = '2f6b8a1d4c93'
+branch_labels = None
+depends_on = None
+
+PARTIAL_INDEXES = [
+    ('ix_parking_active_registration_number', ['lot_id', 'registration_number'], True),
+    ('ix_parking_active_slot_id', ['lot_id', 'slot_id'], True),
+    ('ix_parking_active_reversed_registration_number', ['lot_id', 'reversed_registration_number'], False),
+]
+
+
+def recreate_parking(autoincrement):
+    # The table is copied, the partial indexes are created again afterwards as their condition is not carried over by
+    # the copy
+    for name, _, _ in PARTIAL_INDEXES:
+        op.drop_index(name, table_name='parking')
+    with op.batch_alter_table('parking', recreate='always', table_kwargs={'sqlite_autoincrement': autoincrement}):
+        pass
+    for name, columns, unique in PARTIAL_INDEXES:
+        op.create_index(name, 'parking', columns, unique=unique, sqlite_where=sa.text(u'active = 1'))
+
+
+def upgrade():
+    recreate_parking(True)
+    # The next id follows those of the parking history as well, some of which may have been reused already
+    op.execute('DELETE FROM sqlite_sequence WHERE name = \'parking\'')
+    op.execute('INSERT INTO sqlite_sequence (name, seq) SELECT \'parking\', max(coalesce((SELECT max(id) FROM parking), 0), '
+               'coalesce((SELECT max(id) FROM parking_history), 0))')
+
+
+def downgrade():
+    recreate_parking(False)
@@ -0,0 +1,117 @@
+"""Lot id of the slots and the parkings
+
+Revision ID: c3f1b7e2d9a4
+Revises: a557e816aff5
+Create Date: 2026-10-18 23:12:40.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1b7e2d9a4'
+down_revision = 'a557e816aff5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The existing slots and parkings are those of the default lot
+    op.execute('INSERT INTO lot (id, generation) SELECT 1, 0 WHERE NOT EXISTS (SELECT 1 FROM lot WHERE id = 1)')
+
+    # SQLite cannot change a primary key or a foreign key in place: the tables are copied to new ones
+    op.create_table('_slot',
+    sa.Column('lot_id', sa.Integer(), server_default=sa.text('1'), nullable=False),
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('active', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['lot_id'], ['lot.id'], ),
+    sa.PrimaryKeyConstraint('lot_id', 'id')
+    )
+    op.execute('INSERT INTO _slot (lot_id, id, active) SELECT 1, id, active FROM slot')
+
+    op.create_table('_parking',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('lot_id', sa.Integer(), server_default=sa.text('1'), nullable=False),
+    sa.Column('slot_id', sa.Integer(), nullable=False),
+    sa.Column('registration_number', sa.String(length=20), nullable=False),
+    sa.Column('colour', sa.String(length=15), nullable=False),
+    sa.Column('colour_key', sa.String(length=15), nullable=False),
+    sa.Column('active', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['lot_id', 'slot_id'], ['slot.lot_id', 'slot.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO _parking (id, lot_id, slot_id, registration_number, colour, colour_key, active) '
+               'SELECT id, 1, slot_id, registration_number, colour, colour_key, active FROM parking')
+
+    op.create_table('_parking_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('lot_id', sa.Integer(), server_default=sa.text('1'), nullable=False),
+    sa.Column('slot_id', sa.Integer(), nullable=False),
+    sa.Column('registration_number', sa.String(length=20), nullable=False),
+    sa.Column('colour', sa.String(length=15), nullable=False),
+    sa.Column('colour_key', sa.String(length=15), nullable=False),
+    sa.ForeignKeyConstraint(['lot_id', 'slot_id'], ['slot.lot_id', 'slot.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO _parking_history (id, lot_id, slot_id, registration_number, colour, colour_key) '
+               'SELECT id, 1, slot_id, registration_number, colour, colour_key FROM parking_history')
+
+    # The indexes of the parking table go with it
+    op.drop_table('parking_history')
+    op.drop_table('parking')
+    op.drop_table('slot')
+    op.rename_table('_slot', 'slot')
+    op.rename_table('_parking', 'parking')
+    op.rename_table('_parking_history', 'parking_history')
+
+    op.create_index('ix_parking_active_colour_key_slot_id', 'parking', ['active', 'lot_id', 'colour_key', 'slot_id'], unique=False)
+    op.create_index('ix_parking_active_registration_number', 'parking', ['lot_id', 'registration_number'], unique=True, sqlite_where=sa.text(u'active = 1'))
+    op.create_index('ix_parking_active_slot_id', 'parking', ['lot_id', 'slot_id'], unique=True, sqlite_where=sa.text(u'active = 1'))
+
+
+def downgrade():
+    # Only the default lot is kept
+    op.create_table('_slot',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('active', sa.Boolean(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO _slot (id, active) SELECT id, active FROM slot WHERE lot_id = 1')
+
+    op.create_table('_parking',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('slot_id', sa.Integer(), nullable=False),
+    sa.Column('registration_number', sa.String(length=20), nullable=False),
+    sa.Column('colour', sa.String(length=15), nullable=False),
+    sa.Column('active', sa.Boolean(), nullable=False),
+    sa.Column('colour_key', sa.String(length=15), server_default='', nullable=False),
+    sa.ForeignKeyConstraint(['slot_id'], ['slot.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO _parking (id, slot_id, registration_number, colour, active, colour_key) '
+               'SELECT id, slot_id, registration_number, colour, active, colour_key FROM parking WHERE lot_id = 1')
+
+    op.create_table('_parking_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('slot_id', sa.Integer(), nullable=False),
+    sa.Column('registration_number', sa.String(length=20), nullable=False),
+    sa.Column('colour', sa.String(length=15), nullable=False),
+    sa.Column('colour_key', sa.String(length=15), nullable=False),
+    sa.ForeignKeyConstraint(['slot_id'], ['slot.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO _parking_history (id, slot_id, registration_number, colour, colour_key) '
+               'SELECT id, slot_id, registration_number, colour, colour_key FROM parking_history WHERE lot_id = 1')
+
+    op.drop_table('parking_history')
+    op.drop_table('parking')
+    op.drop_table('slot')
+    op.rename_table('_slot', 'slot')
+    op.rename_table('_parking', 'parking')
+    op.rename_table('_parking_history', 'parking_history')
+    op.execute('DELETE FROM lot WHERE id != 1')
+
+    op.create_index('ix_parking_active_colour_key_slot_id', 'parking', ['active', 'colour_key', 'slot_id'], unique=False)
+    op.create_index('ix_parking_active_registration_number', 'parking', ['registration_number'], unique=True, sqlite_where=sa.text(u'active = 1'))
+    op.create_index('ix_parking_active_slot_id', 'parking', ['slot_id'], unique=True, sqlite_where=sa.text(u'active = 1'))